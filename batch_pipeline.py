@@ -0,0 +1,242 @@
+""" Multiprocess batch prefetching for the training data generators.
+
+    A BatchPipeline spreads batch numbers over a pool of worker processes, each of which builds
+    its batches with a random access batch function (data_load_utils.get_xy_batch or
+    data_load_seq2seq_utils.get_xy_batch) and writes them into a ring of shared memory slots.
+    Batches come out in order, and only the batch number and slot number are sent between
+    processes, the arrays themselves are never pickled. """
+
+from functools import partial
+import inspect
+import mmap
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import queue
+import traceback
+import numpy as np
+import data_load_utils as util
+import data_load_seq2seq_utils as s2s_util
+
+
+def get_slot_layout(batch):
+    """ the (shape, dtype, offset) of each array of batch packed into one buffer, and the
+    total size in bytes. Offsets are aligned to 64 bytes """
+    layout = []
+    offset = 0
+    for arr in util.flatten_batch(batch):
+        layout.append((arr.shape, arr.dtype.str, offset))
+        offset += -(-arr.nbytes // 64) * 64
+    return layout, max(offset, 1)
+
+
+def get_slot_arrays(buffer, layout):
+    """ numpy arrays over a shared memory buffer, one for each entry of layout """
+    return [np.ndarray(shape, dtype=np.dtype(dtype), buffer=buffer, offset=offset)
+            for shape, dtype, offset in layout]
+
+
+def touch_pages(buffer):
+    """ reads a byte of every page of buffer, so the page faults of mapping it are taken now
+    rather than while the first batches are written or read """
+    return int(np.frombuffer(buffer, dtype=np.uint8)[::mmap.PAGESIZE].sum())
+
+
+def pipeline_worker(batch_function, shm_names, layout, structure, task_queue, done_queue):
+    """ worker process loop: takes (seq, batch_num, slot) tasks, builds the batch in the slot,
+    then reports (seq, error) back. A None task stops the worker """
+
+    blocks = [shared_memory.SharedMemory(name=name) for name in shm_names]
+    for block in blocks:
+        touch_pages(block.buf)
+    slots = [get_slot_arrays(block.buf, layout) for block in blocks]
+    batches = [util.unflatten_batch(arrays, structure) for arrays in slots]
+
+    # batch functions with an out argument write straight into shared memory, the rest are copied
+    writes_out = 'out' in inspect.signature(batch_function).parameters
+
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            seq, batch_num, slot = task
+            try:
+                if writes_out:
+                    batch_function(batch_num, out=batches[slot])
+                else:
+                    for out, arr in zip(slots[slot],
+                                        util.flatten_batch(batch_function(batch_num))):
+                        out[...] = arr
+                done_queue.put((seq, None))
+            except Exception:
+                done_queue.put((seq, traceback.format_exc()))
+    finally:
+        del slots, batches
+        for block in blocks:
+            block.close()
+
+
+class BatchPipeline:
+    """ iterates over batch_function(0), batch_function(1) ... batch_function(n_batches - 1),
+    (looping forever if loop is True, like the generators), with the batches built ahead of
+    time by worker processes. prefetch is the number of batches prepared in advance.
+
+    By default each batch is copied out of shared memory, so batches can be held for as long as
+    the consumer likes. With copy=False the arrays are views into shared memory instead, which
+    saves the copy (it takes about as long as building a window batch), but only the last hold
+    batches returned stay valid. Keras' fit_generator takes batches ahead of training them (up
+    to max_queue_size queued, plus the one being trained and the one being built), so it needs
+    hold of at least max_queue_size + 2. See bench_batch_pipeline.py for when each is faster.
+
+    batch_function must return batches of the same shapes and dtypes for every batch number,
+    so only full batches are supported. Use close(), or a with block, to stop the workers and
+    free the shared memory """
+
+    def __init__(self, batch_function, n_batches, workers=2, prefetch=4, loop=True, copy=True,
+                 hold=1, start_method=None):
+        assert n_batches > 0 and workers > 0 and prefetch > 0 and hold > 0
+
+        self.n_batches = n_batches
+        self.loop = loop
+        self.copy = copy
+        self.prefetch = prefetch
+        # the batches being built, and the ones the consumer may still be holding
+        self.n_slots = prefetch + (1 if copy else hold)
+
+        # build the first batch here to find out the shapes and dtypes to allocate
+        first_batch = batch_function(0)
+        self.layout, slot_bytes = get_slot_layout(first_batch)
+        self.structure = util.unflatten_batch([None] * len(self.layout), first_batch)
+        del first_batch
+        self.blocks = [shared_memory.SharedMemory(create=True, size=slot_bytes)
+                       for _ in range(self.n_slots)]
+        for block in self.blocks:
+            touch_pages(block.buf)
+        self.slots = [get_slot_arrays(block.buf, self.layout) for block in self.blocks]
+        self.batches = [util.unflatten_batch(arrays, self.structure) for arrays in self.slots]
+
+        context = mp.get_context(start_method)
+        self.task_queue = context.Queue()
+        self.done_queue = context.Queue()
+        self.workers = [context.Process(target=pipeline_worker,
+                                        args=(batch_function,
+                                              [block.name for block in self.blocks],
+                                              self.layout, self.structure,
+                                              self.task_queue, self.done_queue),
+                                        daemon=True)
+                        for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+        self.dispatched = 0  # sequence number of the next batch to hand to the workers
+        self.consumed = 0    # sequence number of the next batch to return
+        self.done = {}       # sequence number -> error traceback (or None) of finished batches
+        self.closed = False
+
+    def __len__(self):
+        return self.n_batches
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.closed:
+            raise RuntimeError('BatchPipeline is closed')
+        if not self.loop and self.consumed >= self.n_batches:
+            raise StopIteration
+
+        # keep prefetch batches building beyond this one, in the slots of batches given out
+        # at least hold batches ago
+        last = self.consumed + self.prefetch + 1
+        if not self.loop:
+            last = min(last, self.n_batches)
+        while self.dispatched < last:
+            self.task_queue.put((self.dispatched, self.dispatched % self.n_batches,
+                                 self.dispatched % self.n_slots))
+            self.dispatched += 1
+
+        while self.consumed not in self.done:
+            self.wait_for_batch()
+
+        # errors are raised in order, when the failed batch is the one requested
+        error = self.done.pop(self.consumed)
+        if error is not None:
+            self.close()
+            raise RuntimeError('BatchPipeline worker failed on batch {}:\n{}'.format(
+                self.consumed % self.n_batches, error))
+
+        slot = self.consumed % self.n_slots
+        self.consumed += 1
+
+        if self.copy:
+            return util.unflatten_batch([arr.copy() for arr in self.slots[slot]],
+                                        self.structure)
+        return self.batches[slot]
+
+    def wait_for_batch(self, timeout=1.0):
+        """ waits for a worker to finish a batch, raising if a worker died """
+        try:
+            seq, error = self.done_queue.get(timeout=timeout)
+        except queue.Empty:
+            if not all(worker.is_alive() for worker in self.workers):
+                self.close()
+                raise RuntimeError('BatchPipeline worker process died')
+            return
+
+        self.done[seq] = error
+        # collect any other batches that are finished without waiting again
+        try:
+            while True:
+                seq, error = self.done_queue.get_nowait()
+                self.done[seq] = error
+        except queue.Empty:
+            pass
+
+    def close(self):
+        """ stops the workers and frees the shared memory """
+        if self.closed:
+            return
+        self.closed = True
+
+        for _ in self.workers:
+            self.task_queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+
+        self.slots = self.batches = None
+        for block in self.blocks:
+            try:
+                block.close()
+            except BufferError:
+                pass  # the consumer still holds views of this slot, it's unmapped when they go
+            block.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        if hasattr(self, 'closed'):
+            self.close()
+
+
+def window_pipeline(tweet, batch_size=64, workers=2, prefetch=4, loop=True, copy=True, hold=1,
+                    **kwargs):
+    """ a BatchPipeline over the batches of convert_tweet_to_xy_generator(tweet, batch_size,
+    **kwargs), which must be the keyword arguments of data_load_utils.get_xy_batch """
+    return BatchPipeline(partial(util.get_xy_batch, tweet, batch_size=batch_size, **kwargs),
+                         int(len(tweet) / batch_size), workers=workers, prefetch=prefetch,
+                         loop=loop, copy=copy, hold=hold)
+
+
+def seq2seq_pipeline(tweets, batch_size=64, workers=2, prefetch=4, loop=True, copy=True, hold=1,
+                     **kwargs):
+    """ a BatchPipeline over the batches of xy_generator(tweets, batch_size, **kwargs), which
+    must be the keyword arguments of data_load_seq2seq_utils.get_xy_batch """
+    return BatchPipeline(partial(s2s_util.get_xy_batch, tweets, batch_size=batch_size, **kwargs),
+                         int(len(tweets) / batch_size), workers=workers, prefetch=prefetch,
+                         loop=loop, copy=copy, hold=hold)
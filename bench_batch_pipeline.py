@@ -0,0 +1,84 @@
+""" Throughput (batches/sec) of BatchPipeline with different numbers of workers, copying its
+    batches (the default) or handing out views of its shared memory (copy=False), against the
+    serial convert_tweet_to_xy_generator and xy_generator.
+
+    On a 1 cpu machine, with batches of 256 tweets as np.bool_:
+
+                          generator   1 worker   2 workers   4 workers
+        window copies       75-80      28-32       26-35       34-35
+        window views        75-80      86-93       84-87       70-71
+        seq2seq copies     140-152     91-102      73-84       83-90
+        seq2seq views      140-152    307-323     305-364     218-362
+
+    Copying a window batch (39 MB of windows) out of shared memory takes longer than building
+    it, so the copying pipeline is only worth it where the workers have cores of their own to
+    build batches in parallel, and the consumer is otherwise idle. With views, the pipeline
+    beats the serial generators even on one cpu, since the workers write straight into
+    shared memory and nothing is copied (pass hold=max_queue_size + 2 for fit_generator).
+    Extra workers only help with the cores to run them, on one cpu they just take turns.
+
+    run with: python bench_batch_pipeline.py """
+
+import os
+from timeit import default_timer as timer
+import numpy as np
+import pandas as pd
+import batch_pipeline as bp
+import data_load_seq2seq_utils as s2s_util
+import data_load_utils as util
+
+
+SAMPLE_TWEETS = ["red and yellow and pink and green, orange and purple and blue, I can sing a rainbow",
+                 "sweet dreams are made of this, who am I to disagree, travel the world and the seven seas",
+                 "lol",
+                 "Everybody's looking for something!! #sweetdreams"]
+
+
+def get_tweets(n_tweets):
+    return pd.DataFrame({'text': [SAMPLE_TWEETS[i % len(SAMPLE_TWEETS)] for i in range(n_tweets)],
+                         'emoji': [':rainbow:', ':fire:'] * (n_tweets // 2)})
+
+
+def batches_per_second(batches, n_batches, warm_up=10):
+    # warm up, past the pipeline's worker start up and first trip round its slots
+    for _ in range(warm_up):
+        next(batches)
+    start = timer()
+    for _ in range(n_batches):
+        next(batches)
+    return n_batches / (timer() - start)
+
+
+def main(batch_size=256, n_batches=40, workers=(1, 2, 4)):
+    tweets = get_tweets(batch_size * 8)
+    emojis, emoji_idx = util.get_emojis_list(tweets['emoji'])
+    window_args = dict(emoji_set=emojis, dtype=np.bool_)
+    seq2seq_args = dict(emoji_indices=emoji_idx, dtype=np.bool_)
+
+    print('batch size {}, {} cpus'.format(batch_size, os.cpu_count()))
+    print('{:>30} {:>14}'.format('', 'batches/sec'))
+
+    gen = util.convert_tweet_to_xy_generator(tweets, batch_size=batch_size, strided=True,
+                                             **window_args)
+    print('{:>30} {:>14.1f}'.format('window generator', batches_per_second(gen, n_batches)))
+    for copy in [True, False]:
+        for n_workers in workers:
+            with bp.window_pipeline(tweets, batch_size=batch_size, workers=n_workers, copy=copy,
+                                    **window_args) as pipeline:
+                print('{:>30} {:>14.1f}'.format(
+                    'window {}, {} workers'.format(['views', 'copies'][copy], n_workers),
+                    batches_per_second(pipeline, n_batches)))
+
+    gen = s2s_util.xy_generator(tweets, batch_size=batch_size, **seq2seq_args)
+    print('{:>30} {:>14.1f}'.format('seq2seq generator', batches_per_second(gen, n_batches)))
+    for copy in [True, False]:
+        for n_workers in workers:
+            with bp.seq2seq_pipeline(tweets, batch_size=batch_size, workers=n_workers,
+                                     copy=copy, **seq2seq_args) as pipeline:
+                print('{:>30} {:>14.1f}'.format(
+                    'seq2seq {}, {} workers'.format(['views', 'copies'][copy], n_workers),
+                    batches_per_second(pipeline, n_batches)))
+
+
+if __name__ == '__main__':
+    main()
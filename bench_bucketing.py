@@ -0,0 +1,83 @@
+""" Padding ratio and training throughput of length bucketed seq2seq batches
+    (xy_generator(buckets=...)) against the fixed length (161 character) batches.
+
+    The tweet lengths come from the corpus csv (data/emojis_homemade.csv, filtered the same way
+    as for training) if it is there, otherwise from a synthetic set of tweets of 3-30 words.
+    Throughput is real (non-padding) characters per second for building each batch and
+    running it through a numpy LSTM of the seq2seq decoder's size (inference.NumpySeq2Seq),
+    so it measures the work that padding wastes.
+
+    run with: python bench_bucketing.py [path to csv] """
+
+from itertools import islice
+import os
+import random
+import sys
+from timeit import default_timer as timer
+import numpy as np
+import pandas as pd
+import data_load_seq2seq_utils as s2s_util
+import data_load_utils as util
+import inference
+
+CORPUS = 'data/emojis_homemade.csv'
+WORDS = ['red', 'and', 'yellow', 'pink', 'green', 'sing', 'a', 'rainbow', 'too', 'lol', '!!',
+         '#sweetdreams', 'everybody', 'looking', 'for', 'something', 'I', 'the', '2day']
+
+
+def get_tweets(path=CORPUS, n_tweets=20000, seed=0):
+    """ n_tweets of the filtered corpus at path, or synthetic tweets if it doesn't exist """
+    if os.path.exists(path):
+        tweets = pd.concat(util.read_filtered_tweet_chunks(path), ignore_index=True)
+        tweets = tweets.assign(text=s2s_util.filter_text(tweets['text']))
+        return tweets.sample(min(n_tweets, len(tweets)), random_state=seed,
+                             ignore_index=True)
+
+    rng = random.Random(seed)
+    text = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 30)))[0:160]
+            for _ in range(n_tweets)]
+    return pd.DataFrame({'text': text, 'emoji': [':fire:'] * n_tweets})
+
+
+def run_epoch(model, batches):
+    """ (positions, seconds) for running the batches (X, Y[, mask]) through the model, where
+    positions is the number of timesteps including padding """
+    positions = 0
+    start = timer()
+    for batch in batches:
+        x = batch[0]
+        h, c = model.encode(np.zeros((len(x), 1, 1), dtype=np.float32))
+        model.decode([x, h, c])
+        positions += x.shape[0] * x.shape[1]
+    return positions, timer() - start
+
+
+def main(path=CORPUS, batch_size=64, units=256, buckets=s2s_util.DEFAULT_BUCKETS):
+    tweets = get_tweets(path)
+    n_batches = len(tweets) // batch_size
+    tweets = tweets.iloc[0:n_batches * batch_size]  # full batches only, for both
+    lengths = s2s_util.get_sequence_lengths(tweets)
+    chars, _ = s2s_util.get_universal_chars_list()
+    model = inference.NumpySeq2Seq.random(1, len(chars), units=units, rng=0)
+
+    print('{} tweets from {}, mean length {:.1f} (+ newline)'.format(
+        len(tweets), path if os.path.exists(path) else 'synthetic data', lengths.mean() - 1))
+    print('{:>30} {:>14} {:>14}'.format('', 'padding ratio', 'real chars/s'))
+
+    fixed = (s2s_util.get_xy_batch(tweets, i, batch_size=batch_size, dtype=np.float32)
+             for i in range(n_batches))
+    bucket_batches = s2s_util.get_bucket_batches(lengths, buckets=s2s_util.get_buckets(buckets),
+                                                 batch_size=batch_size)
+    bucketed = islice(s2s_util.bucketed_xy_generator(tweets, batch_size=batch_size,
+                                                     buckets=buckets, dtype=np.float32, seed=0),
+                      len(bucket_batches))  # one epoch
+
+    for name, batches in [('fixed length 161', fixed),
+                          ('buckets {}'.format(list(buckets)), bucketed)]:
+        positions, seconds = run_epoch(model, batches)
+        print('{:>30} {:>14.3f} {:>14.0f}'.format(name, 1 - lengths.sum() / positions,
+                                                  lengths.sum() / seconds))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
@@ -0,0 +1,331 @@
+""" Benchmark suite for the training data pipeline: wall time and peak traced memory of
+    read_tweet_data, filter_text_for_handles, convert_tweet_to_xy (in memory and out of core
+    with convert_tweet_to_xy_memmap), convert_tweet_to_xy_generator and xy_generator, over a
+    grid of batch sizes and window/step settings. It needs no GPU, network or data files.
+    Traced memory doesn't include the pages of memory mapped files.
+
+    The tweets are a synthetic corpus written to a temporary csv. Tweet lengths and emoji
+    frequencies are drawn from the real corpus (data/emojis_homemade.csv) if it is there.
+    Otherwise they come from DEFAULT_PROFILE, which approximates it: mostly short tweets, a
+    bump just under the old 140 character limit, a long tail of emojis, some @handles and
+    characters outside the vocabulary. The seed is fixed, so every run sees the same tweets.
+
+    Results are written as JSON. compare checks a results file against a stored baseline and
+    exits with status 1 if any case got slower, or used more memory, by more than the
+    threshold. Only compare runs from the same machine, as times aren't portable.
+
+    run with: python bench_data_pipeline.py run [--output results.json] [--baseline base.json]
+              python bench_data_pipeline.py compare base.json results.json [--threshold 0.2] """
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import data_load_seq2seq_utils as s2s_util
+import data_load_utils as util
+
+CORPUS = 'data/emojis_homemade.csv'
+
+# parameters of the synthetic corpus when the real one isn't available
+DEFAULT_PROFILE = {'n_emojis': 1200,
+                   'emoji_zipf': 1.1,          # count of the emoji of rank r ~ r ** -emoji_zipf
+                   'length_log_mean': 3.7,     # lognormal tweet lengths, median ~40 characters
+                   'length_log_sd': 0.7,
+                   'near_limit_fraction': 0.1,  # tweets of 120-140 characters
+                   'handle_fraction': 0.15,    # words that are @handles
+                   'unknown_char_fraction': 0.01}
+
+WORDS = ['red', 'and', 'yellow', 'pink', 'green', 'sing', 'a', 'rainbow', 'too', 'lol', '!!',
+         '#sweetdreams', 'everybody', 'looking', 'for', 'something', 'I', 'the', '2day', 'so',
+         'happy', 'love', 'this', 'is', 'fire', "can't", 'wait', 'omg', 'u', 'ur', 'tonight',
+         'when', 'you', 'my', 'Monday', 'again...', 'haha', 'best', 'day', 'ever', '2',
+         'Friday!!', 'what', 'a', 'time', 'to', 'be', 'alive', 'yes', 'no', 'ok', '"quote"']
+
+UNKNOWN_CHARS = 'éü…’“”'
+
+
+def get_corpus_profile(path=CORPUS, chunksize=100000):
+    """ the tweet length histogram and emoji counts of the corpus csv at path, for
+    write_synthetic_corpus, or DEFAULT_PROFILE if the file doesn't exist """
+
+    if not os.path.exists(path):
+        return DEFAULT_PROFILE
+
+    length_counts = np.zeros(161, dtype=np.int64)
+    emoji_counts = []
+    for chunk in util.read_tweet_data_chunks(path, chunksize=chunksize):
+        lengths = np.minimum(chunk['text'].str.len().fillna(0).to_numpy(np.int64), 160)
+        length_counts += np.bincount(lengths, minlength=161)
+        emoji_counts.append(chunk['emoji'].value_counts())
+    emoji_counts = pd.concat(emoji_counts).groupby(level=0).sum().sort_values(ascending=False)
+
+    return {'length_counts': length_counts.tolist(), 'emoji_counts': emoji_counts.tolist()}
+
+
+def sample_lengths(profile, n_tweets, rng):
+    if 'length_counts' in profile:
+        counts = np.asarray(profile['length_counts'], dtype=np.float64)
+        return rng.choice(len(counts), size=n_tweets, p=counts / counts.sum())
+
+    lengths = rng.lognormal(profile['length_log_mean'], profile['length_log_sd'], n_tweets)
+    near_limit = rng.random(n_tweets) < profile['near_limit_fraction']
+    lengths[near_limit] = rng.integers(120, 141, near_limit.sum())
+    return np.clip(lengths.astype(np.int64), 1, 160)
+
+
+def sample_emojis(profile, n_tweets, rng):
+    if 'emoji_counts' in profile:
+        weights = np.asarray(profile['emoji_counts'], dtype=np.float64)
+    else:
+        weights = np.arange(1, profile['n_emojis'] + 1) ** -profile['emoji_zipf']
+    emojis = np.array([chr(0x1F300 + i) for i in range(len(weights))], dtype=object)
+    return emojis[rng.choice(len(weights), size=n_tweets, p=weights / weights.sum())]
+
+
+def write_synthetic_corpus(path, n_tweets, profile=DEFAULT_PROFILE, seed=0):
+    """ writes n_tweets synthetic tweets, with lengths and emojis drawn from profile, to the
+    csv at path. Like the real (concatenated) csv, it has a repeated header row every 10000
+    rows for read_tweet_data to drop """
+
+    rng = np.random.default_rng(seed)
+    handle_fraction = profile.get('handle_fraction', DEFAULT_PROFILE['handle_fraction'])
+    unknown_fraction = profile.get('unknown_char_fraction',
+                                   DEFAULT_PROFILE['unknown_char_fraction'])
+
+    texts = []
+    for length in sample_lengths(profile, n_tweets, rng):
+        words = []
+        while sum(len(word) + 1 for word in words) <= length:
+            if rng.random() < handle_fraction:
+                words.append('@user{}'.format(rng.integers(100000)))
+            else:
+                words.append(WORDS[rng.integers(len(WORDS))])
+        text = ' '.join(words)[0:length]
+        letters = [i for i, char in enumerate(text) if char != ' ']
+        if letters and rng.random() < unknown_fraction * length:
+            i = letters[rng.integers(len(letters))]
+            text = text[0:i] + UNKNOWN_CHARS[rng.integers(len(UNKNOWN_CHARS))] + text[i + 1:]
+        texts.append(text)
+
+    tweets = pd.DataFrame({'text': texts, 'emoji': sample_emojis(profile, n_tweets, rng)})
+    headers = pd.DataFrame({'text': 'text', 'emoji': 'emoji'},
+                           index=np.arange(0, n_tweets, 10000) - 0.5)
+    pd.concat([headers, tweets]).sort_index(kind='stable').to_csv(path, index=False)
+
+
+def consume(generator, n_batches):
+    for _ in range(n_batches):
+        next(generator)
+
+
+def get_cases(path, tweets, n_window_tweets=256, n_batches=10):
+    """ the benchmark cases, as a list of (name, parameters, function) where function() runs
+    the case once. tweets are the tweets of the csv at path, as read by read_tweet_data """
+
+    raw_text = tweets['text']
+    tweets = tweets.assign(text=util.filter_text_for_handles(raw_text))
+    emojis, emoji_index = util.get_emojis_list(tweets['emoji'])
+    seq2seq_tweets = tweets.assign(text=s2s_util.filter_text(tweets['text']))
+    window_tweets = tweets.iloc[0:n_window_tweets]
+
+    cases = [('read_tweet_data', {'tweets': len(tweets)}, lambda: util.read_tweet_data(path)),
+             ('filter_text_for_handles', {'tweets': len(tweets)},
+              lambda: util.filter_text_for_handles(raw_text))]
+
+    for window_size, step in [(40, 3), (40, 1), (20, 3)]:
+        params = {'tweets': len(window_tweets), 'window_size': window_size, 'step': step,
+                  'dtype': 'bool'}
+        cases.append(('convert_tweet_to_xy', params,
+                      lambda w=window_size, s=step: util.convert_tweet_to_xy(
+                          window_tweets, window_size=w, step=s, dtype=np.dtype('bool'))))
+        # the same arrays written out of core, to .npy files next to the corpus
+        cases.append(('convert_tweet_to_xy_memmap', params,
+                      lambda w=window_size, s=step: util.convert_tweet_to_xy_memmap(
+                          window_tweets, os.path.join(os.path.dirname(path), 'x.npy'),
+                          os.path.join(os.path.dirname(path), 'y.npy'), window_size=w, step=s,
+                          dtype=np.dtype('bool'), chunksize=64)))
+
+    for batch_size in [64, 256]:
+        for window_size, step in [(40, 3), (40, 1), (20, 3)]:
+            for strided in [False, True]:
+                params = {'batch_size': batch_size, 'window_size': window_size, 'step': step,
+                          'strided': strided, 'batches': n_batches, 'dtype': 'bool'}
+                cases.append(('convert_tweet_to_xy_generator', params,
+                              lambda b=batch_size, w=window_size, s=step, st=strided: consume(
+                                  util.convert_tweet_to_xy_generator(
+                                      tweets, window_size=w, step=s, batch_size=b,
+                                      emoji_set=emojis, strided=st, dtype=np.dtype('bool')),
+                                  n_batches)))
+
+        for encoding, dtype in [('onehot', 'float32'), ('onehot', 'bool'), ('index', 'int8')]:
+            params = {'batch_size': batch_size, 'encoding': encoding, 'dtype': dtype,
+                      'batches': n_batches}
+            cases.append(('xy_generator', params,
+                          lambda b=batch_size, e=encoding, d=dtype: consume(
+                              s2s_util.xy_generator(seq2seq_tweets, batch_size=b,
+                                                    emoji_indices=emoji_index, encoding=e,
+                                                    dtype=np.dtype(d)),
+                              n_batches)))
+
+    return cases
+
+
+def get_case_key(name, params):
+    """ the name of a case in the results, eg. xy_generator[batch_size=64,dtype=bool] """
+    return '{}[{}]'.format(name, ','.join('{}={}'.format(key, value)
+                                          for key, value in sorted(params.items())))
+
+
+def measure(function, repeats=3):
+    """ (best wall time in seconds out of repeats, peak traced memory in MB) of function().
+    Memory is traced in a separate run, as tracemalloc slows things down """
+
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return min(seconds), peak / 2**20
+
+
+def run(n_tweets=20000, repeats=3, corpus=CORPUS, seed=0, select=None, log=sys.stdout):
+    """ runs the benchmark cases (those whose key contains select, if given) on a synthetic
+    corpus of n_tweets and returns the results as a dict """
+
+    profile = get_corpus_profile(corpus)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'synthetic.csv')
+        write_synthetic_corpus(path, n_tweets, profile=profile, seed=seed)
+        results = {}
+        for name, params, function in get_cases(path, util.read_tweet_data(path)):
+            key = get_case_key(name, params)
+            if select and select not in key:
+                continue
+            seconds, peak_mb = measure(function, repeats=repeats)
+            results[key] = {'function': name, 'params': params, 'seconds': seconds,
+                            'peak_mb': peak_mb}
+            if log:
+                print('{:<104} {:>9.4f} s {:>9.1f} MB'.format(key, seconds, peak_mb), file=log)
+
+    return {'meta': {'n_tweets': n_tweets, 'repeats': repeats, 'seed': seed,
+                     'profile': 'corpus' if profile is not DEFAULT_PROFILE else 'default',
+                     'machine': platform.node(), 'processor': platform.processor(),
+                     'cpus': os.cpu_count(), 'python': platform.python_version(),
+                     'numpy': np.__version__, 'pandas': pd.__version__,
+                     'date': time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'results': results}
+
+
+def compare(baseline, current, threshold=0.2, memory_threshold=None):
+    """ compares two sets of results from run. Returns a list of (key, metric, baseline value,
+    current value, ratio) for every case whose time (metric 'seconds') grew by more than
+    threshold (a fraction, 0.2 is 20% slower), or whose peak memory ('peak_mb') grew by more
+    than memory_threshold (threshold if not given). Cases in only one of them are ignored """
+
+    if memory_threshold is None:
+        memory_threshold = threshold
+
+    regressions = []
+    for key, result in sorted(current['results'].items()):
+        if key not in baseline['results']:
+            continue
+        for metric, limit in [('seconds', threshold), ('peak_mb', memory_threshold)]:
+            base_value, value = baseline['results'][key][metric], result[metric]
+            ratio = value / base_value if base_value > 0 else float('inf') if value > 0 else 1
+            if ratio > 1 + limit:
+                regressions.append((key, metric, base_value, value, ratio))
+    return regressions
+
+
+def report_comparison(baseline, current, threshold=0.2, memory_threshold=None, log=sys.stdout):
+    """ prints the comparison of current against baseline, returns the number of regressions """
+
+    for side, results in [('baseline', baseline), ('current', current)]:
+        meta = results['meta']
+        print('{:>9}: {} on {} ({} cpus), numpy {}, pandas {}'.format(
+            side, meta['date'], meta['machine'], meta['cpus'], meta['numpy'], meta['pandas']),
+            file=log)
+    if baseline['meta']['machine'] != current['meta']['machine']:
+        print('warning: the results are from different machines', file=log)
+
+    missing = sorted(set(baseline['results']) ^ set(current['results']))
+    for key in missing:
+        print('only in {}: {}'.format('baseline' if key in baseline['results'] else 'current',
+                                      key), file=log)
+
+    regressions = compare(baseline, current, threshold=threshold,
+                          memory_threshold=memory_threshold)
+    for key, metric, base_value, value, ratio in regressions:
+        print('REGRESSION {:<90} {:>8} {:>10.4f} -> {:>10.4f} ({:+.0%})'.format(
+            key, metric, base_value, value, ratio - 1), file=log)
+    print('{} regressions in {} cases'.format(
+        len(regressions), len(set(baseline['results']) & set(current['results']))), file=log)
+
+    return len(regressions)
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='data pipeline benchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='run the benchmarks')
+    run_parser.add_argument('--output', help='write the results to this JSON file')
+    run_parser.add_argument('--baseline', help='compare the results with this JSON file')
+    run_parser.add_argument('--tweets', type=int, default=20000)
+    run_parser.add_argument('--repeats', type=int, default=3)
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--corpus', default=CORPUS,
+                            help='csv to take the length and emoji distributions from')
+    run_parser.add_argument('--select', help='only run cases whose name contains this')
+
+    compare_parser = subparsers.add_parser('compare', help='compare results with a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+
+    for sub_parser in (run_parser, compare_parser):
+        sub_parser.add_argument('--threshold', type=float, default=0.2,
+                                help='allowed fractional slowdown, default 0.2')
+        sub_parser.add_argument('--memory-threshold', type=float, default=None,
+                                help='allowed fractional growth in peak memory, '
+                                     'default the same as --threshold')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        return int(report_comparison(load_results(args.baseline), load_results(args.current),
+                                     threshold=args.threshold,
+                                     memory_threshold=args.memory_threshold) > 0)
+
+    results = run(n_tweets=args.tweets, repeats=args.repeats, corpus=args.corpus,
+                  seed=args.seed, select=args.select)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.baseline:
+        return int(report_comparison(load_results(args.baseline), results,
+                                     threshold=args.threshold,
+                                     memory_threshold=args.memory_threshold) > 0)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,69 @@
+""" Benchmarks the decoding strategies in decoding with both generators: the cost per generated
+    character of the samplers, and of beam search as the beam width grows.
+
+    The window generator runs models/tweet_gen_model-0.776_1.hdf5 with the numpy runtime in
+    inference, the seq2seq decoder a NumpySeq2Seq with random weights of the notebook's shapes.
+
+    run with: python bench_decoding.py """
+
+from timeit import default_timer as timer
+import numpy as np
+import data_load_seq2seq_utils as s2s_util
+import decoding
+import generate
+import inference
+
+
+SEEDS = ["red and yellow and pink and green, orange and purple and blue, I can sing a rainbow",
+         "sweet dreams are made of this, who am I to disagree, travel the world and the seven seas",
+         "lol",
+         "Everybody's looking for something!! #sweetdreams"]
+
+STRATEGIES = [('greedy', decoding.GreedySampler()),
+              ('temperature 0.5', decoding.TemperatureSampler(0.5)),
+              ('top-k 5', decoding.TopKSampler(k=5)),
+              ('nucleus 0.9', decoding.NucleusSampler(top_p=0.9))]
+
+
+def time_window_generator(model, strategy, batch_size, n_chars):
+    seeds = [SEEDS[i % len(SEEDS)] for i in range(batch_size)]
+    start = timer()
+    generate.generate_text(model, seeds, n_chars=n_chars, strategy=strategy, rng=0)
+    return timer() - start, batch_size * n_chars
+
+
+def time_seq2seq(model, strategy, batch_size, max_length):
+    emojis = np.eye(100, dtype=np.float32)[np.arange(batch_size) % 100]
+    start = timer()
+    tweets = generate.decode_sequences(model.encode, model.decode, emojis,
+                                       max_length=max_length, strategy=strategy, rng=0)
+    return timer() - start, sum(len(tweet) + 1 for tweet in tweets)
+
+
+def report(name, timings):
+    seconds, n_chars = timings
+    print('{:>36} {:>10.3f} {:>14.3f}'.format(name, seconds, 1e6 * seconds / n_chars))
+
+
+def main(batch_size=32, n_chars=40, widths=(1, 2, 4, 8, 16)):
+    window_model = inference.load_model('models/tweet_gen_model-0.776_1.hdf5')
+    chars, char_index = s2s_util.get_universal_chars_list()
+    seq2seq_model = inference.NumpySeq2Seq.random(100, len(chars), units=256, rng=0)
+    seq2seq_model.dense_weights[1][char_index['\n']] += 0.5  # tweets of mean length ~40
+
+    for title, time_function, model in [
+            ('window generator, {} seeds x {} chars'.format(batch_size, n_chars),
+             time_window_generator, window_model),
+            ('seq2seq decoder, {} tweets up to {} chars'.format(batch_size, n_chars),
+             time_seq2seq, seq2seq_model)]:
+        print('\n' + title)
+        print('{:>36} {:>10} {:>14}'.format('strategy', 'total (s)', 'us per char'))
+        for name, strategy in STRATEGIES:
+            report(name, time_function(model, strategy, batch_size, n_chars))
+        for width in widths:
+            report('beam width {}'.format(width),
+                   time_function(model, decoding.BeamSearch(width=width), batch_size, n_chars))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+""" Benchmarks emoji prediction with emoji_model-0.650.h5: the notebook's way (a dense float
+    tensor filled row by row with iterrows, padded to the whole window, and np.argmax of each
+    row in a list comprehension) against EmojiClassifier.predict, at several batch sizes,
+    and the latency of MicroBatcher with one request at a time.
+
+    run with: python bench_emoji_predict.py """
+
+from timeit import default_timer as timer
+import numpy as np
+import pandas as pd
+import data_load_utils as util
+import emoji_predict
+import inference
+
+TEXTS = ['sing a rainbow', 'sweet dreams are made of this, who am I to disagree',
+         'lol', 'red and yellow and pink and green']
+
+
+def notebook_predict(model, tweets, window_size=40):
+    chars, char_index = util.get_universal_chars_list()
+    x = np.zeros((len(tweets), window_size, len(chars)))
+    for row_idx, (_, row) in enumerate(tweets.iterrows()):
+        for ch_idx, ch in enumerate(util.pad_text(row['text'], length=window_size)):
+            x[row_idx, ch_idx, char_index[ch]] = 1
+    predicted = model.predict(x)
+    return [np.argmax(p) for p in predicted]
+
+
+def best_time(function, repeats=3):
+    best = float('inf')
+    for _ in range(repeats):
+        start = timer()
+        function()
+        best = min(best, timer() - start)
+    return best
+
+
+def main(batch_sizes=(1, 64, 1024)):
+    model = inference.load_model(emoji_predict.EMOJI_MODEL)
+    classifier = emoji_predict.EmojiClassifier(model)
+
+    print('{:>10} {:>18} {:>18}'.format('batch', 'notebook texts/s', 'compiled texts/s'))
+    for batch_size in batch_sizes:
+        texts = [TEXTS[i % len(TEXTS)] for i in range(batch_size)]
+        tweets = pd.DataFrame({'text': util.normalise_texts(texts)})
+        notebook = best_time(lambda: notebook_predict(model, tweets))
+        compiled = best_time(lambda: classifier.predict(texts, top_k=3))
+        print('{:>10} {:>18.0f} {:>18.0f}'.format(batch_size, batch_size / notebook,
+                                                  batch_size / compiled))
+
+    with emoji_predict.MicroBatcher(classifier.predict, max_delay=0.002) as batcher:
+        latency = best_time(lambda: batcher('sing a rainbow'), repeats=20)
+    print('\nmicro-batched single request latency: {:.2f} ms'.format(latency * 1000))
+
+
+if __name__ == '__main__':
+    main()
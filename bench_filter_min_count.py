@@ -0,0 +1,59 @@
+""" filter_tweets_min_count against the groupby('emoji').filter it replaces, and the cost of
+    building the per-emoji statistics table (get_emoji_stats) serially and with a Pool.
+
+    The tweets are synthetic, with a long tail of n_emojis emojis, since what matters is the
+    number of rows and of emoji classes.
+
+    run with: python bench_filter_min_count.py [n_tweets] [n_emojis] """
+
+import sys
+from timeit import default_timer as timer
+import numpy as np
+import pandas as pd
+import data_load_utils as util
+
+WORDS = np.array(['red', 'and', 'yellow', 'pink', 'green', 'sing', 'a', 'rainbow', 'too', 'lol',
+                  '!!', '#sweetdreams', 'everybody', '@someone'], dtype=object)
+
+
+def get_tweets(n_tweets, n_emojis, seed=0):
+    rng = np.random.default_rng(seed)
+    emojis = np.array([':emoji_{}:'.format(i) for i in range(n_emojis)], dtype=object)
+    # zipf-like class sizes, like the real corpus
+    emoji = emojis[np.minimum(rng.zipf(1.3, n_tweets), n_emojis) - 1]
+    text = [' '.join(WORDS[rng.integers(0, len(WORDS), 10)]) for _ in range(1000)]
+    text = np.asarray(text, dtype=object)[rng.integers(0, 1000, n_tweets)]
+    return pd.DataFrame({'text': text, 'emoji': emoji})
+
+
+def time(function):
+    start = timer()
+    result = function()
+    return result, timer() - start
+
+
+def main(n_tweets=1000000, n_emojis=2000, min_count=100):
+    tweets = get_tweets(int(n_tweets), int(n_emojis))
+    print('{} tweets, {} emojis, min_count {}'.format(len(tweets), tweets['emoji'].nunique(),
+                                                      min_count))
+
+    expected, seconds = time(lambda: tweets.groupby('emoji').filter(
+        lambda c: len(c) > min_count))
+    print('{:>40} {:>8.3f} s'.format('groupby filter', seconds))
+    filtered, seconds = time(lambda: util.filter_tweets_min_count(tweets, min_count))
+    assert filtered.equals(expected)
+    print('{:>40} {:>8.3f} s'.format('filter_tweets_min_count', seconds))
+
+    stats, seconds = time(lambda: util.get_emoji_stats(tweets))
+    print('{:>40} {:>8.3f} s'.format('get_emoji_stats', seconds))
+    _, seconds = time(lambda: util.get_emoji_stats(tweets, processes=4))
+    print('{:>40} {:>8.3f} s'.format('get_emoji_stats, 4 processes', seconds))
+    _, seconds = time(lambda: util.filter_tweets_min_count(tweets, min_count, emoji_stats=stats))
+    print('{:>40} {:>8.3f} s'.format('filter_tweets_min_count with stats', seconds))
+    _, seconds = time(lambda: util.filter_tweets_min_count(tweets, min_count,
+                                                           max_per_emoji=1000))
+    print('{:>40} {:>8.3f} s'.format('with max_per_emoji=1000', seconds))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:3])
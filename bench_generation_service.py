@@ -0,0 +1,54 @@
+""" Load test for generation_service: concurrent HTTP clients asking for single tweets from the
+    stub engine (random seq2seq weights, tweets of about 60 characters), with the service
+    decoding one request at a time (max batch size 1) against coalescing up to 64 sequences
+    into each model step. Reports requests and characters per second, the p50 and p99 latency
+    and the mean number of sequences per step.
+
+    run with: python bench_generation_service.py [clients] [requests per client] """
+
+import asyncio
+import sys
+from timeit import default_timer as timer
+import numpy as np
+import generation_service as gs
+
+
+async def client(port, n_requests, latencies, rng):
+    for _ in range(n_requests):
+        start = timer()
+        status, response = await gs.post_generate({'emoji': int(rng.randint(64))}, port=port)
+        assert status == 200, response
+        latencies.append(timer() - start)
+
+
+async def run_load(engine, max_batch_size, n_clients, n_requests):
+    async with gs.GenerationService(engine, max_batch_size=max_batch_size,
+                                    max_queue=2 * n_clients, rng=0) as service:
+        server = await gs.serve(service, port=0)
+        port = server.sockets[0].getsockname()[1]
+        latencies = []
+        start = timer()
+        await asyncio.gather(*[client(port, n_requests, latencies, np.random.RandomState(i))
+                               for i in range(n_clients)])
+        seconds = timer() - start
+        server.close()
+        await server.wait_closed()
+        return seconds, np.array(latencies), service.stats()
+
+
+def main(n_clients=64, n_requests=5):
+    engine = gs.get_stub_engine()
+    print('{} clients, {} requests each'.format(n_clients, n_requests))
+    print('{:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'max batch', 'req/s', 'chars/s', 'p50 (ms)', 'p99 (ms)', 'batch'))
+    for max_batch_size in [1, 64]:
+        seconds, latencies, stats = asyncio.run(
+            run_load(engine, max_batch_size, n_clients, n_requests))
+        print('{:>10} {:>10.1f} {:>10.0f} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+            max_batch_size, len(latencies) / seconds, stats['chars'] / seconds,
+            1000 * np.percentile(latencies, 50), 1000 * np.percentile(latencies, 99),
+            stats['mean_batch_size']))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,72 @@
+""" Measures the peak resident memory (RSS) of the batch generators for each output dtype,
+    picking up where generator_function_memoryprof.ipynb left off with %memit.
+
+    Each (generator, dtype) pair runs in a fresh python process, since peak RSS can only grow.
+    run with: python bench_generator_memory.py """
+
+import json
+import resource
+import subprocess
+import sys
+import numpy as np
+import pandas as pd
+import data_load_utils as util
+import data_load_seq2seq_utils as s2s_util
+
+
+DTYPES = ['bool', 'uint8', 'float16', 'float32', 'float64']
+
+SAMPLE_TWEETS = ["red and yellow and pink and green, orange and purple and blue, I can sing a rainbow",
+                 "sweet dreams are made of this, who am I to disagree, travel the world and the seven seas",
+                 "lol",
+                 "Everybody's looking for something!! #sweetdreams"]
+
+
+def get_peak_rss_mb():
+    """ peak resident set size of this process so far, in MB (ru_maxrss is KB on linux) """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def get_tweets(n_tweets):
+    """ a DataFrame of n_tweets made up from SAMPLE_TWEETS """
+    return pd.DataFrame({'text': [SAMPLE_TWEETS[i % len(SAMPLE_TWEETS)] for i in range(n_tweets)],
+                         'emoji': [':rainbow:', ':fire:'] * (n_tweets // 2)})
+
+
+def measure(generator_name, dtype, batch_size, n_batches=4):
+    """ runs n_batches of the named generator, returns the peak RSS before and after """
+    tweets = get_tweets(batch_size * n_batches)
+    emojis, emoji_index = util.get_emojis_list(tweets['emoji'])
+    baseline = get_peak_rss_mb()
+
+    if generator_name == 'convert_tweet_to_xy_generator':
+        gen = util.convert_tweet_to_xy_generator(tweets, batch_size=batch_size, emoji_set=emojis,
+                                                 strided=True, dtype=np.dtype(dtype))
+    else:
+        gen = s2s_util.xy_generator(tweets, batch_size=batch_size, emoji_indices=emoji_index,
+                                    dtype=np.dtype(dtype))
+
+    for _ in range(n_batches):
+        next(gen)
+
+    return {'generator': generator_name, 'dtype': dtype, 'batch_size': batch_size,
+            'baseline_mb': baseline, 'peak_mb': get_peak_rss_mb(),
+            'batch_mb': get_peak_rss_mb() - baseline}
+
+
+def main(batch_size=256):
+    print('{:>30} {:>8} {:>12} {:>14}'.format('generator', 'dtype', 'peak (MB)', 'per batch (MB)'))
+    for generator_name in ['convert_tweet_to_xy_generator', 'xy_generator']:
+        for dtype in DTYPES:
+            output = subprocess.check_output(
+                [sys.executable, __file__, '--worker', generator_name, dtype, str(batch_size)])
+            result = json.loads(output)
+            print('{:>30} {:>8} {:>12.1f} {:>14.1f}'.format(
+                generator_name, dtype, result['peak_mb'], result['batch_mb']))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--worker':
+        print(json.dumps(measure(sys.argv[2], sys.argv[3], int(sys.argv[4]))))
+    else:
+        main()
@@ -0,0 +1,70 @@
+""" Benchmarks the numpy inference runtime (inference.load_model) on the saved models:
+    cold start time and peak RSS of a fresh process that imports the runtime, loads a model
+    and predicts one batch, then prediction throughput at several batch sizes.
+
+    run with: python bench_inference.py """
+
+from timeit import default_timer as timer
+import subprocess
+import sys
+import numpy as np
+import generate
+import inference
+
+
+MODELS = ['models/tweet_gen_model-0.776_1.hdf5', 'emoji_model-0.650.h5',
+          'models/text_emoji_joint_gen_model-0.840.hdf5']
+
+COLD_START = """
+from timeit import default_timer as timer
+start = timer()
+import resource
+import numpy as np
+import inference
+model = inference.load_model({path!r})
+shapes = model.input_shape if isinstance(model.input_shape, list) else [model.input_shape]
+model.predict([np.zeros((1,) + tuple(shape[1:]), dtype=np.float32) for shape in shapes])
+print(timer() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+"""
+
+
+def cold_start(path):
+    """ (seconds, peak RSS in MB) for a new process to load path and predict once """
+    result = subprocess.run([sys.executable, '-c', COLD_START.format(path=path)],
+                            capture_output=True, text=True, check=True)
+    seconds, rss = result.stdout.split()
+    return float(seconds), float(rss)
+
+
+def throughput(path, batch_size, repeats=3):
+    """ windows per second predicted by the model at path """
+    model = inference.load_model(path)
+    shapes = model.input_shape if isinstance(model.input_shape, list) else [model.input_shape]
+    windows = generate.get_seed_windows(['sing a rainbow'] * batch_size,
+                                        window_size=shapes[0][1])
+    inputs = [windows] + [np.eye(shape[1], dtype=np.float32)[np.arange(batch_size) % shape[1]]
+                          for shape in shapes[1:]]
+
+    best = float('inf')
+    for _ in range(repeats):
+        start = timer()
+        model.predict(inputs if len(inputs) > 1 else inputs[0])
+        best = min(best, timer() - start)
+    return batch_size / best
+
+
+def main(batch_sizes=(1, 64, 512)):
+    print('{:>46} {:>14} {:>10}'.format('model', 'cold start (s)', 'RSS (MB)'))
+    for path in MODELS:
+        seconds, rss = cold_start(path)
+        print('{:>46} {:>14.3f} {:>10.1f}'.format(path, seconds, rss))
+
+    print('\n{:>46} {:>10} {:>14}'.format('model', 'batch', 'windows/s'))
+    for path in MODELS:
+        for batch_size in batch_sizes:
+            rate = throughput(path, batch_size)
+            print('{:>46} {:>10} {:>14.0f}'.format(path, batch_size, rate))
+
+
+if __name__ == '__main__':
+    main()
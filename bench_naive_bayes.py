@@ -0,0 +1,134 @@
+""" Benchmarks the streaming naive Bayes classifier (emoji_naive_bayes.train_naive_bayes)
+    against the naive bayes notebook: training time, peak memory and dev set accuracy, and the
+    time to find the top words of every emoji.
+
+    The notebook fits TfidfVectorizer(max_features=5000, use_idf=False) on the training tweets
+    in memory, and its dev accuracy is shown both as written (with the vectorizer refitted on
+    the dev set) and with the dev set transformed by the training vectorizer.
+
+    The tweets come from the corpus csv (data/emojis_homemade.csv) if it is there, otherwise
+    from a synthetic csv where each emoji has its own words mixed in with common ones. The last
+    n_dev tweets are the dev set, as in the notebook.
+
+    run with: python bench_naive_bayes.py [path to csv] """
+
+import os
+import random
+import sys
+import tempfile
+from timeit import default_timer as timer
+import tracemalloc
+import numpy as np
+import pandas as pd
+from sklearn import feature_extraction, naive_bayes, preprocessing
+import data_load_utils as util
+import emoji_naive_bayes as nb
+
+CORPUS = 'data/emojis_homemade.csv'
+COMMON_WORDS = ['the', 'and', 'a', 'to', 'is', 'lol', 'today', 'my', 'this', 'so', 'love', 'i']
+
+
+def write_synthetic_corpus(path, n_tweets=200000, n_emojis=20, seed=0):
+    rng = random.Random(seed)
+    emojis = [chr(0x1F600 + i) for i in range(n_emojis)]
+    emoji_words = dict((emoji, ['w{}x{}'.format(i, j) for j in range(30)])
+                       for i, emoji in enumerate(emojis))
+    rows = []
+    for _ in range(n_tweets):
+        emoji = emojis[min(int(rng.expovariate(0.2)), n_emojis - 1)]
+        words = [rng.choice(emoji_words[emoji] if rng.random() < 0.3 else
+                            emoji_words[rng.choice(emojis)] if rng.random() < 0.2 else
+                            COMMON_WORDS) for _ in range(rng.randint(3, 20))]
+        rows.append((' '.join(words), emoji))
+    pd.DataFrame(rows, columns=['text', 'emoji']).to_csv(path, index=False)
+
+
+def measure(function):
+    """ (result, seconds, peak traced memory in MB) of function() """
+    tracemalloc.start()
+    start = timer()
+    result = function()
+    seconds = timer() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return result, seconds, peak
+
+
+def notebook_train(path, n_dev, min_count):
+    tweets = util.read_tweet_data(path)
+    tweets = util.filter_tweets_min_count(tweets, min_count=min_count)
+    tweets = tweets.assign(text=util.filter_text_for_handles(tweets['text']))
+    train, dev = tweets[0:-n_dev], tweets[-n_dev:]
+
+    tfidf_vec = feature_extraction.text.TfidfVectorizer(max_features=5000, use_idf=False)
+    label_encoder = preprocessing.LabelEncoder()
+    train_x = tfidf_vec.fit_transform(train['text'])
+    train_y = label_encoder.fit_transform(train['emoji'])
+    bayes = naive_bayes.MultinomialNB().fit(train_x, train_y)
+    return bayes, tfidf_vec, label_encoder, dev
+
+
+def streaming_train(path, n_dev, min_count, chunksize=50000):
+    """ trains on all but the last n_dev tweets of path, streaming """
+    counts = util.get_emoji_counts(path, chunksize=chunksize)
+    emojis = sorted(counts.index[counts > min_count])
+    classifier = nb.NaiveBayesEmojiClassifier(emojis)
+
+    n_train = sum(int(counts[emoji]) for emoji in emojis) - n_dev
+    seen = 0
+    for chunk in util.read_filtered_tweet_chunks(path, min_count=min_count, chunksize=chunksize,
+                                                 emoji_counts=counts):
+        chunk = chunk.iloc[0:max(n_train - seen, 0)]
+        seen += len(chunk)
+        if len(chunk):
+            classifier.partial_fit(chunk['text'], chunk['emoji'])
+    return classifier
+
+
+def main(path=None, n_dev=20000, min_count=500):
+    tmp_dir = None
+    if path is None and os.path.exists(CORPUS):
+        path = CORPUS
+    if path is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(tmp_dir.name, 'synthetic.csv')
+        write_synthetic_corpus(path)
+    print('tweets from {}'.format(CORPUS if path == CORPUS else path))
+
+    (bayes, tfidf_vec, label_encoder, dev), nb_seconds, nb_peak = measure(
+        lambda: notebook_train(path, n_dev, min_count))
+    classifier, seconds, peak = measure(lambda: streaming_train(path, n_dev, min_count))
+
+    dev_y = label_encoder.transform(dev['emoji'])
+    fixed_acc = np.mean(bayes.predict(tfidf_vec.transform(dev['text'])) == dev_y)
+    words = list(tfidf_vec.vocabulary_)
+    inverse_vocab = dict((idx, word) for word, idx in tfidf_vec.vocabulary_.items())
+    # as written in the notebook, which replaces the training vocabulary
+    refit_acc = np.mean(bayes.predict(
+        feature_extraction.text.TfidfVectorizer(max_features=5000, use_idf=False)
+        .fit_transform(dev['text'])) == dev_y)
+    acc = classifier.score(dev['text'], dev['emoji'])
+
+    print('{:>34} {:>10} {:>14} {:>10}'.format('', 'train (s)', 'peak mem (MB)', 'dev acc'))
+    print('{:>34} {:>10.2f} {:>14.1f} {:>10.3f}'.format('notebook, dev refitted', nb_seconds,
+                                                        nb_peak, refit_acc))
+    print('{:>34} {:>10} {:>14} {:>10.3f}'.format('notebook, dev transformed', '', '',
+                                                  fixed_acc))
+    print('{:>34} {:>10.2f} {:>14.1f} {:>10.3f}'.format('streaming hashed', seconds, peak, acc))
+
+    start = timer()
+    word_pred = bayes.predict_proba(np.eye(len(inverse_vocab)))
+    [[inverse_vocab[i] for i in np.argsort(-word_pred[:, c])[0:10]]
+     for c in range(word_pred.shape[1])]
+    eye_seconds = timer() - start
+    start = timer()
+    classifier.top_words(words, n=10)
+    print('\ntop 10 words of every emoji: identity prediction {:.3f} s, top_words {:.3f} s'
+          .format(eye_seconds, timer() - start))
+
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
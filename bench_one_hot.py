@@ -0,0 +1,81 @@
+""" Benchmarks the vectorised one-hot encoder (get_x_bool_array / get_y_bool_array)
+    against the original per-character loops, at several batch sizes.
+
+    run with: python bench_one_hot.py """
+
+from timeit import default_timer as timer
+import numpy as np
+import pandas as pd
+import data_load_utils as util
+
+
+SAMPLE_TWEETS = ["red and yellow and pink and green, orange and purple and blue, I can sing a rainbow",
+                 "sweet dreams are made of this, who am I to disagree, travel the world and the seven seas",
+                 "@someone lol",
+                 "Everybody's looking for something!! #sweetdreams"]
+
+
+def loop_x_bool_array(sentence, chars, char_index):
+    """ the original per-character implementation of get_x_bool_array """
+    text_x = np.zeros((len(sentence), len(sentence[0]), len(chars)), dtype=np.bool_)
+    for i, s in enumerate(sentence):
+        for pos, char in enumerate(s):
+            text_x[i, pos, char_index[char]] = 1
+    return text_x
+
+
+def loop_y_bool_array(next_chars, char_index):
+    """ the original per-character implementation of get_y_bool_array """
+    text_y = np.zeros((len(next_chars), len(char_index)), dtype=np.bool_)
+    for i in range(len(next_chars)):
+        text_y[i, char_index[next_chars[i]]] = 1
+    return text_y
+
+
+def get_batch_windows(batch_size, length=160, window_size=40, step=3):
+    """ returns the (sentences, next_chars) of every tweet in a batch of batch_size tweets """
+    tweets = pd.DataFrame({'text': [SAMPLE_TWEETS[i % len(SAMPLE_TWEETS)] for i in range(batch_size)],
+                           'emoji': ':rainbow:'})
+    tweets['text'] = util.filter_text_for_handles(tweets['text'])
+    return [util.get_series_data_from_tweet(tweet, length=length, window_size=window_size, step=step)
+            for _, tweet in tweets.iterrows()]
+
+
+def time_encoder(windows, x_func, y_func, chars, char_index, repeats=3):
+    """ best-of-repeats time to one-hot encode all the windows in a batch """
+    best = float('inf')
+    for _ in range(repeats):
+        start = timer()
+        for sentences, next_chars in windows:
+            x_func(sentences, chars, char_index)
+            y_func(next_chars, char_index)
+        best = min(best, timer() - start)
+    return best
+
+
+def batch_windows(windows):
+    """ joins the windows of every tweet in a batch into a single (sentences, next_chars) pair,
+    so the whole batch is encoded in one call """
+    sentences = [sentence for tweet_sentences, _ in windows for sentence in tweet_sentences]
+    next_chars = [char for _, tweet_next_chars in windows for char in tweet_next_chars]
+    return [(sentences, next_chars)]
+
+
+def main(batch_sizes=(64, 512, 2048)):
+    chars, char_index = util.get_universal_chars_list()
+
+    print('{:>10} {:>12} {:>16} {:>14} {:>8}'.format(
+        'batch', 'loop (s)', 'per tweet (s)', 'batched (s)', 'speedup'))
+    for batch_size in batch_sizes:
+        windows = get_batch_windows(batch_size)
+        loop_time = time_encoder(windows, loop_x_bool_array, loop_y_bool_array, chars, char_index)
+        tweet_time = time_encoder(windows, util.get_x_bool_array, util.get_y_bool_array,
+                                  chars, char_index)
+        batch_time = time_encoder(batch_windows(windows), util.get_x_bool_array,
+                                  util.get_y_bool_array, chars, char_index)
+        print('{:>10} {:>12.4f} {:>16.4f} {:>14.4f} {:>7.1f}x'.format(
+            batch_size, loop_time, tweet_time, batch_time, loop_time / batch_time))
+
+
+if __name__ == '__main__':
+    main()
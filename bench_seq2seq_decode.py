@@ -0,0 +1,61 @@
+""" Benchmarks batched seq2seq decoding (generate.decode_sequences) against the notebook's
+    decode_sequence, which decodes one tweet at a time with a batch of one per character.
+    Both use the numpy reference model (inference.NumpySeq2Seq) with random weights, so the
+    numbers measure the decoding loop rather than keras.
+
+    The dense bias of the newline character is raised so that sampled tweets finish at
+    different lengths, the way a trained model's do, and finished tweets drop out of the batch.
+
+    run with: python bench_seq2seq_decode.py """
+
+from timeit import default_timer as timer
+import numpy as np
+import data_load_seq2seq_utils as s2s_util
+import generate
+import inference
+
+
+N_EMOJIS = 100
+
+
+def get_model(units=256, stop_bias=0.5):
+    chars, char_index = s2s_util.get_universal_chars_list()
+    model = inference.NumpySeq2Seq.random(N_EMOJIS, len(chars), units=units, rng=0)
+    model.dense_weights[1][char_index['\n']] += stop_bias
+    return model
+
+
+def one_at_a_time(model, emojis, temperature, rng):
+    """ the notebook's decode_sequence loop, for each emoji in turn """
+    tweets = []
+    for emoji in emojis:
+        tweets += generate.decode_sequences(model.encode, model.decode, emoji[np.newaxis],
+                                            temperature=temperature, rng=rng)
+    return tweets
+
+
+def main(batch_sizes=(1, 16, 256, 1024), units=256, temperature=1.0, n_reference=32):
+    model = get_model(units=units)
+    rng = np.random.default_rng(0)
+    emojis = np.eye(N_EMOJIS, dtype=np.float32)[rng.integers(0, N_EMOJIS, max(batch_sizes))]
+
+    start = timer()
+    tweets = one_at_a_time(model, emojis[0:n_reference], temperature, rng)
+    reference_time = (timer() - start) / n_reference
+    print('one at a time: {:.2f} ms per tweet, {:.0f} tweets/s (mean length {:.0f})'.format(
+        1000 * reference_time, 1 / reference_time, np.mean([len(t) for t in tweets])))
+
+    print('{:>10} {:>12} {:>16} {:>12} {:>8}'.format(
+        'batch', 'total (s)', 'per tweet (ms)', 'tweets/s', 'speedup'))
+    for batch_size in batch_sizes:
+        start = timer()
+        generate.decode_sequences(model.encode, model.decode, emojis[0:batch_size],
+                                  temperature=temperature, rng=rng)
+        total = timer() - start
+        print('{:>10} {:>12.3f} {:>16.3f} {:>12.0f} {:>7.1f}x'.format(
+            batch_size, total, 1000 * total / batch_size, batch_size / total,
+            reference_time * batch_size / total))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+""" First token latency of the seq2seq generation service's engine with and without the state
+    cache: the time from a new request's emoji (and seed) to the probabilities of its first
+    character, that is the engine's first_step(). Without the cache (or on a miss) it runs the
+    encoder and the decoder over the newline and the seed; with the cache warm it only stacks
+    the stored probabilities and states, with or without a seed.
+
+    The engine is the stub (a NumpySeq2Seq with random weights and the notebook's 256 units).
+
+    run with: python bench_state_cache.py [repeats] """
+
+import sys
+from timeit import default_timer as timer
+import numpy as np
+import generation_service as gs
+import state_cache
+
+
+def first_token_seconds(engine, emoji_codes, seeds, repeats):
+    """ the best of repeats times of first_step() """
+    best = float('inf')
+    for _ in range(repeats):
+        start = timer()
+        engine.first_step(emoji_codes, seeds)
+        best = min(best, timer() - start)
+    return best
+
+
+def main(repeats=50):
+    cache = state_cache.StateCache()
+    engines = [('no cache', gs.get_stub_engine()), ('warm cache', gs.get_stub_engine(cache=cache))]
+    cases = [('1 request', [7], [None]),
+             ('1 request, seed', [7], ['sing a rainbow ']),
+             ('8 requests', [1, 2, 3, 4, 5, 6, 7, 8], [None] * 8),
+             ('8 requests, seeds', [1, 2, 3, 4, 5, 6, 7, 8], ['i love ', 'omg '] * 4)]
+
+    print('{:>20} {:>14} {:>14} {:>8}'.format('', 'no cache (ms)', 'warm (ms)', 'speedup'))
+    for name, emoji_codes, seeds in cases:
+        emoji_codes = np.array(emoji_codes)
+        gs.get_stub_engine(cache=cache).first_step(emoji_codes, seeds)  # warms the cache
+        cold, warm = [first_token_seconds(engine, emoji_codes, seeds, repeats)
+                      for _, engine in engines]
+        print('{:>20} {:>14.3f} {:>14.3f} {:>7.1f}x'.format(name, 1000 * cold, 1000 * warm,
+                                                             cold / warm))
+    print(cache.stats())
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
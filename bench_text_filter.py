@@ -0,0 +1,59 @@
+""" Benchmarks filter_text_for_handles against the original Series.apply closures on a
+    synthetic set of 500k tweets, serially and with a multiprocessing pool.
+
+    run with: python bench_text_filter.py """
+
+import os
+import random
+from timeit import default_timer as timer
+import pandas as pd
+import data_load_utils as util
+
+
+WORDS = ['red', 'and', 'yellow', 'pink', 'green', 'sing', 'a', 'rainbow', 'too', 'lol', '!!',
+         '#sweetdreams', 'I`m', 'café', '\U0001F308', '@someone', '@another_handle', '', '£5']
+
+
+def get_tweets(n_tweets=500000, seed=0):
+    """ n_tweets random tweets of 3-30 words, including handles and unwanted characters """
+    rng = random.Random(seed)
+    return pd.Series([' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 30)))
+                      for _ in range(n_tweets)], name='text')
+
+
+def original_filter_text_for_handles(text, chars=util.CHARACTERS):
+    """ the original Series.apply implementation of filter_text_for_handles """
+
+    def filter_handles(txt): return ' '.join(
+        word for word in txt.split(' ') if not word.startswith('@'))
+
+    def filter_chars(txt): return ''.join([c for c in txt if c in chars])
+
+    return text.apply(lambda txt: filter_chars(filter_handles(txt)))
+
+
+def time_function(func, *args, **kwargs):
+    start = timer()
+    result = func(*args, **kwargs)
+    return timer() - start, result
+
+
+def main(n_tweets=500000, processes=os.cpu_count()):
+    tweets = get_tweets(n_tweets)
+
+    original_time, original = time_function(original_filter_text_for_handles, tweets)
+    serial_time, serial = time_function(util.filter_text_for_handles, tweets)
+    pool_time, pooled = time_function(util.filter_text_for_handles, tweets, processes=processes)
+
+    assert serial.equals(original) and pooled.equals(original)
+
+    print('{} tweets, {} cpus'.format(n_tweets, os.cpu_count()))
+    print('{:>28} {:>8.2f}s'.format('original apply', original_time))
+    print('{:>28} {:>8.2f}s {:>6.1f}x'.format('regex normaliser', serial_time,
+                                                original_time / serial_time))
+    print('{:>28} {:>8.2f}s {:>6.1f}x'.format('regex, {} processes'.format(processes), pool_time,
+                                                original_time / pool_time))
+
+
+if __name__ == '__main__':
+    main()
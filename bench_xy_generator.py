@@ -0,0 +1,84 @@
+""" Batches per second of xy_generator's one-hot batches, newly allocated (the default) and
+    encoded into a ring of reused buffers (buffers=2, only setting and clearing their ones),
+    against the original row by row loop over this_batch.iloc[m] and against get_xy_batch.
+
+    The tweets are synthetic, with lengths spread over the 160 characters.
+
+    run with: python bench_xy_generator.py [batch size] """
+
+from itertools import islice
+import random
+import sys
+from timeit import default_timer as timer
+import numpy as np
+import pandas as pd
+import data_load_seq2seq_utils as s2s_util
+import data_load_utils as util
+
+WORDS = ['red', 'and', 'yellow', 'pink', 'green', 'sing', 'a', 'rainbow', 'too', 'lol', '!!',
+         '#sweetdreams', 'everybody', 'looking', 'for', 'something', 'I', 'the', '2day']
+
+
+def get_tweets(n_tweets, seed=0):
+    rng = random.Random(seed)
+    text = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 30)))[0:160]
+            for _ in range(n_tweets)]
+    emoji = [rng.choice([':fire:', ':rainbow:', ':ghost:']) for _ in range(n_tweets)]
+    return pd.DataFrame({'text': text, 'emoji': emoji})
+
+
+def row_loop_generator(tweets, batch_size, emoji_indices, dtype, sequence_length=161):
+    """ the original xy_generator loop, with the buffers cleared so its batches are right """
+    _, char_idx_univ = s2s_util.get_universal_chars_list()
+    x_arr = np.zeros((batch_size, sequence_length, len(char_idx_univ)), dtype=dtype)
+    y_arr = np.zeros_like(x_arr)
+    emoji_arr = np.zeros((batch_size, 1, len(emoji_indices)), dtype=dtype)
+    n_batches = len(tweets) // batch_size
+    batch_num = 0
+    while True:
+        for arr in (x_arr, y_arr, emoji_arr):
+            arr.fill(0)
+        this_batch = tweets.iloc[(batch_num*batch_size):(batch_num+1)*batch_size]
+        for m in range(batch_size):
+            for i, char in enumerate(this_batch.iloc[m].loc['text'] + '\n'):
+                x_arr[m, i, char_idx_univ[char]] = 1
+                if i > 0:
+                    y_arr[m, i-1, char_idx_univ[char]] = 1
+            emoji_arr[m, 0, emoji_indices[this_batch.iloc[m].loc['emoji']]] = 1
+        yield ([emoji_arr, x_arr], y_arr)
+        batch_num = (batch_num + 1) % n_batches
+
+
+def batches_per_second(batches, n_batches):
+    start = timer()
+    for _ in islice(batches, n_batches):
+        pass
+    return n_batches / (timer() - start)
+
+
+def main(batch_size=64, n_batches=50):
+    batch_size = int(batch_size)
+    tweets = get_tweets(batch_size * n_batches)
+    _, emoji_idx = util.get_emojis_list(tweets['emoji'])
+
+    print('batch size {}'.format(batch_size))
+    print('{:>30} {:>14} {:>14}'.format('', 'float64 b/s', 'uint8 b/s'))
+    for name, make_batches in [
+            ('row by row loop', lambda dtype: row_loop_generator(tweets, batch_size, emoji_idx,
+                                                                 dtype)),
+            ('new batch each time', lambda dtype: (
+                s2s_util.get_xy_batch(tweets, i, batch_size=batch_size,
+                                      emoji_indices=emoji_idx, dtype=dtype)
+                for i in range(n_batches))),
+            ('xy_generator', lambda dtype: s2s_util.xy_generator(
+                tweets, batch_size=batch_size, emoji_indices=emoji_idx, dtype=dtype)),
+            ('xy_generator buffers=2', lambda dtype: s2s_util.xy_generator(
+                tweets, batch_size=batch_size, emoji_indices=emoji_idx, dtype=dtype,
+                buffers=2))]:
+        print('{:>30} {:>14.1f} {:>14.1f}'.format(
+            name, *[batches_per_second(make_batches(dtype), n_batches)
+                    for dtype in (np.float64, np.uint8)]))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:2])
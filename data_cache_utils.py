@@ -0,0 +1,299 @@
+""" Functions that build an on-disk cache of the filtered tweet corpus and load it back
+    memory-mapped, so training runs don't re-read, re-filter and re-encode the csv files.
+
+    A cache directory holds
+      codes.npy      (tweets, length) uint8 matrix of character codes, each text left-aligned
+                     and followed by CACHE_BLANK
+      lengths.npy    (tweets,) int16 length of each text
+      emoji.npy      (tweets,) int32 index of each tweet's emoji in manifest['emojis']
+      hashes.npy     (tweets,) uint64 data_load_utils.get_tweet_hashes of each tweet, of its
+                     whole text before it was truncated to length, so tweets are assigned
+                     to the same splits as in a pd.DataFrame of the corpus
+      manifest.json  the charset, emoji list, filter parameters and source file signatures
+      splits.npz     int32 row numbers of the tweets in each train/dev/test split, written the
+                     first time a split is asked for, see CorpusCache.get_split """
+
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+import data_load_utils as util
+
+
+CACHE_VERSION = 2
+CACHE_BLANK = 255  # code matrix entry for positions after the end of a tweet
+MANIFEST_FILE = 'manifest.json'
+CODES_FILE = 'codes.npy'
+LENGTHS_FILE = 'lengths.npy'
+EMOJI_FILE = 'emoji.npy'
+HASHES_FILE = 'hashes.npy'
+SPLITS_FILE = 'splits.npz'
+
+
+class CorpusCache:
+    """ the filtered corpus loaded from a cache directory with load_corpus_cache. Can be passed
+    to convert_tweet_to_xy_generator and xy_generator in place of a pd.DataFrame of tweets.
+    A cache can also be a subset of the rows of another (see get_split), in which case rows
+    maps its row numbers to those of codes """
+
+    def __init__(self, codes, lengths, emoji, manifest, cache_dir=None, rows=None,
+                 hashes=None):
+        self.codes = codes
+        self.lengths = lengths
+        self.emoji = emoji
+        self.hashes = hashes
+        self.manifest = manifest
+        self.cache_dir = cache_dir
+        self.rows = rows
+        self.chars = manifest['charset']
+        self.emojis = manifest['emojis']
+        self.length = manifest['length']
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def get_text_codes(self, rows, char_index):
+        """ returns the code matrix for rows (a slice or array of row numbers), with codes
+        translated to char_index and positions after the end of each text set to BLANK_CODE """
+
+        table = np.full(CACHE_BLANK + 1, util.UNKNOWN_CODE, dtype=np.int16)
+        for code, char in enumerate(self.chars):
+            table[code] = char_index[char]
+        table[CACHE_BLANK] = util.BLANK_CODE
+
+        return table[self.codes[self.get_code_rows(rows)]]
+
+    def get_code_rows(self, rows):
+        """ the rows of codes for rows of this cache """
+        return rows if self.rows is None else self.rows[rows]
+
+    def get_emojis(self, rows):
+        """ returns an array of the emoji strings for rows (a slice or array of row numbers) """
+        return np.asarray(self.emojis, dtype=object)[self.emoji[rows]]
+
+    def get_tweets(self, rows=slice(None)):
+        """ decodes rows back into a pd.DataFrame with 'text' and 'emoji' columns """
+        chars = np.asarray(list(self.chars) + [''], dtype=object)
+        # CACHE_BLANK decodes to ''
+        codes = np.minimum(self.codes[self.get_code_rows(rows)], len(self.chars))
+        text = [''.join(row) for row in chars[codes]]
+        return pd.DataFrame({'text': text, 'emoji': self.get_emojis(rows)})
+
+    def get_split_index(self, splits=util.DEFAULT_SPLITS, chunksize=100000):
+        """ the split index (see data_load_utils.get_split_index) of the tweets in the cache,
+        loaded from the cache directory, or built and saved there if it isn't there yet or
+        was built with other splits """
+
+        path = os.path.join(self.cache_dir, SPLITS_FILE)
+        if os.path.exists(path):
+            split_index, saved_splits = load_split_index(path)
+            if saved_splits == [list(split) for split in splits]:
+                return split_index
+
+        # the hashes were taken when the cache was built, from the whole of each text
+        split_of_row = np.concatenate(
+            [util.assign_splits(self.hashes[i:i + chunksize], splits=splits)
+             for i in range(0, len(self), chunksize)] + [np.zeros(0, dtype=np.int8)])
+        split_index = dict((name, np.flatnonzero(split_of_row == i).astype(np.int32))
+                           for i, (name, _) in enumerate(splits))
+        save_split_index(path, split_index, splits)
+        return split_index
+
+    def get_split(self, split, splits=util.DEFAULT_SPLITS):
+        """ the CorpusCache of the tweets in one split. The lengths and emojis of the split
+        are gathered into memory, the codes are still read from the memory-mapped file,
+        a batch at a time """
+
+        assert self.rows is None and self.cache_dir is not None, \
+            'splits need a cache loaded with load_corpus_cache'
+        rows = self.get_split_index(splits=splits)[split]
+        return CorpusCache(self.codes, self.lengths[rows], self.emoji[rows], self.manifest,
+                           rows=rows)
+
+
+def save_split_index(path, split_index, splits=util.DEFAULT_SPLITS):
+    """ writes a split index (a dict of split name -> row numbers) to the .npz file at path,
+    along with the splits it was made with """
+    np.savez(path, __splits__=np.array(json.dumps([list(split) for split in splits])),
+             **dict((name, np.asarray(rows, dtype=np.int32))
+                    for name, rows in split_index.items()))
+
+
+def load_split_index(path):
+    """ reads a split index written by save_split_index, returns (split_index, splits) """
+    with np.load(path) as f:
+        splits = json.loads(str(f['__splits__']))
+        return dict((name, f[name]) for name, _ in splits), splits
+
+
+def get_file_hash(path, chunk_size=2**20):
+    """ sha1 hex digest of the contents of the file at path """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def get_file_signature(path, with_hash=True):
+    """ the path, size, modification time and (optionally) content hash of a source file """
+    stat = os.stat(path)
+    signature = {'path': os.path.abspath(path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+    if with_hash:
+        signature['sha1'] = get_file_hash(path)
+    return signature
+
+
+def get_cache_params(min_count=1000, length=160):
+    """ everything apart from the source files that the contents of the cache depends on """
+    chars, _ = util.get_universal_chars_list()
+    return {'version': CACHE_VERSION,
+            'min_count': min_count,
+            'length': length,
+            'charset': ''.join(chars)}
+
+
+def is_source_unchanged(signature, path):
+    """ checks a source file still matches the signature stored in the manifest. Size and
+    modification time are checked first, so the file is only re-hashed if it has been touched.
+    If it was touched but its contents are the same, signature['mtime'] is updated to the new
+    modification time """
+
+    if not os.path.exists(path) or signature['path'] != os.path.abspath(path):
+        return False
+
+    current = get_file_signature(path, with_hash=False)
+    if current['size'] != signature['size']:
+        return False
+    if current['mtime'] == signature['mtime']:
+        return True
+
+    if get_file_hash(path) != signature['sha1']:
+        return False
+    signature['mtime'] = current['mtime']
+    return True
+
+
+def is_cache_fresh(cache_dir, paths, min_count=1000, length=160):
+    """ True if cache_dir holds a complete cache built from paths with the same parameters """
+
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return False
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    if any(manifest.get(key) != value
+           for key, value in get_cache_params(min_count, length).items()):
+        return False
+
+    if len(manifest['sources']) != len(paths):
+        return False
+
+    mtimes = [signature['mtime'] for signature in manifest['sources']]
+    if not all(is_source_unchanged(signature, path)
+               for signature, path in zip(manifest['sources'], paths)):
+        return False
+
+    if mtimes != [signature['mtime'] for signature in manifest['sources']]:
+        # some sources were touched but not changed, keep their new modification times so
+        # they aren't hashed again on every load
+        write_manifest(manifest_path, manifest)
+    return True
+
+
+def write_manifest(manifest_path, manifest):
+    """ writes the manifest to a temporary file first and then moves it into place, so a
+    reader never sees a half written manifest """
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def build_corpus_cache(paths, cache_dir, min_count=1000, length=160, chunksize=100000):
+    """ streams the csv files in paths through read_filtered_tweet_chunks, which filters them the
+    same way as the notebooks (filter_tweets_min_count then filter_text_for_handles), and writes
+    the encoded corpus to cache_dir chunksize rows at a time, so memory use doesn't grow with
+    the size of the csv files. Texts longer than length are truncated. Returns the manifest """
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # remove the old manifest first, so a half written cache is never mistaken for a fresh one,
+    # and the old split index, whose row numbers are for the old tweets
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+    for path in (manifest_path, os.path.join(cache_dir, SPLITS_FILE)):
+        if os.path.exists(path):
+            os.remove(path)
+
+    # the first pass gives the emoji list and the final number of tweets
+    counts = util.get_emoji_counts(paths, chunksize=chunksize)
+    counts = counts[counts > min_count]
+    emojis, emoji_index = util.get_emojis_list(counts.index)
+    n_tweets = int(counts.sum())
+
+    _, char_index = util.get_universal_chars_list()
+
+    codes = np.lib.format.open_memmap(os.path.join(cache_dir, CODES_FILE), mode='w+',
+                                      dtype=np.uint8, shape=(n_tweets, length))
+    lengths = np.lib.format.open_memmap(os.path.join(cache_dir, LENGTHS_FILE), mode='w+',
+                                        dtype=np.int16, shape=(n_tweets,))
+    labels = np.lib.format.open_memmap(os.path.join(cache_dir, EMOJI_FILE), mode='w+',
+                                       dtype=np.int32, shape=(n_tweets,))
+    hashes = np.lib.format.open_memmap(os.path.join(cache_dir, HASHES_FILE), mode='w+',
+                                       dtype=np.uint64, shape=(n_tweets,))
+
+    start = 0
+    for tweets in util.read_filtered_tweet_chunks(paths, min_count=min_count,
+                                                  chunksize=chunksize, emoji_counts=counts):
+        texts = [text[0:length] for text in tweets['text']]
+        stop = start + len(texts)
+
+        chunk = util.encode_char_codes(texts, char_index)
+        codes[start:stop] = CACHE_BLANK
+        codes[start:stop, 0:chunk.shape[1]] = np.where(chunk == util.BLANK_CODE,
+                                                       CACHE_BLANK, chunk)
+        lengths[start:stop] = [len(text) for text in texts]
+        labels[start:stop] = [emoji_index[emoji] for emoji in tweets['emoji']]
+        hashes[start:stop] = util.get_tweet_hashes(tweets)
+
+        start = stop
+
+    for arr in (codes, lengths, labels, hashes):
+        arr.flush()
+    del codes, lengths, labels, hashes
+
+    manifest = get_cache_params(min_count, length)
+    manifest['emojis'] = emojis
+    manifest['n_tweets'] = n_tweets
+    manifest['sources'] = [get_file_signature(path) for path in paths]
+
+    write_manifest(manifest_path, manifest)
+    return manifest
+
+
+def load_corpus_cache(cache_dir, mmap_mode='r'):
+    """ loads the cache in cache_dir as a CorpusCache, with the arrays memory-mapped """
+
+    with open(os.path.join(cache_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+
+    return CorpusCache(np.load(os.path.join(cache_dir, CODES_FILE), mmap_mode=mmap_mode),
+                       np.load(os.path.join(cache_dir, LENGTHS_FILE), mmap_mode=mmap_mode),
+                       np.load(os.path.join(cache_dir, EMOJI_FILE), mmap_mode=mmap_mode),
+                       manifest, cache_dir=cache_dir,
+                       hashes=np.load(os.path.join(cache_dir, HASHES_FILE), mmap_mode=mmap_mode))
+
+
+def get_corpus_cache(paths, cache_dir, min_count=1000, length=160):
+    """ loads the cache in cache_dir, (re)building it first if it is missing or if the source
+    files or filter parameters have changed since it was built """
+
+    if isinstance(paths, str):
+        paths = [paths]
+
+    if not is_cache_fresh(cache_dir, paths, min_count=min_count, length=length):
+        build_corpus_cache(paths, cache_dir, min_count=min_count, length=length)
+
+    return load_corpus_cache(cache_dir)
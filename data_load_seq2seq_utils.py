@@ -3,8 +3,10 @@
 
     x is (tweet_length, character_set_size) sized ndarray"""
 
+import collections
 import os
 import string
+import threading
 import pandas as pd
 import numpy as np
 import data_load_utils as prev_util
@@ -14,6 +16,9 @@ import data_load_utils as prev_util
 CHARACTERS = """\n '",.\\/|?:;@'~#[]{}-=_+!"£$%^&*()abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ01234567890"""
 CHARACTERS_NO_NEWLINE = """ '",.\\/|?:;@'~#[]{}-=_+!"£$%^&*()abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ01234567890"""
 
+# the sequence lengths (text + newline) that xy_generator's bucketing groups tweets into
+DEFAULT_BUCKETS = (32, 64, 96, 128, 161)
+
 
 def get_unique_chars_list(list_strings):
     """ takes list of strings, returns dict of all characters """
@@ -21,70 +26,364 @@ def get_unique_chars_list(list_strings):
     one_big_string = ' '.join(list_strings)
 
     chars = sorted(list(set(one_big_string)))
-    char_indices = dict((char, chars.index(char)) for char in chars)
+    char_indices = dict((char, i) for i, char in enumerate(chars))
 
     return chars, char_indices
 
 
 def get_universal_chars_list():
     """ gets a universal set of text characters and basic punctuation, suitable for using
-    on all tweets. returns set of characters and the index. """
+    on all tweets. returns set of characters and the index (a data_load_utils.Vocabulary). """
 
-    return get_unique_chars_list(CHARACTERS)
+    vocab = prev_util.get_char_vocabulary(CHARACTERS)
+    return list(vocab.tokens), vocab
 
 
-def filter_text(text, chars=CHARACTERS_NO_NEWLINE):
+def filter_text(text, chars=CHARACTERS_NO_NEWLINE, processes=None):
     """ takes an pd.Series of text. 
     Filters it, removing twitter handles from text data - all text preceded by @ and then 
-    all characters not contained in universal set. Also removes all newline characters"""
+    all characters not contained in universal set. Also removes all newline characters.
+    processes is passed through to data_load_utils.filter_text_for_handles """
+
+    return prev_util.filter_text_for_handles(text, chars=chars, processes=processes)
+
+
+def get_sequence_codes(tweets, rows, sequence_length=161):
+    """ encodes the text + newline of the tweets in rows (a slice or array of row numbers) of
+    tweets, a pd.DataFrame or a CorpusCache loaded by data_cache_utils, into a
+    (tweets, sequence_length) code matrix. Positions after the newline are
+    data_load_utils.BLANK_CODE """
+
+    chars_univ, char_idx_univ = get_universal_chars_list()
+
+    if isinstance(tweets, pd.DataFrame):
+        codes = prev_util.encode_char_codes(
+            [text + '\n' for text in tweets['text'].iloc[rows]], char_idx_univ)
+    else:
+        # the cache holds the text only, so add the newline after the end of each one
+        codes = tweets.get_text_codes(rows, char_idx_univ)
+        lengths = tweets.lengths[rows]
+        codes = np.append(codes, np.full((len(codes), 1), prev_util.BLANK_CODE), axis=1)
+        codes[np.arange(len(codes)), lengths] = char_idx_univ['\n']
+
+    x_arr = np.full((len(codes), sequence_length), prev_util.BLANK_CODE,
+                    dtype=prev_util.get_code_dtype(len(chars_univ)))
+    codes = codes[:, 0:sequence_length]
+    x_arr[:, 0:codes.shape[1]] = codes
+
+    return x_arr
+
+
+def get_index_xy_batch(tweets, rows, sequence_length=161, emoji_indices=None):
+    """ the encoding='index' equivalent of an xy_generator batch. Takes the tweets in rows
+    (a slice or array of row numbers) of tweets, a pd.DataFrame or CorpusCache, and returns
+    (X, Y) where X is a (batch_size, sequence_length) array of character indices for each
+    tweet + newline and Y is X shifted on by one character, suitable for
+    sparse_categorical_crossentropy.
+    Positions after the end of a tweet (all-zero rows in the one-hot arrays) are
+    data_load_utils.BLANK_CODE, so mask them with sample_weight=(Y >= 0).
+    If emoji_indices is passed, X is a list [emoji, text] where emoji is (batch_size, 1) """
+
+    x_arr = get_sequence_codes(tweets, rows, sequence_length=sequence_length)
+
+    # y_arr is ahead by one character and omits starting character
+    y_arr = np.full_like(x_arr, prev_util.BLANK_CODE)
+    y_arr[:, 0:-1] = x_arr[:, 1:]
+
+    if emoji_indices:
+        emoji_arr = np.array([[emoji_indices[emoji]]
+                              for emoji in prev_util.get_batch_emojis(tweets, rows)],
+                             dtype=prev_util.get_code_dtype(len(emoji_indices)))
+        return ([emoji_arr, x_arr], y_arr)
 
-    def filter_handles(txt): return ' '.join(
-        word for word in txt.split(' ') if not word.startswith('@'))
+    return (x_arr, y_arr)
+
+
+def get_batch_n_codes(emoji_indices=None):
+    """ the number of codes of each array of a flattened batch, for one-hot encoding them """
+    n_chars = len(get_universal_chars_list()[0])
+    return ([len(emoji_indices)] if emoji_indices else []) + [n_chars, n_chars]
+
+
+def one_hot_batch(batch, emoji_indices=None, dtype=np.float64):
+    """ one-hot encodes an encoding='index' batch from get_index_xy_batch """
+    arrays = prev_util.flatten_batch(batch)
+    return prev_util.unflatten_batch(
+        [prev_util.one_hot_from_codes(arr, n, dtype=dtype)
+         for arr, n in zip(arrays, get_batch_n_codes(emoji_indices))], batch)
+
+
+def get_xy_batch(tweets, batch_num, batch_size=64, sequence_length=161, emoji_indices=None,
+                 encoding='onehot', dtype=np.float64, out=None):
+    """ random access version of xy_generator, takes the same arguments and returns batch
+    number batch_num (the tweets batch_num*batch_size:(batch_num+1)*batch_size). The batch is
+    newly allocated, unless out (a batch of the same shapes and dtypes) is given to be
+    written into """
+
+    return get_xy_for_rows(tweets, slice(batch_num*batch_size, (batch_num+1)*batch_size),
+                           sequence_length=sequence_length, emoji_indices=emoji_indices,
+                           encoding=encoding, dtype=dtype, out=out)
+
+
+def get_xy_for_rows(tweets, rows, sequence_length=161, emoji_indices=None, encoding='onehot',
+                    dtype=np.float64, out=None):
+    """ get_xy_batch for any rows of tweets, a slice or an array of row numbers """
+
+    assert encoding in ('onehot', 'index')
+
+    batch = get_index_xy_batch(tweets, rows, sequence_length=sequence_length,
+                               emoji_indices=emoji_indices)
+
+    if encoding == 'index' and out is None:
+        return batch
+
+    if out is None:
+        return one_hot_batch(batch, emoji_indices=emoji_indices, dtype=dtype)
+
+    arrays = prev_util.flatten_batch(batch)
+    n_codes = get_batch_n_codes(emoji_indices)
+    for arr, n, out_arr in zip(arrays, n_codes, prev_util.flatten_batch(out)):
+        if encoding == 'index':
+            out_arr[...] = arr
+        else:
+            prev_util.one_hot_from_codes(arr, n, out=out_arr)
 
-    def filter_chars(txt): return ''.join([c for c in txt if c in chars])
+    return out
 
-    def filter(txt): return filter_chars(filter_handles(txt))
 
-    return text.apply(filter)
+def get_sequence_lengths(tweets, sequence_length=161):
+    """ the length of the text + newline of every tweet of tweets (a pd.DataFrame or a
+    CorpusCache), truncated to sequence_length like get_sequence_codes """
 
+    if isinstance(tweets, pd.DataFrame):
+        lengths = tweets['text'].str.len().to_numpy()
+    else:
+        lengths = np.asarray(tweets.lengths)
+    return np.minimum(lengths.astype(np.int64) + 1, sequence_length)
 
-def xy_generator(tweets, batch_size=64, sequence_length=161, emoji_indices=None):
+
+def get_buckets(buckets, sequence_length=161):
+    """ the sorted bucket lengths, capped at sequence_length, with sequence_length last so
+    every tweet fits in a bucket """
+    return sorted(set(min(length, sequence_length) for length in buckets) | {sequence_length})
+
+
+def get_bucket_batches(lengths, buckets=DEFAULT_BUCKETS, batch_size=64, rng=None):
+    """ groups sequences of the given lengths into batches of sequences from the same bucket,
+    each bucket holding the sequences longer than the bucket before it and no longer than
+    its own length. Returns a list of (bucket length, row numbers) for one epoch. Each
+    bucket's last batch may be smaller than batch_size.
+    If rng (a np.random.Generator) is given the rows are shuffled within each bucket, and the
+    batches of all the buckets are shuffled together, otherwise they are in row order """
+
+    buckets = np.asarray(sorted(buckets))
+    bucket_of_row = np.searchsorted(buckets, lengths)  # the first bucket long enough
+    assert (bucket_of_row < len(buckets)).all(), 'sequences longer than the last bucket'
+
+    batches = []
+    for bucket, bucket_length in enumerate(buckets):
+        rows = np.flatnonzero(bucket_of_row == bucket)
+        if rng is not None:
+            rows = rng.permutation(rows)
+        batches.extend((int(bucket_length), rows[i:i + batch_size])
+                       for i in range(0, len(rows), batch_size))
+
+    if rng is not None:
+        batches = [batches[i] for i in rng.permutation(len(batches))]
+    return batches
+
+
+def bucketed_xy_generator(tweets, batch_size=64, sequence_length=161, buckets=DEFAULT_BUCKETS,
+                          emoji_indices=None, encoding='onehot', dtype=np.float64,
+                          shuffle=True, seed=None, metrics=None):
+    """ length bucketed version of xy_generator, see get_bucket_batches. Yields (X, Y, mask)
+    tuples indefinitely, where the time dimension of X and Y is the length of the batch's
+    bucket rather than sequence_length, and mask is a float32 (batch_size, bucket length)
+    array that is 0 at the padding positions of Y and 1 elsewhere, for keras' sample_weight
+    (with sample_weight_mode='temporal'). The batches are reshuffled every epoch if shuffle
+    is True, with a np.random.Generator seeded with seed. metrics is an optional
+    pipeline_metrics.PipelineMetrics, see xy_generator """
+
+    assert encoding in ('onehot', 'index')
+
+    lengths = get_sequence_lengths(tweets, sequence_length=sequence_length)
+    buckets = get_buckets(buckets, sequence_length=sequence_length)
+    rng = np.random.default_rng(seed) if shuffle else None
+
+    while True:
+        for bucket_length, rows in get_bucket_batches(lengths, buckets=buckets,
+                                                      batch_size=batch_size, rng=rng):
+            if metrics is not None:
+                metrics.start_batch()
+            batch = get_index_xy_batch(tweets, rows, sequence_length=bucket_length,
+                                       emoji_indices=emoji_indices)
+            if metrics is not None:
+                metrics.lap('codes', batch)
+            mask = (batch[1] >= 0).astype(np.float32)
+            if metrics is not None:
+                metrics.lap('mask', mask)
+            if encoding == 'onehot':
+                batch = one_hot_batch(batch, emoji_indices=emoji_indices, dtype=dtype)
+                if metrics is not None:
+                    metrics.lap('one_hot', batch)
+            if metrics is not None:
+                metrics.end_batch(batch + (mask,))
+            yield batch + (mask,)
+
+
+class BatchBufferPool:
+    """ a fixed set of n_buffers preallocated one-hot batches, for encoding the
+    encoding='index' batches of get_index_xy_batch (all with the same shapes as template)
+    without allocating new arrays. encode() takes a free buffer and only sets its ones, and
+    release() hands it back, clearing only the ones that were set rather than the whole
+    array. A batch belongs to its holder from encode() until release(), so a consumer can hold
+    on to up to n_buffers batches at once, eg. to prefetch them in another thread. encode()
+    waits for a buffer to be released if all of them are held """
+
+    def __init__(self, template, emoji_indices=None, n_buffers=2, dtype=np.float64):
+        assert n_buffers > 0
+        arrays = prev_util.flatten_batch(template)
+        self.n_codes = get_batch_n_codes(emoji_indices)
+        self.n_buffers = n_buffers
+        self.buffers = [prev_util.unflatten_batch(
+            [np.zeros(arr.shape + (n,), dtype=dtype) for arr, n in zip(arrays, self.n_codes)],
+            template) for _ in range(n_buffers)]
+        # the flat indices of the ones set in each buffer's arrays, cleared on release
+        self.set_indices = [None] * n_buffers
+        self.buffer_ids = dict((id(prev_util.flatten_batch(buffer)[0]), i)
+                               for i, buffer in enumerate(self.buffers))
+        self.free = list(range(n_buffers))
+        self.condition = threading.Condition()
+
+    def encode(self, batch, timeout=None):
+        """ one-hot encodes batch, an encoding='index' batch, into a free buffer and returns
+        it. Raises TimeoutError if no buffer is released within timeout seconds """
+
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.free, timeout=timeout):
+                raise TimeoutError('all {} batch buffers are held'.format(self.n_buffers))
+            i = self.free.pop()
+
+        set_indices = []
+        for codes, n, arr in zip(prev_util.flatten_batch(batch), self.n_codes,
+                                 prev_util.flatten_batch(self.buffers[i])):
+            assert codes.shape == arr.shape[0:-1], 'batch shapes differ from the template'
+            codes = codes.ravel()
+            positions = np.flatnonzero(codes >= 0)  # BLANK_CODE positions stay all-zero
+            indices = positions * n + codes[positions]
+            np.put(arr, indices, 1)
+            set_indices.append(indices)
+        self.set_indices[i] = set_indices
+
+        return self.buffers[i]
+
+    def release(self, batch):
+        """ hands a batch returned by encode back to the pool, after which it must not be
+        used """
+
+        i = self.buffer_ids[id(prev_util.flatten_batch(batch)[0])]
+        with self.condition:
+            assert i not in self.free, 'batch released twice'
+        for arr, indices in zip(prev_util.flatten_batch(batch), self.set_indices[i]):
+            np.put(arr, indices, 0)
+        self.set_indices[i] = None
+
+        with self.condition:
+            self.free.append(i)
+            self.condition.notify()
+
+
+def xy_generator(tweets, batch_size=64, sequence_length=161, emoji_indices=None,
+                 encoding='onehot', dtype=np.float64, buckets=None, seed=None, split=None,
+                 buffers=None, pool=None, metrics=None):
     """ Generator function that returns an (X, Y) tuple, where X and Y are a numpy
-    array of shape (batch_size, sequence_length, len(char_indices)
-    sequence_length is 160 (longest tweet) + newline """
+    array of shape (batch_size, sequence_length, len(char_indices).
+    tweets is a pd.DataFrame or a CorpusCache loaded by data_cache_utils
+    sequence_length is 160 (longest tweet) + newline
+    If encoding is 'index', X and Y are integer character indices of shape
+    (batch_size, sequence_length) instead, see get_index_xy_batch. Otherwise dtype is the
+    dtype of the one-hot arrays (np.bool_ and np.uint8 are 8x smaller than the default float64)
+    If buckets (a list of lengths, eg. DEFAULT_BUCKETS) is passed, the tweets are batched by
+    length with bucketed_xy_generator instead, which yields (X, Y, mask)
+    If split is a split name ('train', 'dev' or 'test'), only the tweets of that split are
+    used, see data_load_utils.select_split
+    By default every one-hot batch is newly allocated, so batches can be held for as long as
+    the consumer likes. If buffers is given, they are written into a ring of that many
+    preallocated batches instead, and each batch is only valid until buffers - 1 more batches
+    have been yielded. Keras' fit_generator takes batches ahead of training them (up to
+    max_queue_size queued, plus the one being trained and the one being built), so it needs
+    buffers of at least max_queue_size + 2. Or pass a BatchBufferPool as pool to manage the
+    buffers yourself, in which case every batch is yours until you release it
+    metrics is an optional pipeline_metrics.PipelineMetrics that records the time and bytes of
+    each stage of building the batches """
+
+    assert encoding in ('onehot', 'index')
+
+    tweets = prev_util.select_split(tweets, split)
+
+    if buckets:
+        yield from bucketed_xy_generator(tweets, batch_size=batch_size,
+                                         sequence_length=sequence_length, buckets=buckets,
+                                         emoji_indices=emoji_indices, encoding=encoding,
+                                         dtype=dtype, seed=seed, metrics=metrics)
+        return
 
     # NB remeber to append \n to all sequences and include it in char_indices
 
     # Iterate over the dataset
     batch_num = 0
-    n_batches = int(tweets.shape[0] / batch_size)  # terminate after last full batch for now
+    n_batches = int(len(tweets) / batch_size)  # terminate after last full batch for now
+    if n_batches == 0:  # in case tweets < batch_size
+        return
 
-    chars_univ, char_idx_univ = get_universal_chars_list()
+    def get_batch(batch_num):
+        # one column fetch (or cache read) for the whole batch, as character codes
+        return get_index_xy_batch(tweets, slice(batch_num*batch_size, (batch_num+1)*batch_size),
+                                  sequence_length=sequence_length, emoji_indices=emoji_indices)
 
-    x_dims = (batch_size, sequence_length, len(char_idx_univ))
-    x_arr = np.zeros(shape=x_dims)
-    y_arr = np.zeros(shape=(batch_size, sequence_length, len(char_idx_univ))
-                     )  # should it be sequence_length -1?
-    if emoji_indices:
-        # shape is (batch_size, sequence_length, tokens)
-        emoji_arr = np.zeros(shape=(batch_size, 1, len(emoji_indices)))
+    if encoding == 'index':
+        while True:
+            if metrics is not None:
+                metrics.start_batch()
+            batch = get_batch(batch_num)
+            if metrics is not None:
+                metrics.lap('codes', batch)
+                metrics.end_batch(batch)
+            yield batch
+            batch_num = (batch_num + 1) % n_batches  # loop indefinitely
 
-    while batch_num < n_batches:  # in case tweets < batch_size
+    owned = pool is None
+    held = collections.deque()  # the batches of our own pool, oldest first
 
-        # slice the batch
-        this_batch = tweets.iloc[(batch_num*batch_size):(batch_num+1)*batch_size]
+    while True:
+        if metrics is not None:
+            metrics.start_batch()
+        batch = get_batch(batch_num)
+        if metrics is not None:
+            metrics.lap('codes', batch)
 
-        for m in range(batch_size):
-            for i, char in enumerate(this_batch.iloc[m].loc['text'] + '\n'):
-                x_arr[m, i, char_idx_univ[char]] = 1
-                if i > 0:
-                    # y_arr is ahead by one character and omits starting character
-                    y_arr[m, i-1, char_idx_univ[char]] = 1
+        if pool is None and buffers is None:
+            out = one_hot_batch(batch, emoji_indices=emoji_indices, dtype=dtype)
+            if metrics is not None:
+                metrics.lap('one_hot', out)
+                metrics.end_batch(out)
+            yield out
+            batch_num = (batch_num + 1) % n_batches  # loop indefinitely
+            continue
 
-            if emoji_indices:
-                emoji_arr[m, 0, emoji_indices[this_batch.iloc[m].loc['emoji']]] = 1
+        if pool is None:
+            pool = BatchBufferPool(batch, emoji_indices=emoji_indices, n_buffers=buffers,
+                                   dtype=dtype)
+        if owned and len(held) == pool.n_buffers:
+            pool.release(held.popleft())
+            if metrics is not None:
+                metrics.lap('reset')
+        out = pool.encode(batch)
+        if owned:
+            held.append(out)
+        if metrics is not None:
+            metrics.lap('one_hot')
+            metrics.end_batch(out)
+        yield out
 
-        if emoji_indices:
-            yield ([emoji_arr, x_arr], y_arr)
-        else:
-            yield (x_arr, y_arr)
+        batch_num = (batch_num + 1) % n_batches  # loop indefinitely
@@ -1,21 +1,39 @@
 """ Functions that load downloaded emoji data and prepare train/dev/test sets for NNs """
 
 
+from collections.abc import Mapping
+from functools import lru_cache
+from itertools import chain
+import json
 from math import ceil
+from multiprocessing import Pool
 import os
+import re
 import string
+from types import MappingProxyType
 import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 # import emoji
 
 
 CHARACTERS = """ '",.\\/|?:;@'~#[]{}-=_+!"£$%^&*()abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ01234567890"""
 
+# codes used by encode_char_codes for padding and for characters missing from the index
+BLANK_CODE = -1
+UNKNOWN_CODE = -2
+
+# a space followed by a word starting with @, see get_text_normaliser
+HANDLE_REGEX = re.compile(' @[^ ]*')
+
+# the default train/dev/test split of the tweets, see assign_splits
+DEFAULT_SPLITS = (('train', 0.9), ('dev', 0.05), ('test', 0.05))
+
 
 def read_tweet_data(path):
     """" loads the csv (path) containing text and emoji data
     returns a pandas dataframe containing line number, text, and emoji """
-    data = pd.read_csv(path, dtype='object')
+    data = pd.read_csv(path, dtype='object', usecols=['text', 'emoji'])
     data = data.loc[:, ['text', 'emoji']]  # should contain two labelled columns
 
     # filter out comumn headers (rows where text='text' emoji='emoji')
@@ -24,25 +42,233 @@ def read_tweet_data(path):
     return data[filt]
 
 
-def filter_tweets_min_count(tweets, min_count=1000):
+def read_tweet_data_chunks(paths, chunksize=100000):
+    """ streaming version of read_tweet_data. Reads the csv file(s) in paths (a path or a list of
+    paths) chunksize rows at a time, loading only the text and emoji columns, and yields a
+    pandas dataframe of text and emoji for each chunk with the column header rows removed """
+
+    if isinstance(paths, str):
+        paths = [paths]
+
+    for path in paths:
+        for chunk in pd.read_csv(path, dtype='object', usecols=['text', 'emoji'],
+                                 chunksize=chunksize):
+            chunk = chunk[['text', 'emoji']]
+            yield chunk[chunk['emoji'] != 'emoji']
+
+
+def get_emoji_counts(paths, chunksize=100000):
+    """ counts the examples of each emoji in the csv file(s) in paths with one streaming pass,
+    returns a pd.Series of counts indexed by emoji """
+
+    counts = pd.Series(dtype=np.int64)
+    for chunk in read_tweet_data_chunks(paths, chunksize=chunksize):
+        counts = counts.add(chunk['emoji'].value_counts(), fill_value=0)
+
+    return counts.astype(np.int64)
+
+
+def read_filtered_tweet_chunks(paths, min_count=1000, chunksize=100000, filter_text=True,
+                               emoji_counts=None):
+    """ streaming equivalent of read_tweet_data -> filter_tweets_min_count ->
+    filter_text_for_handles over the csv file(s) in paths. Makes a first pass to count the
+    emojis (skipped if emoji_counts from get_emoji_counts is passed in), then yields chunks
+    holding only emojis with >min_count examples, with text filtered by filter_text_for_handles
+    unless filter_text is False. Peak memory depends on chunksize, not on the size of the files """
+
+    counts = emoji_counts if emoji_counts is not None else get_emoji_counts(paths, chunksize)
+    keep = counts.index[counts > min_count]
+
+    for chunk in read_tweet_data_chunks(paths, chunksize=chunksize):
+        chunk = chunk[chunk['emoji'].isin(keep)]
+        if filter_text:
+            chunk = chunk.assign(text=filter_text_for_handles(chunk['text']))
+        yield chunk
+
+
+def filter_tweets_min_count(tweets, min_count=1000, max_per_emoji=None, seed=0,
+                            emoji_stats=None):
     """ loads an m x 3 pandas dataframe (cols line number, text, emoji) and returns
-    filtered list with only emojis with >min_count examples """
-    return tweets.groupby('emoji').filter(lambda c: len(c) > min_count)
+    filtered list with only emojis with >min_count examples.
+    If max_per_emoji is set, emojis with more examples are downsampled to a random
+    max_per_emoji of them (chosen with seed), for class balanced training. The rows keep
+    their order and index either way. Pass emoji_stats from get_emoji_stats(tweets) to reuse
+    its counts rather than counting again """
+
+    emoji_codes, emojis = pd.factorize(tweets['emoji'])
+    if emoji_stats is not None:
+        counts = emoji_stats['count'].reindex(emojis, fill_value=0).to_numpy()
+    else:
+        counts = np.bincount(emoji_codes[emoji_codes >= 0], minlength=len(emojis))
+
+    # missing emojis (code -1) pick up the extra 0 count on the end
+    keep = np.append(counts, 0)[emoji_codes] > min_count
+
+    if max_per_emoji is not None:
+        keep &= get_emoji_ranks(emoji_codes, seed=seed) < max_per_emoji
+
+    return tweets[keep]
+
+
+def get_emoji_ranks(emoji_codes, seed=0):
+    """ a random ordering of the rows of each emoji: for each row, the number of rows with the
+    same emoji code that come before it in a permutation of the rows drawn with seed """
+
+    order = np.random.default_rng(seed).permutation(len(emoji_codes))
+    # sort the permuted rows by emoji, then count along each emoji's run of rows
+    order = order[np.argsort(emoji_codes[order], kind='stable')]
+    sorted_codes = emoji_codes[order]
+    run_starts = np.flatnonzero(np.diff(sorted_codes, prepend=sorted_codes[0:1] - 1))
+    run_lengths = np.diff(np.append(run_starts, len(order)))
+
+    ranks = np.empty(len(emoji_codes), dtype=np.int64)
+    ranks[order] = np.arange(len(order)) - np.repeat(run_starts, run_lengths)
+    return ranks
+
+
+def get_chunk_emoji_stats(texts, emoji_codes, n_emojis, chars=CHARACTERS):
+    """ the (n_emojis,) tweet counts and total text lengths, and the (n_emojis, len(vocab))
+    character counts of the characters in get_char_vocabulary(chars), of a chunk of texts
+    with the given emoji codes. Characters outside the vocabulary aren't counted """
 
+    vocab = get_char_vocabulary(chars)
+    counts = np.bincount(emoji_codes, minlength=n_emojis)
+    lengths = np.array([len(text) for text in texts], dtype=np.int64)
+    total_lengths = np.bincount(emoji_codes, weights=lengths, minlength=n_emojis)
 
-def filter_text_for_handles(text, chars=CHARACTERS):
-    """ takes an pd.Series of text, removes twitter handles from
-    text data - all text preceded by @ and then all characters not contained in
-    universal set"""
+    unicode_arr = np.asarray(texts, dtype=str)
+    char_counts = np.zeros(n_emojis * len(vocab), dtype=np.int64)
+    if unicode_arr.itemsize:
+        ordinals = unicode_arr.view(np.uint32).reshape(len(unicode_arr), -1)
+        table = vocab.lookup
+        codes = table[np.where(ordinals < len(table), ordinals, 1)]
+        known = codes >= 0  # not BLANK_CODE padding or UNKNOWN_CODE
+        rows = np.broadcast_to(emoji_codes[:, np.newaxis], codes.shape)
+        char_counts = np.bincount(rows[known] * len(vocab) + codes[known],
+                                  minlength=n_emojis * len(vocab))
+
+    return counts, total_lengths, char_counts.reshape(n_emojis, len(vocab))
+
+
+def get_emoji_stats(tweets, chars=CHARACTERS, processes=None, chunksize=100000):
+    """ a pd.DataFrame of statistics for each emoji of tweets, indexed by emoji (most
+    frequent first, like value_counts) with columns 'count', 'mean_length' and then a
+    histogram of the characters of the texts, one column per character of
+    get_char_vocabulary(chars). Computed in one pass over the tweets, in chunks of chunksize,
+    in a multiprocessing pool of that many processes if processes is set """
+
+    emoji_codes, emojis = pd.factorize(tweets['emoji'])
+    present = emoji_codes >= 0
+    texts = tweets['text'][present].tolist()
+    emoji_codes = emoji_codes[present]
+
+    chunks = [(texts[i:i + chunksize], emoji_codes[i:i + chunksize], len(emojis), chars)
+              for i in range(0, len(texts), chunksize)]
+    if processes and len(chunks) > 1:
+        with Pool(processes) as pool:
+            results = pool.starmap(get_chunk_emoji_stats, chunks)
+    else:
+        results = [get_chunk_emoji_stats(*chunk) for chunk in chunks]
+
+    vocab = get_char_vocabulary(chars)
+    counts = sum(result[0] for result in results) if results else np.zeros(len(emojis), int)
+    total_lengths = sum(result[1] for result in results) if results else np.zeros(len(emojis))
+    char_counts = sum(result[2] for result in results) if results else \
+        np.zeros((len(emojis), len(vocab)), dtype=np.int64)
+
+    stats = pd.DataFrame(char_counts, index=pd.Index(emojis, name='emoji'),
+                         columns=list(vocab.tokens))
+    stats.insert(0, 'count', counts)
+    stats.insert(1, 'mean_length', total_lengths / np.maximum(counts, 1))
+    return stats.sort_values('count', ascending=False, kind='stable')
+
+
+def get_tweet_hashes(tweets):
+    """ a stable uint64 hash of the text and emoji of every tweet of a pd.DataFrame, that
+    doesn't depend on the tweet's position, or on the python process """
+    return pd.util.hash_pandas_object(tweets[['text', 'emoji']], index=False).to_numpy()
+
+
+def assign_splits(hashes, splits=DEFAULT_SPLITS):
+    """ the split number of each tweet, given its hash from get_tweet_hashes. splits is a
+    sequence of (name, fraction) pairs, and a tweet goes to the split whose share of the hash
+    range its hash falls in, so it stays in the same split whatever else is in the corpus """
+
+    bounds = np.cumsum([fraction for _, fraction in splits])
+    assert np.isclose(bounds[-1], 1), 'split fractions must add up to 1'
+
+    # the top 53 bits of the hash as a float in [0, 1)
+    position = (np.asarray(hashes, dtype=np.uint64) >> np.uint64(11)) / float(2**53)
+    return np.minimum(np.searchsorted(bounds, position, side='right'),
+                      len(splits) - 1).astype(np.int8)
+
+
+def get_split_index(tweets, splits=DEFAULT_SPLITS):
+    """ the row numbers of the tweets (a pd.DataFrame) in each split, a dict of split name ->
+    sorted int32 array, see assign_splits """
+
+    split_of_row = assign_splits(get_tweet_hashes(tweets), splits=splits)
+    return dict((name, np.flatnonzero(split_of_row == i).astype(np.int32))
+                for i, (name, _) in enumerate(splits))
+
+
+def select_split(tweets, split, splits=DEFAULT_SPLITS, split_index=None):
+    """ the tweets of one split (a name from splits) of tweets, a pd.DataFrame or a CorpusCache
+    loaded by data_cache_utils, or all of the tweets if split is None.
+    A CorpusCache uses the split index saved in its cache directory. For a pd.DataFrame, pass
+    a split_index from get_split_index (or data_cache_utils.load_split_index) so the rows are
+    just gathered, otherwise every tweet is hashed to find them """
+
+    if split is None:
+        return tweets
 
-    def filter_handles(txt): return ' '.join(
-        word for word in txt.split(' ') if not word.startswith('@'))
+    if not isinstance(tweets, pd.DataFrame):
+        return tweets.get_split(split, splits=splits)
 
-    def filter_chars(txt): return ''.join([c for c in txt if c in chars])
+    if split_index is None:
+        split_index = get_split_index(tweets, splits=splits)
+    return tweets.iloc[split_index[split]].reset_index(drop=True)
 
-    def filter(txt): return filter_chars(filter_handles(txt))
 
-    return text.apply(filter)
+@lru_cache(maxsize=None)
+def get_text_normaliser(chars=CHARACTERS):
+    """ returns a function that filters a single string the way filter_text_for_handles does,
+    with the handle and character filters each compiled into a regex. Memoised per chars """
+
+    not_chars = re.compile('[^' + re.escape(chars) + ']+')
+
+    def normalise(txt):
+        # every word of ' ' + txt starts with a space, so removing ' @handle' drops each
+        # handle along with its separator, exactly like filtering txt.split(' ')
+        if '@' in txt:
+            txt = HANDLE_REGEX.sub('', ' ' + txt)[1:]
+        return not_chars.sub('', txt)
+
+    return normalise
+
+
+def normalise_texts(texts, chars=CHARACTERS):
+    """ runs the get_text_normaliser function over an iterable of strings, returns a list """
+
+    normalise = get_text_normaliser(chars)
+    return [normalise(txt) for txt in texts]
+
+
+def filter_text_for_handles(text, chars=CHARACTERS, processes=None, chunksize=50000):
+    """ takes an pd.Series of text, removes twitter handles from
+    text data - all text preceded by @ and then all characters not contained in
+    universal set. If processes is set, Series longer than chunksize are split into
+    chunks and filtered in a multiprocessing pool of that many processes """
+
+    if processes and len(text) > chunksize:
+        chunks = [(text.iloc[i:i + chunksize].tolist(), chars)
+                  for i in range(0, len(text), chunksize)]
+        with Pool(processes) as pool:
+            filtered = list(chain.from_iterable(pool.starmap(normalise_texts, chunks)))
+    else:
+        filtered = normalise_texts(text.tolist(), chars)
+
+    return pd.Series(filtered, index=text.index, name=text.name)
 
 
 def pad_text(text, length=160):
@@ -55,6 +281,64 @@ def pad_text(text, length=160):
     return padded_text
 
 
+def get_padded_codes(texts, char_index, length=160):
+    """ pads (or truncates) every text in texts with pad_text, and encodes them all at once
+    into a (len(texts), length) code matrix with encode_char_codes """
+
+    return encode_char_codes([pad_text(text, length=length) for text in texts], char_index)
+
+
+def pad_codes(codes, lengths, length=160, pad_code=0):
+    """ the code matrix equivalent of pad_text. Each row of codes holds a text of lengths[i]
+    characters, left-aligned; returns a (len(codes), length) matrix where each text is truncated
+    to length characters and right-aligned after pad_code (the code for ' ') """
+
+    lengths = np.minimum(lengths, length)
+
+    # column of codes that ends up in each column of the output, negative for padding
+    src = np.arange(length) - (length - lengths)[:, np.newaxis]
+    padded = codes[np.arange(len(codes))[:, np.newaxis], np.maximum(src, 0)]
+
+    return np.where(src >= 0, padded, pad_code).astype(codes.dtype)
+
+
+def get_batch_padded_codes(tweet, rows, char_index, length=160):
+    """ get_padded_codes for the tweets in rows (a slice or array of row numbers), where tweet
+    is either a pd.DataFrame or a CorpusCache loaded by data_cache_utils """
+
+    if isinstance(tweet, pd.DataFrame):
+        return get_padded_codes(tweet['text'].iloc[rows], char_index, length=length)
+
+    return pad_codes(tweet.get_text_codes(rows, char_index), tweet.lengths[rows],
+                     length=length, pad_code=char_index[' '])
+
+
+def get_batch_emojis(tweet, rows):
+    """ the emojis of the tweets in rows (a slice or array of row numbers), where tweet is
+    either a pd.DataFrame or a CorpusCache loaded by data_cache_utils """
+
+    if isinstance(tweet, pd.DataFrame):
+        return tweet['emoji'].iloc[rows]
+
+    return tweet.get_emojis(rows)
+
+
+def get_window_views(encoded, window_size=40, step=3):
+    """ takes an array of encoded tweets, dims (tweets, length, ...), and returns (x, y) where x is
+    a (tweets, m_per_tweet, window_size, ...) view of every window_size character moving window
+    and y is the (tweets, m_per_tweet, ...) view of the character following each window.
+    Windows are strided views into encoded, no characters are copied """
+
+    length = encoded.shape[1]
+
+    # sliding_window_view puts the window axis last, move it back next to the window index
+    windows = sliding_window_view(encoded, window_size, axis=1)
+    x_view = np.moveaxis(windows[:, 0:length - window_size:step], -1, 2)
+    y_view = encoded[:, window_size::step]
+
+    return x_view, y_view
+
+
 def get_series_data_from_tweet(tweet, length=160, window_size=40, step=3):
     """ input (tweet) is a pd.Series, a row of a pd.DataFrame
     returns corresponding lists sentences (of length window_size)
@@ -102,7 +386,7 @@ def get_unique_chars_list(list_strings):
 
     chars = sorted(list(set(one_big_string)))
     # print('Unique chars: ', len(chars))
-    char_indices = dict((char, chars.index(char)) for char in chars)
+    char_indices = dict((char, i) for i, char in enumerate(chars))
 
     return chars, char_indices
 
@@ -110,15 +394,158 @@ def get_unique_chars_list(list_strings):
 def get_emojis_list(emoji_pandas_series):
     """ Gets a sorted list of unique emojis, and a dictionary of inverses"""
     emojis = sorted(list(set(emoji_pandas_series)))
-    emoji_indices = dict((emoji, emojis.index(emoji)) for emoji in emojis)
+    emoji_indices = dict((emoji, i) for i, emoji in enumerate(emojis))
     return emojis, emoji_indices
 
 
+class Vocabulary(Mapping):
+    """ an immutable, ordered set of tokens (characters or emojis) that maps each token to its
+    index, so it can be used anywhere a char_index or emoji_index dict is expected.
+    Use get_vocabulary or get_char_vocabulary rather than building one directly, they return
+    the same object for the same tokens, so the index and lookup table are only built once """
+
+    def __init__(self, tokens):
+        tokens = tuple(tokens)
+        index = dict((token, i) for i, token in enumerate(tokens))
+        assert len(index) == len(tokens), 'vocabulary tokens must be unique'
+
+        self._tokens = tokens
+        self._index = MappingProxyType(index)
+        self._lookup = None
+        self._decode_table = None
+        self._token_index = None
+        self._token_array = None
+
+    @property
+    def tokens(self):
+        """ the tokens in index order """
+        return self._tokens
+
+    @property
+    def is_chars(self):
+        """ True if every token is a single character, so strings can be encoded """
+        return all(len(token) == 1 for token in self._tokens)
+
+    @property
+    def lookup(self):
+        """ read only table over character ordinals, lookup[ord(char)] == self[char], see
+        get_char_lookup_table. Only for vocabularies of single characters """
+        assert self.is_chars, 'lookup table needs single character tokens'
+        if self._lookup is None:
+            lookup = get_char_lookup_table(self._index)
+            lookup.setflags(write=False)
+            self._lookup = lookup
+        return self._lookup
+
+    def __getitem__(self, token):
+        return self._index[token]
+
+    def __iter__(self):
+        return iter(self._tokens)
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def __hash__(self):
+        return hash(self._tokens)
+
+    def __repr__(self):
+        return 'Vocabulary({} tokens)'.format(len(self))
+
+    def __setattr__(self, name, value):
+        if not name.startswith('_'):
+            raise AttributeError('Vocabulary is immutable')
+        super().__setattr__(name, value)
+
+    def as_lists(self):
+        """ (tokens, index) as a new list and dict, like get_unique_chars_list returns """
+        return list(self._tokens), dict(self._index)
+
+    def encode(self, tokens):
+        """ vectorised index lookup, an int array of self[token] with the same shape as tokens.
+        Raises KeyError for tokens not in the vocabulary """
+        tokens = np.asarray(tokens, dtype=object)
+        if self._token_index is None:  # built once, its hash table is reused by every call
+            self._token_index = pd.Index(self._tokens)
+        codes = self._token_index.get_indexer(tokens.ravel())
+        if (codes < 0).any():
+            raise KeyError(tokens.ravel()[int(np.argmax(codes < 0))])
+        return codes.reshape(tokens.shape)
+
+    def decode(self, codes):
+        """ the inverse of encode, an object array of the tokens at codes """
+        if self._token_array is None:
+            token_array = np.asarray(self._tokens, dtype=object)
+            token_array.setflags(write=False)
+            self._token_array = token_array
+        return self._token_array[np.asarray(codes)]
+
+    def encode_text(self, sentences):
+        """ encodes a list of strings into a code matrix with encode_char_codes, for a
+        vocabulary of single characters """
+        return encode_char_codes(sentences, self)
+
+    def decode_text(self, codes):
+        """ the inverse of encode_text, codes is (..., characters) and the result is an array
+        of strings with the BLANK_CODE entries dropped """
+        codes = np.asarray(codes)
+        if self._decode_table is None:
+            assert self.is_chars, 'decode_text needs single character tokens'
+            # ordinal of each token, with one extra entry at the end (ordinal 0) for BLANK_CODE
+            decode_table = np.array([ord(char) for char in self._tokens] + [0], dtype=np.uint32)
+            decode_table.setflags(write=False)
+            self._decode_table = decode_table
+
+        # the inverse of the trick in encode_char_codes, rows of ordinals viewed as strings
+        width = max(codes.shape[-1], 1)
+        ordinals = np.zeros(codes.shape[:-1] + (width,), dtype=np.uint32)
+        ordinals[..., 0:codes.shape[-1]] = self._decode_table[codes]
+        return ordinals.view('<U{}'.format(width))[..., 0].astype(str)
+
+    def to_json(self):
+        """ the vocabulary as a json string """
+        return json.dumps({'tokens': list(self._tokens)})
+
+    @staticmethod
+    def from_json(text):
+        """ the vocabulary saved by to_json """
+        return get_vocabulary(json.loads(text)['tokens'])
+
+    def save(self, path):
+        """ writes the vocabulary to a json file at path, eg. next to a model's .hdf5 file """
+        with open(path, 'w') as f:
+            f.write(self.to_json())
+
+    @staticmethod
+    def load(path):
+        """ reads a vocabulary written by save """
+        with open(path) as f:
+            return Vocabulary.from_json(f.read())
+
+
+def get_vocabulary(tokens):
+    """ the Vocabulary of tokens (any iterable of unique strings), in the given order """
+    return _get_vocabulary(tuple(tokens))
+
+
+@lru_cache(maxsize=64)
+def _get_vocabulary(tokens):
+    return Vocabulary(tokens)
+
+
+@lru_cache(maxsize=16)
+def get_char_vocabulary(chars=CHARACTERS):
+    """ the Vocabulary of the sorted unique characters of chars, the same characters and
+    indices as get_unique_chars_list(chars) """
+    return get_vocabulary(sorted(set(chars) | {' '}))
+
+
 def get_universal_chars_list():
     """ gets a universal set of text characters and basic punctuation, suitable for using
-    on all tweets. returns set of characters and the index. """
+    on all tweets. returns set of characters and the index (a Vocabulary). """
 
-    return get_unique_chars_list(CHARACTERS)
+    vocab = get_char_vocabulary(CHARACTERS)
+    return list(vocab.tokens), vocab
 
 
 def get_x_y_bool_arrays(sentences, next_chars):
@@ -140,22 +567,128 @@ def get_x_y_bool_arrays(sentences, next_chars):
     return (text_x, text_y)
 
 
+def get_char_lookup_table(char_index):
+    """ builds a lookup table over character ordinals, so that table[ord(char)] gives
+    char_index[char]. Ordinal 0 (numpy's padding for short strings) maps to BLANK_CODE and
+    any character not in char_index maps to UNKNOWN_CODE """
+
+    table = np.full(max(ord(char) for char in char_index) + 1, UNKNOWN_CODE, dtype=np.int16)
+    for char, idx in char_index.items():
+        table[ord(char)] = idx
+    table[0] = BLANK_CODE
+
+    return table
+
+
+def encode_char_codes(sentences, char_index):
+    """ batch encodes a list of strings (sentences) into an integer code matrix of dims
+    (len(sentences), longest sentence), where each entry is char_index[char].
+    Strings shorter than the longest are padded at the end with BLANK_CODE.
+    Raises KeyError for characters that aren't in char_index, like a dict lookup would """
+
+    if isinstance(char_index, Vocabulary):
+        table = char_index.lookup  # built once per vocabulary
+    else:
+        table = get_char_lookup_table(char_index)
+
+    # numpy stores unicode strings as fixed width UCS4, so viewing them as uint32
+    # gives the ordinal of every character without a python loop (even [] and [''] are one
+    # character wide). The width is explicit as reshape can't infer it with no sentences
+    unicode_arr = np.asarray(sentences, dtype=str)
+    ordinals = unicode_arr.view(np.uint32).reshape(len(unicode_arr), unicode_arr.itemsize // 4)
+
+    # ordinals beyond the end of the table can't be in char_index
+    ordinals = np.where(ordinals < len(table), ordinals, 1)  # ord 1 is never a valid char
+    codes = table[ordinals]
+
+    if (codes == UNKNOWN_CODE).any():
+        unknown = unicode_arr.view(np.uint32).reshape(codes.shape)[codes == UNKNOWN_CODE][0]
+        raise KeyError(chr(unknown))
+
+    return codes
+
+
+def one_hot_from_codes(codes, n_chars, dtype=np.bool_, out=None):
+    """ one-hot encodes an integer code matrix (any shape) as produced by encode_char_codes,
+    returns an array of dims codes.shape + (n_chars,). BLANK_CODE entries become all-zero rows.
+    If out is given, the result is written into it (and dtype is taken from it) """
+
+    if out is not None:
+        dtype = out.dtype
+
+    # the extra all-zero last row is picked out by BLANK_CODE (-1)
+    lookup = np.zeros((n_chars + 1, n_chars), dtype=dtype)
+    lookup[np.arange(n_chars), np.arange(n_chars)] = 1
+
+    if out is not None:
+        # take only writes straight into out without 'raise' mode's bounds check buffer
+        return lookup.take(codes, axis=0, out=out, mode='wrap')
+
+    return lookup.take(codes, axis=0)
+
+
+def get_code_dtype(n_codes):
+    """ smallest signed integer dtype that holds the codes 0..n_codes-1 as well as BLANK_CODE,
+    used for the encoding='index' arrays """
+
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_codes <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def get_index_window_batch(tweet, rows, char_index, length=160, window_size=40, step=3,
+                           emoji_index=None):
+    """ the encoding='index' equivalent of a convert_tweet_to_xy_generator batch. Takes the
+    tweets in rows (a slice or array of row numbers) of tweet, a pd.DataFrame or CorpusCache,
+    and returns (x, y) where x is an (m, window_size) array of character indices and y is the
+    (m,) array of next-character indices, suitable for sparse_categorical_crossentropy.
+    If emoji_index is passed, x is a list [text, emoji] where emoji is the (m,) array of
+    emoji indices for each window """
+
+    dtype = get_code_dtype(len(char_index))
+    codes = get_batch_padded_codes(tweet, rows, char_index, length=length).astype(dtype)
+    x_view, y_view = get_window_views(codes, window_size=window_size, step=step)
+
+    # reshape copies the windows out into a contiguous (m, w) array
+    x_fin = x_view.reshape(-1, window_size)
+    y_fin = y_view.reshape(-1)
+
+    if emoji_index:
+        emoji_codes = np.array([emoji_index[emoji] for emoji in get_batch_emojis(tweet, rows)],
+                               dtype=get_code_dtype(len(emoji_index)))
+        x_fin = [x_fin, np.repeat(emoji_codes, x_view.shape[1])]
+
+    return x_fin, y_fin
+
+
+def flatten_batch(batch):
+    """ flattens a batch, eg. (x, y) or ([x_text, x_emoji], y), into a list of its arrays """
+    if isinstance(batch, (list, tuple)):
+        return [arr for item in batch for arr in flatten_batch(item)]
+    return [batch]
+
+
+def unflatten_batch(arrays, structure):
+    """ the inverse of flatten_batch, where structure is a batch of the same nesting """
+    arrays = iter(arrays)
+
+    def rebuild(item):
+        if isinstance(item, (list, tuple)):
+            return type(item)(rebuild(sub_item) for sub_item in item)
+        return next(arrays)
+
+    return rebuild(structure)
+
+
 def get_x_bool_array(sentence, chars, char_index):
     """ similar to get_x_y_bool_arrays() but operates on a single
     sentence and returns a one-hot encoded bool array (dims len(sentence) x len(chars)).
     Series chars is a list of recognised characters and char_index is the corresponding index"""
 
-    # chars, char_index = get_unique_chars_list(sentence)
-
-    text_x = np.zeros((len(sentence), len(sentence[0]),
-                       len(chars)), dtype=np.bool)
-    # text_y = np.zeros((len(sentences), len(char_index)), dtype=np.bool)
-    for i, s in enumerate(sentence):
-        for pos, char in enumerate(s):
-            text_x[i, pos, char_index[char]] = 1
-        # text_y[i, char_index[next_chars[i]]] = 1
+    codes = encode_char_codes(sentence, char_index)[:, 0:len(sentence[0])]
 
-    return np.asarray(text_x)
+    return one_hot_from_codes(codes, len(chars))
 
 
 def get_y_bool_array(next_chars, char_index):
@@ -164,15 +697,9 @@ def get_y_bool_array(next_chars, char_index):
     Series chars is a list of recognised characters and char_index is the corresponding index"""
 
     # Pass in a global list/index of characters so it's the same encoding for all tweets
-    # chars, char_index = get_unique_chars_list(sentence)
-
-    # text_x = np.zeros((len(sentence), len(sentence[0]),
-    #                   len(chars)), dtype=np.bool)
-    text_y = np.zeros((len(next_chars), len(char_index)), dtype=np.bool)
-    for i in range(len(next_chars)):
-        text_y[i, char_index[next_chars[i]]] = 1
+    codes = encode_char_codes(next_chars, char_index)[:, 0:1].reshape(len(next_chars))
 
-    return np.asarray(text_y)
+    return one_hot_from_codes(codes, len(char_index))
 
 
 def get_emoji_bool_array(emoji, emoji_index):
@@ -212,11 +739,13 @@ def x_y_bool_array_to_sentence(text_x, text_y, chars, position=0, separator=Fals
     return decode_example(text_x[position], text_y[position])
 
 
-def convert_tweet_to_xy(tweet, length=160, window_size=40, step=3):
+def convert_tweet_to_xy(tweet, length=160, window_size=40, step=3, dtype=np.float64):
     """ converts a tweet (pd DataFrame with 'text' field) to x, y text pairs, where x is
     window_size character moving window over the text, and y is the expected next character.
     outputs an ndarray of dims (m, window_size, characters) where m is the final number of
-    training examples and characters is the number of characters in the set (78 by default) """
+    training examples and characters is the number of characters in the set (78 by default).
+    dtype is the dtype of the output arrays, np.bool_ or np.uint8 use 1/8th the memory of the
+    default float64 """
 
     # apply the function to split each tweet into multiple windows of 40 chars and
     # a corresponding n_char
@@ -248,8 +777,8 @@ def convert_tweet_to_xy(tweet, length=160, window_size=40, step=3):
               y_bool[0].shape[1])    # one-hot encoding for each character (78)
 
     # allocate space for the array
-    x_arr = np.zeros(shape=x_dims)
-    y_arr = np.zeros(shape=y_dims)
+    x_arr = np.zeros(shape=x_dims, dtype=dtype)
+    y_arr = np.zeros(shape=y_dims, dtype=dtype)
 
     for i, twit in enumerate(x_bool):
         x_arr[i] = twit
@@ -274,19 +803,140 @@ def convert_tweet_to_xy(tweet, length=160, window_size=40, step=3):
     return x_fin, y_fin
 
 
+def convert_tweet_to_xy_memmap(tweet, x_path, y_path, length=160, window_size=40, step=3,
+                               dtype=np.float64, chunksize=1024):
+    """ out-of-core version of convert_tweet_to_xy for corpora whose arrays don't fit in memory.
+    tweet is a pd.DataFrame or a CorpusCache. The (m, w, c) x and (m, c) y arrays that
+    convert_tweet_to_xy would return are written to the .npy files x_path and y_path,
+    chunksize tweets at a time. Each chunk is one-hot encoded straight from its character codes
+    into its own part of the files, which is only mapped while it is being written, so memory
+    use depends on chunksize and not on the number of tweets.
+    Returns x and y as read-only memory maps of the files """
+
+    assert length > window_size
+
+    chars_univ, char_idx_univ = get_universal_chars_list()
+    m_per_tweet = int(ceil((length - window_size) / step))
+    n_tweets = len(tweet)
+
+    outputs = []
+    for path, shape in [(x_path, (window_size, len(chars_univ))), (y_path, (len(chars_univ),))]:
+        # writes the header and sizes the file, the data itself isn't touched
+        arr = np.lib.format.open_memmap(path, mode='w+', dtype=dtype,
+                                        shape=(n_tweets * m_per_tweet,) + shape)
+        row_bytes = int(np.prod(shape)) * arr.dtype.itemsize
+        outputs.append((path, shape, arr.offset, row_bytes))
+        del arr
+
+    for start in range(0, n_tweets, chunksize):
+        rows = slice(start, min(start + chunksize, n_tweets))
+        codes = get_batch_padded_codes(tweet, rows, char_idx_univ, length=length)
+        n_windows = len(codes) * m_per_tweet
+
+        for (path, shape, offset, row_bytes), view in zip(
+                outputs, get_window_views(codes, window_size=window_size, step=step)):
+            out = np.memmap(path, dtype=dtype, mode='r+',
+                            offset=offset + start * m_per_tweet * row_bytes,
+                            shape=(n_windows,) + shape)
+            one_hot_from_codes(view.reshape((n_windows,) + shape[0:-1]), len(chars_univ),
+                               out=out)
+            out.flush()
+            del out
+
+    return np.load(x_path, mmap_mode='r'), np.load(y_path, mmap_mode='r')
+
+
+def get_xy_batch(tweet, batch_num, length=160, window_size=40, step=3, batch_size=64,
+                 emoji_set=None, encoding='onehot', dtype=np.float64, out=None):
+    """ random access version of convert_tweet_to_xy_generator, takes the same arguments and
+    returns batch number batch_num (the tweets batch_num*batch_size:(batch_num+1)*batch_size),
+    identical to the batch the generator would yield. The batch is newly allocated, unless out
+    (a batch of the same shapes and dtypes, eg. an earlier one) is given to be written into """
+
+    return get_xy_for_rows(tweet, slice(batch_num*batch_size, (batch_num+1)*batch_size),
+                           length=length, window_size=window_size, step=step,
+                           emoji_set=emoji_set, encoding=encoding, dtype=dtype, out=out)
+
+
+def get_xy_for_rows(tweet, rows, length=160, window_size=40, step=3, emoji_set=None,
+                    encoding='onehot', dtype=np.float64, out=None):
+    """ get_xy_batch for any rows of tweet, a slice or an array of row numbers """
+
+    assert length > window_size
+    assert encoding in ('onehot', 'index')
+
+    chars_univ, char_idx_univ = get_universal_chars_list()
+    emoji_idx = get_vocabulary(emoji_set) if emoji_set else None
+
+    if encoding == 'index':
+        batch = get_index_window_batch(tweet, rows, char_idx_univ, length=length,
+                                       window_size=window_size, step=step, emoji_index=emoji_idx)
+        if out is None:
+            return batch
+        for out_arr, arr in zip(flatten_batch(out), flatten_batch(batch)):
+            out_arr[...] = arr
+        return out
+
+    one_hot = one_hot_from_codes(get_batch_padded_codes(tweet, rows, char_idx_univ, length=length),
+                                 len(chars_univ), dtype=dtype)
+    x_view, y_view = get_window_views(one_hot, window_size=window_size, step=step)
+    n_tweets, m_per_tweet = x_view.shape[0:2]
+
+    if emoji_set:
+        emoji_codes = emoji_idx.encode(get_batch_emojis(tweet, rows))
+        emoji_one_hot = one_hot_from_codes(emoji_codes, len(emoji_set), dtype=dtype)
+
+    if out is None:
+        # reshape into (m, w, c) and (m, c) arrays, copying the windows out of the views
+        x_fin = x_view.reshape(-1, window_size, len(chars_univ))
+        y_fin = y_view.reshape(-1, len(chars_univ))
+        if emoji_set:
+            x_fin = [x_fin, np.repeat(emoji_one_hot, m_per_tweet, axis=0)]
+        return (x_fin, y_fin)
+
+    (x_fin, y_fin) = out
+    if emoji_set:
+        [x_fin, emoji_fin] = x_fin
+        emoji_fin.reshape(n_tweets, m_per_tweet, len(emoji_set))[...] = \
+            emoji_one_hot[:, np.newaxis]
+    x_fin.reshape(x_view.shape)[...] = x_view
+    y_fin.reshape(y_view.shape)[...] = y_view
+
+    return out
+
+
 def convert_tweet_to_xy_generator(tweet, length=160, window_size=40,
-                                  step=3, batch_size=64, emoji_set=None):
-    """ generator function that batch converts tweets (from pd DataFrame of tweets) to tuple of (x,y)
-    data, (where x is (m, window_size, character_set_size) ndarray and y is an (m,character_set_size)
+                                  step=3, batch_size=64, emoji_set=None, strided=False,
+                                  encoding='onehot', dtype=np.float64, split=None, metrics=None):
+    """ generator function that batch converts tweets (from pd DataFrame of tweets, or a
+    CorpusCache loaded by data_cache_utils) to tuple of (x,y) data, (where x is
+    (m, window_size, character_set_size) ndarray and y is an (m,character_set_size)
     dimensional array) suitable for feeding to keras fit_generator.
     If set of all emojis is passed in as emoji_set, then the x return
     value is a list containing m,emoji_size matrix as well as the text.
-    Num training examples per tweet given by math.ceil((length - window_size)/step)"""
+    Num training examples per tweet given by math.ceil((length - window_size)/step)
+    If strided is True, each padded tweet is one-hot encoded once and the windows are taken
+    as strided views of it (see get_window_views) rather than encoded copy by copy;
+    the batches are identical either way. A CorpusCache is always read the strided way.
+    If encoding is 'index', batches are integer character indices rather than one-hot arrays,
+    see get_index_window_batch. Otherwise dtype is the dtype of the one-hot batches, which are
+    encoded straight into buffers of that dtype (np.bool_ and np.uint8 are 8x smaller than
+    the default float64).
+    If split is a split name ('train', 'dev' or 'test'), only the tweets of that split are
+    used, see select_split.
+    metrics is an optional pipeline_metrics.PipelineMetrics that records the time and bytes of
+    each stage of building the batches."""
 
     assert length > window_size
+    assert encoding in ('onehot', 'index')
+
+    tweet = select_split(tweet, split)
 
     batch_num = 0
-    n_batches = int(tweet.shape[0] / batch_size)  # terminate after last full batch for now
+    n_batches = int(len(tweet) / batch_size)  # terminate after last full batch for now
+
+    # the window-by-window path needs the rows of a DataFrame
+    strided = strided or not isinstance(tweet, pd.DataFrame)
 
     # calculate num training examples per tweet
     m_per_tweet = int(ceil((length - window_size) / step))
@@ -294,7 +944,7 @@ def convert_tweet_to_xy_generator(tweet, length=160, window_size=40,
     # get the universal character set and its index
     chars_univ, char_idx_univ = get_universal_chars_list()
     if emoji_set:
-        emoji_idx = dict((emoji, emoji_set.index(emoji)) for emoji in emoji_set)
+        emoji_idx = get_vocabulary(emoji_set)
 
     # allocate ndarray to contain one-hot encoded batch
     x_dims = (batch_size,             # num tweets
@@ -306,49 +956,113 @@ def convert_tweet_to_xy_generator(tweet, length=160, window_size=40,
               m_per_tweet,
               len(chars_univ))        # length of the one-hot vector
 
-    x_arr = np.zeros(shape=x_dims)
-    y_arr = np.zeros(shape=y_dims)
+    if encoding == 'onehot':
+        x_arr = np.zeros(shape=x_dims, dtype=dtype)
+        y_arr = np.zeros(shape=y_dims, dtype=dtype)
 
-    if emoji_set:
+    if emoji_set and encoding == 'onehot':
         emoji_dims = (batch_size,
                       m_per_tweet,
                       len(emoji_set))
-        emoji_arr = np.zeros(shape=emoji_dims)
+        emoji_arr = np.zeros(shape=emoji_dims, dtype=dtype)
 
     while batch_num < n_batches:  # in case tweet < batch_size
 
-        # slice the batch
-        this_batch = tweet.iloc[(batch_num*batch_size):(batch_num+1)*batch_size]
-
-        # expand out all the tweets
-        if emoji_set:
-            zipped = this_batch.apply(
-                lambda x: get_emoji_and_series_data_from_tweet(
-                    x, length=length, window_size=window_size, step=step),
-                axis=1)
+        if metrics is not None:
+            metrics.start_batch()
 
-            # unzips the tuples into separate tuples of x, y
-            (x_tuple, emoji_tuple, y_tuple) = zip(*zipped)
+        # slice the batch
+        rows = slice(batch_num*batch_size, (batch_num+1)*batch_size)
+
+        if encoding == 'index':
+            x_fin, y_fin = get_index_window_batch(
+                tweet, rows, char_idx_univ, length=length, window_size=window_size, step=step,
+                emoji_index=emoji_idx if emoji_set else None)
+            if metrics is not None:
+                metrics.lap('index', x_fin, y_fin)
+
+            batch_num += 1  # do the next batch
+            batch_num = batch_num % n_batches  # loop indefinitely
+
+            if metrics is not None:
+                metrics.end_batch((x_fin, y_fin))
+            yield (x_fin, y_fin)
+            continue
+
+        if strided:
+            # encode each tweet once, then copy all the overlapping windows in one go
+            codes = get_batch_padded_codes(tweet, rows, char_idx_univ, length=length)
+            if metrics is not None:
+                metrics.lap('codes', codes)
+            one_hot = one_hot_from_codes(codes, len(chars_univ), dtype=dtype)
+            if metrics is not None:
+                metrics.lap('one_hot', one_hot)
+            x_view, y_view = get_window_views(one_hot, window_size=window_size, step=step)
+            if metrics is not None:
+                metrics.lap('windows')
+            x_arr[...] = x_view
+            y_arr[...] = y_view
+            if metrics is not None:
+                metrics.lap('copy', x_arr, y_arr)
+
+            if emoji_set:
+                # every window of a tweet shares the tweet's emoji
+                emoji_codes = emoji_idx.encode(get_batch_emojis(tweet, rows))
+                emoji_arr[...] = one_hot_from_codes(emoji_codes, len(emoji_set),
+                                                    dtype=dtype)[:, np.newaxis]
+                if metrics is not None:
+                    metrics.lap('emoji', emoji_arr)
 
         else:
-            zipped = this_batch.apply(
-                lambda x: get_series_data_from_tweet(
-                    x, length=length, window_size=window_size, step=step),
-                axis=1)
-
-            # unzips the tuples into separate tuples of x, y
-            (x_tuple, y_tuple) = zip(*zipped)
-
-        # turn each tuple into an series and then one-hot encode it
-        x_bool = pd.Series(x_tuple).apply(lambda x: get_x_bool_array(x, chars_univ, char_idx_univ))
-        y_bool = pd.Series(y_tuple).apply(lambda x: get_y_bool_array(x, char_idx_univ))
-
-        # convert it to the ndarray
-        for i, twit in enumerate(x_bool):
-            x_arr[i] = twit
-
-        for i, nchar in enumerate(y_bool):
-            y_arr[i] = nchar
+            this_batch = tweet.iloc[rows]
+            if metrics is not None:
+                metrics.lap('slice')
+
+            # expand out all the tweets
+            if emoji_set:
+                zipped = this_batch.apply(
+                    lambda x: get_emoji_and_series_data_from_tweet(
+                        x, length=length, window_size=window_size, step=step),
+                    axis=1)
+
+                # unzips the tuples into separate tuples of x, y
+                (x_tuple, emoji_tuple, y_tuple) = zip(*zipped)
+
+            else:
+                zipped = this_batch.apply(
+                    lambda x: get_series_data_from_tweet(
+                        x, length=length, window_size=window_size, step=step),
+                    axis=1)
+
+                # unzips the tuples into separate tuples of x, y
+                (x_tuple, y_tuple) = zip(*zipped)
+            if metrics is not None:
+                metrics.lap('windows')
+
+            # turn each tuple into an series and then one-hot encode it
+            x_bool = pd.Series(x_tuple).apply(
+                lambda x: get_x_bool_array(x, chars_univ, char_idx_univ))
+            y_bool = pd.Series(y_tuple).apply(lambda x: get_y_bool_array(x, char_idx_univ))
+            if metrics is not None:
+                metrics.lap('one_hot', *x_bool, *y_bool)
+
+            # convert it to the ndarray
+            for i, twit in enumerate(x_bool):
+                x_arr[i] = twit
+
+            for i, nchar in enumerate(y_bool):
+                y_arr[i] = nchar
+            if metrics is not None:
+                metrics.lap('copy', x_arr, y_arr)
+
+            if emoji_set:
+                emoji_bool = pd.Series(emoji_tuple).apply(
+                    lambda x: get_emoji_bool_array(x, emoji_idx))
+
+                for i, emoj in enumerate(emoji_bool):
+                    emoji_arr[i] = emoj
+                if metrics is not None:
+                    metrics.lap('emoji', emoji_arr)
 
         # finally, reshape into a (m, w, c) array
         # where m is training example, w is window size,
@@ -358,19 +1072,13 @@ def convert_tweet_to_xy_generator(tweet, length=160, window_size=40,
         # y is a (m, c) array, where m is training example and c is one-hot encoded character
         y_fin = y_arr.reshape(batch_size * m_per_tweet, len(chars_univ))
 
-        my_var = 'conditional_before'
-
         if emoji_set:
-            emoji_bool = pd.Series(emoji_tuple).apply(lambda x: get_emoji_bool_array(x, emoji_idx))
-
-            for i, emoj in enumerate(emoji_bool):
-                emoji_arr[i] = emoj
-
-            my_var = 'conditional_true'
             emoji_fin = emoji_arr.reshape(batch_size * m_per_tweet, len(emoji_set))
             x_fin = [x_fin, emoji_fin]
 
         batch_num += 1  # do the next batch
         batch_num = batch_num % n_batches  # loop indefinitely
 
+        if metrics is not None:
+            metrics.end_batch((x_fin, y_fin))
         yield (x_fin, y_fin)
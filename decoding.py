@@ -0,0 +1,267 @@
+""" Decoding strategies for the text generators in generate.
+
+    A strategy picks the next character of every sequence in a batch from the model's
+    predicted probabilities:
+      GreedySampler       the most likely character, like decode_sequence in the notebook
+      TemperatureSampler  a draw from the reweighted probabilities, like the notebooks' sample
+      TopKSampler         a draw from the k most likely characters
+      NucleusSampler      a draw from the most likely characters that make up top_p of the
+                          probability (nucleus sampling)
+      BeamSearch          keeps the width most likely continuations of every sequence
+
+    run_decoder drives any of them with a step function that runs the model, so the same
+    strategies work for the char-LSTM window generator and the seq2seq decoder. Each step
+    is one batched model call, and the sampling or candidate scoring for the whole batch is
+    done with array ops """
+
+import numpy as np
+import data_load_utils as util
+
+
+class Sampler:
+    """ base class for the strategies that draw one character per sequence. Called with the
+    (n, n_chars) probabilities, the original row number of each of the n sequences (to look
+    up per sequence settings) and a np.random.Generator, returns the n chosen codes """
+
+    def __call__(self, preds, rows, rng):
+        raise NotImplementedError
+
+
+class GreedySampler(Sampler):
+    """ always picks the most likely character """
+
+    def __call__(self, preds, rows, rng):
+        return preds.argmax(axis=1)
+
+
+def reweight(preds, temperature):
+    """ preds ** (1 / temperature), row by row, which is proportional to the notebooks'
+    exp(log(preds) / temperature). Rows are scaled by their maximum first so low temperatures
+    don't underflow. All-zero rows (eg. fully masked ones) get uniform weights rather than
+    NaNs. temperature is a scalar or one per row """
+
+    temperature = np.asarray(temperature, dtype=preds.dtype)
+    rowmax = preds.max(axis=1, keepdims=True)
+    empty = rowmax <= 0
+    if temperature.ndim == 0 and temperature == 1 and not empty.any():
+        return preds
+    if temperature.ndim == 1:
+        temperature = temperature[:, np.newaxis]
+    weights = (preds / np.where(empty, 1, rowmax)) ** (1 / temperature)
+    return np.where(empty, 1, weights)
+
+
+def sample_rows(weights, rng):
+    """ draws one column index from each row of the non-negative (n, m) weights, with
+    probability proportional to the weight, by inverse cdf sampling """
+
+    cumulative = np.cumsum(weights, axis=1)
+    draws = rng.random((len(weights), 1), dtype=cumulative.dtype) * cumulative[:, -1:]
+    samples = (cumulative <= draws).sum(axis=1)
+    return np.minimum(samples, weights.shape[1] - 1)  # guards against rounding at the top
+
+
+class TemperatureSampler(Sampler):
+    """ draws from the probabilities reweighted by temperature, a scalar or an array with one
+    temperature for each row of the batch. Rows with a temperature of 0 are greedy """
+
+    def __init__(self, temperature=1.0):
+        self.temperature = np.asarray(temperature, dtype=np.float64)
+
+    def get_temperature(self, rows):
+        """ the temperature of each of rows, with the greedy (0) temperatures set to 1 """
+        temperature = self.temperature if self.temperature.ndim == 0 else self.temperature[rows]
+        return np.where(temperature > 0, temperature, 1.0), temperature <= 0
+
+    def __call__(self, preds, rows, rng):
+        temperature, greedy = self.get_temperature(rows)
+        samples = sample_rows(reweight(preds, temperature), rng)
+        return np.where(greedy, preds.argmax(axis=1), samples)
+
+
+class TopKSampler(TemperatureSampler):
+    """ draws from the k most likely characters, reweighted by temperature """
+
+    def __init__(self, k=5, temperature=1.0):
+        super().__init__(temperature)
+        self.k = k
+
+    def __call__(self, preds, rows, rng):
+        temperature, greedy = self.get_temperature(rows)
+        k = min(self.k, preds.shape[1])
+        candidates = np.argpartition(preds, -k, axis=1)[:, -k:]
+        weights = reweight(np.take_along_axis(preds, candidates, axis=1), temperature)
+        picks = sample_rows(weights, rng)[:, np.newaxis]
+        samples = np.take_along_axis(candidates, picks, axis=1)[:, 0]
+        return np.where(greedy, preds.argmax(axis=1), samples)
+
+
+class NucleusSampler(TemperatureSampler):
+    """ draws from the smallest set of most likely characters whose probabilities, after
+    reweighting by temperature, add up to at least top_p """
+
+    def __init__(self, top_p=0.9, temperature=1.0):
+        super().__init__(temperature)
+        self.top_p = top_p
+
+    def __call__(self, preds, rows, rng):
+        temperature, greedy = self.get_temperature(rows)
+        weights = reweight(preds, temperature)
+
+        order = np.argsort(-weights, axis=1)
+        weights = np.take_along_axis(weights, order, axis=1)
+        cumulative = np.cumsum(weights, axis=1)
+        # keep each character while the ones before it make up less than top_p
+        in_nucleus = cumulative - weights < self.top_p * cumulative[:, -1:]
+        picks = sample_rows(np.where(in_nucleus, weights, 0), rng)[:, np.newaxis]
+        samples = np.take_along_axis(order, picks, axis=1)[:, 0]
+        return np.where(greedy, preds.argmax(axis=1), samples)
+
+
+def get_strategy(strategy=None, temperature=1.0):
+    """ strategy, or a greedy or temperature sampler for temperature if it is None """
+    if strategy is not None:
+        return strategy
+    temperature = np.asarray(temperature)
+    if temperature.ndim == 0 and temperature <= 0:
+        return GreedySampler()
+    return TemperatureSampler(temperature)
+
+
+def sample_batch(preds, temperature=1.0, rng=None):
+    """ vectorised version of the notebooks' sample(preds, temperature): draws one index from
+    each row of preds (n, n_classes) after reweighting it by temperature, which is a scalar or
+    one temperature per row. A temperature of 0 picks the most likely index """
+    preds = np.asarray(preds)
+    return get_strategy(temperature=temperature)(preds, np.arange(len(preds)),
+                                                 np.random.default_rng(rng))
+
+
+class BeamSearch:
+    """ beam search with width beams per sequence. Every step scores all the width x batch x
+    n_chars continuations at once, by adding the log probabilities of the next characters to
+    the running totals of the beams. Finished beams (ones that produced the stop character,
+    or reached the maximum length) are ranked by their total log probability divided by
+    length ** length_penalty, so 0 ranks by total probability and 1 by the mean per character.
+    A sequence stops early, and drops out of the batch, once it has width finished beams and
+    none of its live beams can do better """
+
+    def __init__(self, width=4, length_penalty=1.0):
+        assert width > 0 and length_penalty >= 0
+        self.width = width
+        self.length_penalty = length_penalty
+
+    def search(self, step, state, start_codes, n_steps, stop_code=None):
+        """ see run_decoder. Returns the best (n, n_steps) codes and their scores """
+
+        width = self.width
+        n = len(state[0])
+        beams = np.repeat(np.arange(n), width)
+        state = [arr[beams] for arr in state]
+        last_codes = None if start_codes is None else np.asarray(start_codes)[beams]
+
+        # only the first copy of each sequence is live at the start, the rest would be repeats
+        scores = np.full((n, width), -np.inf)
+        scores[:, 0] = 0
+        codes = np.full((n, width, n_steps), util.BLANK_CODE, dtype=np.int16)
+        done_scores = np.full((n, width), -np.inf)
+        done_codes = np.full((n, width, n_steps), util.BLANK_CODE, dtype=np.int16)
+        active = np.arange(n)
+
+        for i in range(n_steps):
+            preds, state = step(state, last_codes)
+            m, n_chars = len(active), preds.shape[1]
+            batch = np.arange(m)[:, np.newaxis]
+
+            # score every continuation of every beam in one go
+            with np.errstate(divide='ignore'):
+                log_preds = np.log(np.asarray(preds, dtype=np.float64)).reshape(m, width, n_chars)
+            candidates = (scores[:, :, np.newaxis] + log_preds).reshape(m, width * n_chars)
+
+            # the best 2 * width are enough to keep width live beams, even if width of them stop
+            k = min(2 * width, candidates.shape[1])
+            top = np.argpartition(-candidates, k - 1, axis=1)[:, 0:k]
+            top_scores = np.take_along_axis(candidates, top, axis=1)
+            parents, chars = np.divmod(top, n_chars)
+
+            top_codes = codes[batch, parents]
+            stops = chars == stop_code if stop_code is not None else np.zeros_like(top, bool)
+            top_codes[:, :, i] = np.where(stops, util.BLANK_CODE, chars)
+            ends = stops | (i == n_steps - 1)
+
+            # add the beams that end here to the finished beams, keeping the best width
+            finished = np.where(ends, top_scores / (i + 1) ** self.length_penalty, -np.inf)
+            all_scores = np.concatenate([done_scores[active], finished], axis=1)
+            best = np.argsort(-all_scores, axis=1, kind='stable')[:, 0:width]
+            done_scores[active] = np.take_along_axis(all_scores, best, axis=1)
+            done_codes[active] = np.concatenate([done_codes[active], top_codes], axis=1)[
+                batch, best]
+
+            # and carry on with the best width that haven't ended
+            live = np.argsort(np.where(ends, np.inf, -top_scores), axis=1, kind='stable')[
+                :, 0:width]
+            scores = np.where(np.take_along_axis(ends, live, axis=1), -np.inf,
+                              np.take_along_axis(top_scores, live, axis=1))
+            codes = top_codes[batch, live]
+            last_codes = np.take_along_axis(chars, live, axis=1)
+            beams = (batch * width + np.take_along_axis(parents, live, axis=1)).ravel()
+
+            # a live beam's total can only go down, so the best score it could still finish
+            # with is its total divided by the longest length. Sequences drop out once none of
+            # their live beams can beat their width best finished ones
+            best_possible = scores.max(axis=1) / n_steps ** self.length_penalty
+            running = done_scores[active].min(axis=1) < best_possible
+            if not running.all():
+                active, scores, codes = active[running], scores[running], codes[running]
+                last_codes = last_codes[running]
+                beams = beams.reshape(m, width)[running].ravel()
+            if len(active) == 0:
+                break
+
+            state = [arr[beams] for arr in state]
+            last_codes = last_codes.ravel()
+
+        return done_codes[:, 0], done_scores[:, 0]
+
+
+def run_decoder(step, state, n_steps, strategy, start_codes=None, stop_code=None, rng=None):
+    """ generates up to n_steps characters for a batch of sequences with strategy.
+
+    state is a list of arrays with one row per sequence (eg. the LSTM states, or the
+    one-hot windows). step(state, codes) runs the model for the batch, returning the (n, n_chars)
+    probabilities of the next characters and the new state. codes are the characters chosen
+    at the last step, or start_codes at the first. Rows of state are dropped, repeated and
+    reordered between steps as sequences finish or beams are chosen, so step can update
+    state in place but mustn't hold on to it.
+
+    A sequence ends when it produces stop_code (if given). Returns an (n, n_steps) code matrix,
+    with BLANK_CODE after the end of each sequence (and in place of stop_code) """
+
+    rng = np.random.default_rng(rng)
+
+    if isinstance(strategy, BeamSearch):
+        return strategy.search(step, state, start_codes, n_steps, stop_code=stop_code)[0]
+
+    n = len(state[0])
+    active = np.arange(n)  # the sequences still being generated, in the order of the batch
+    codes = np.full((n, n_steps), util.BLANK_CODE, dtype=np.int16)
+    last_codes = start_codes
+
+    for i in range(n_steps):
+        preds, state = step(state, last_codes)
+        last_codes = strategy(preds, active, rng)
+
+        if stop_code is None:
+            codes[active, i] = last_codes
+            continue
+        codes[active, i] = np.where(last_codes == stop_code, util.BLANK_CODE, last_codes)
+
+        # drop the finished sequences from the batch, along with their state
+        running = last_codes != stop_code
+        if not running.all():
+            active, last_codes = active[running], last_codes[running]
+            state = [arr[running] for arr in state]
+        if len(active) == 0:
+            break
+
+    return codes
@@ -0,0 +1,102 @@
+""" A naive Bayes emoji classifier that is trained in one streaming pass over the csv files.
+
+    The naive bayes notebook fits a TfidfVectorizer over all of the training tweets in memory
+    (and fits it again on the dev set, so the dev features don't match the training ones).
+    NaiveBayesEmojiClassifier hashes words into a fixed number of features instead, with
+    sklearn's stateless HashingVectorizer, so every chunk of tweets is vectorised the same way
+    without a vocabulary, and MultinomialNB.partial_fit updates the word counts chunk by chunk.
+    train_naive_bayes reads the csv files with data_load_utils.read_filtered_tweet_chunks, so
+    memory use depends on the chunk size and n_features, not on the size of the corpus.
+
+    The notebook gets the top words of each emoji by predicting a dense identity matrix over
+    the vocabulary. top_words computes the same P(emoji | word) for a list of candidate words
+    straight from the model's feature_log_prob_, and picks each emoji's top words with
+    argpartition """
+
+import numpy as np
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.naive_bayes import MultinomialNB
+import data_load_utils as util
+
+
+class NaiveBayesEmojiClassifier:
+    """ multinomial naive Bayes over hashed word features, for the emojis in emojis (the
+    classes, fixed up front so the model can be trained incrementally). The features are
+    l2 normalised term frequencies, like the notebook's TfidfVectorizer(use_idf=False).
+    alpha is the additive smoothing of MultinomialNB. Its default of 1 is too strong here, as
+    it is added to every one of the n_features hashed features, most of which are empty,
+    where the notebook only had 5000 """
+
+    def __init__(self, emojis, n_features=2**16, alpha=0.01):
+        self.emojis = util.get_vocabulary(emojis)
+        self.vectorizer = HashingVectorizer(n_features=n_features, alternate_sign=False)
+        self.model = MultinomialNB(alpha=alpha)
+
+    def transform(self, texts):
+        """ the (len(texts), n_features) sparse features of texts, an iterable of strings """
+        return self.vectorizer.transform(texts)
+
+    def partial_fit(self, texts, emojis):
+        """ updates the model with a chunk of tweets, texts and emojis are iterables of strings.
+        Emojis that aren't in the classifier's emojis raise a KeyError """
+        self.model.partial_fit(self.transform(texts), self.emojis.encode(list(emojis)),
+                               classes=np.arange(len(self.emojis)))
+        return self
+
+    def predict_proba(self, texts):
+        """ the (len(texts), len(emojis)) probability of each emoji for each of texts """
+        return self.model.predict_proba(self.transform(texts))
+
+    def predict(self, texts):
+        """ the most likely emoji for each of texts, as an array of strings """
+        return self.emojis.decode(self.model.predict(self.transform(texts)))
+
+    def score(self, texts, emojis):
+        """ the accuracy of predict on texts with the true emojis """
+        return float(np.mean(self.predict(texts) == np.asarray(list(emojis), dtype=object)))
+
+    def get_word_features(self, words):
+        """ the feature number of each of words. Two words can share a feature """
+        features = self.transform(words)
+        assert (np.diff(features.indptr) == 1).all(), 'words must be single tokens'
+        return features.indices
+
+    def top_words(self, words, n=10):
+        """ the n words out of words (a list of candidate words, eg. the vocabulary of a sample
+        of tweets, as the hashed features can't be turned back into words) with the highest
+        P(emoji | word) for each emoji. Returns a dict of emoji -> list of words, best first """
+
+        words = list(dict.fromkeys(words))
+        n = min(n, len(words))
+
+        # joint log likelihood of each single word tweet, like predict_proba(np.eye(vocab))
+        log_prob = (self.model.feature_log_prob_[:, self.get_word_features(words)] +
+                    self.model.class_log_prior_[:, np.newaxis])
+        log_prob -= np.logaddexp.reduce(log_prob, axis=0)
+
+        rows = np.arange(len(log_prob))[:, np.newaxis]
+        top = np.argpartition(-log_prob, n - 1, axis=1)[:, 0:n]
+        top = top[rows, np.argsort(-log_prob[rows, top], axis=1, kind='stable')]
+
+        words = np.asarray(words, dtype=object)
+        return dict((emoji, words[top[i]].tolist()) for i, emoji in enumerate(self.emojis))
+
+
+def train_naive_bayes(paths, min_count=500, chunksize=100000, n_features=2**16, alpha=0.01,
+                      emoji_counts=None):
+    """ trains a NaiveBayesEmojiClassifier on the csv file(s) in paths in one streaming pass
+    (after a counting pass, skipped if emoji_counts from get_emoji_counts is passed in), on
+    the emojis with >min_count examples and with the text filtered like
+    read_filtered_tweet_chunks """
+
+    if emoji_counts is None:
+        emoji_counts = util.get_emoji_counts(paths, chunksize=chunksize)
+    emojis = sorted(emoji_counts.index[emoji_counts > min_count])
+
+    classifier = NaiveBayesEmojiClassifier(emojis, n_features=n_features, alpha=alpha)
+    for chunk in util.read_filtered_tweet_chunks(paths, min_count=min_count,
+                                                 chunksize=chunksize, emoji_counts=emoji_counts):
+        if len(chunk):
+            classifier.partial_fit(chunk['text'], chunk['emoji'])
+
+    return classifier
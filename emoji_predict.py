@@ -0,0 +1,231 @@
+""" Online emoji prediction with the char-LSTM classifier (emoji_model-0.650.h5).
+
+    The notebook builds a dense (batch, max_sequence_len, n_chars) float tensor row by row with
+    iterrows, runs the model and takes np.argmax of each row in a list comprehension.
+    EmojiClassifier compiles the model's weights into a serving path instead:
+
+      - texts are filtered with data_load_utils.normalise_texts and encoded to character codes
+        in one vectorised pass, and never one-hot encoded. The LSTM's input projection of a
+        one-hot character is a row of its kernel, so the projections are a table lookup
+      - a batch is only as long as its longest text (up to the model's window), not the window.
+        Texts are left padded with spaces like pad_text, and the LSTM state after every number
+        of leading spaces is computed once when the model is compiled, so a batch starts from
+        the state after the padding it skips. Predictions don't depend on the batch a text is in
+      - the top k emojis are picked with argpartition, for the whole batch at once
+
+    MicroBatcher collects texts submitted concurrently (eg. by the threads of a web server) into
+    batches of up to max_batch_size, waiting at most max_delay seconds for a batch to fill """
+
+from concurrent.futures import Future
+from functools import lru_cache
+import os
+import queue
+import threading
+from timeit import default_timer as timer
+import numpy as np
+import data_load_utils as util
+import inference
+
+EMOJI_MODEL = 'emoji_model-0.650.h5'
+
+
+def get_labels_path(path):
+    """ where the emoji labels of the model at path are saved (with Vocabulary.save), eg.
+    emoji_model-0.650.labels.json """
+    return os.path.splitext(path)[0] + '.labels.json'
+
+
+def top_k_classes(probs, k=1):
+    """ the (n, k) class numbers and probabilities of the k most likely classes of each row of
+    the (n, n_classes) probs, most likely first """
+
+    k = min(k, probs.shape[1])
+    rows = np.arange(len(probs))[:, np.newaxis]
+    # argpartition finds the k largest in linear time, then only those k are sorted
+    top = np.argpartition(-probs, k - 1, axis=1)[:, 0:k]
+    top = top[rows, np.argsort(-probs[rows, top], axis=1, kind='stable')]
+    return top, probs[rows, top]
+
+
+class EmojiClassifier:
+    """ a char-LSTM classifier (an InferenceModel with one LSTM followed by Dense layers, like
+    emoji_model-0.650.h5) compiled for serving. labels is the emoji of each output class, if
+    None the class numbers are returned instead. vocab is the model's character set, by
+    default the universal one; texts are filtered to the characters in chars """
+
+    def __init__(self, model, labels=None, vocab=None, chars=util.CHARACTERS):
+        lstms = model.get_layer_config('LSTM')
+        dense = model.get_layer_config('Dense')
+        assert len(lstms) == 1 and not lstms[0]['config']['return_sequences'] and dense, \
+            'not a char-LSTM classifier model'
+
+        self.vocab = util.get_char_vocabulary() if vocab is None else vocab
+        self.chars = chars
+        self.window_size = model.input_shape[1]
+        assert model.input_shape[2] == len(self.vocab), 'model and vocabulary sizes differ'
+
+        config = lstms[0]['config']
+        kernel, recurrent_kernel, bias = model.weights[config['name']]
+        self.recurrent_kernel = recurrent_kernel
+        self.recurrent_activation = inference.ACTIVATIONS[config['recurrent_activation']]
+        # the input projection (with bias) of each character's one-hot vector
+        self.projections = kernel + bias
+
+        self.dense = [(model.weights[layer['config']['name']],
+                       inference.ACTIVATIONS[layer['config']['activation']]) for layer in dense]
+        n_classes = self.dense[-1][0][0].shape[1]
+        assert labels is None or len(labels) == n_classes, 'model and labels sizes differ'
+        self.labels = labels
+
+        self.pad_states = self.get_pad_states()
+
+    def get_pad_states(self):
+        """ the (window_size + 1, units) LSTM states h and c after 0, 1 ... window_size
+        leading spaces, starting from zeros """
+
+        units = self.recurrent_kernel.shape[0]
+        h = np.zeros((self.window_size + 1, units), dtype=np.float32)
+        c = np.zeros((self.window_size + 1, units), dtype=np.float32)
+        pad = self.projections[self.vocab[' ']][np.newaxis]
+        for i in range(self.window_size):
+            h[i + 1], c[i + 1] = inference.lstm_projected_step(
+                pad, h[i:i + 1], c[i:i + 1], self.recurrent_kernel, self.recurrent_activation)
+        return h, c
+
+    def encode(self, texts):
+        """ filters texts and encodes them to a (len(texts), length) code matrix, right aligned
+        after space padding, where length is the longest (truncated) text. The same as the
+        last length characters of get_padded_codes(texts, vocab, window_size) """
+
+        texts = [text[0:self.window_size]
+                 for text in util.normalise_texts(texts, chars=self.chars)]
+        lengths = np.array([len(text) for text in texts], dtype=np.int64)
+        length = int(lengths.max()) if len(texts) else 0
+        codes = self.vocab.encode_text(texts)
+        return util.pad_codes(codes, lengths, length=length, pad_code=self.vocab[' '])
+
+    def predict_proba(self, texts):
+        """ the (len(texts), n_classes) class probabilities of texts, a list of strings """
+
+        codes = self.encode(texts)
+        n, length = codes.shape
+        h = np.repeat(self.pad_states[0][np.newaxis, self.window_size - length], n, axis=0)
+        c = np.repeat(self.pad_states[1][np.newaxis, self.window_size - length], n, axis=0)
+
+        projected = self.projections[codes]
+        for t in range(length):
+            h, c = inference.lstm_projected_step(projected[:, t], h, c, self.recurrent_kernel,
+                                                 self.recurrent_activation)
+
+        x = h
+        for weights, activation in self.dense:
+            kernel, bias = weights if len(weights) == 2 else (weights[0], 0)
+            x = activation(x @ kernel + bias)
+        return x
+
+    def predict(self, texts, top_k=1):
+        """ the top_k emojis of each of texts, a list of strings. Returns a list with a list of
+        (emoji, probability) pairs for each text, most likely first """
+
+        classes, probs = top_k_classes(self.predict_proba(texts), top_k)
+        if self.labels is not None:
+            classes = np.asarray(self.labels.tokens if isinstance(self.labels, util.Vocabulary)
+                                 else self.labels, dtype=object)[classes]
+        return [list(zip(row_classes.tolist(), row_probs.tolist()))
+                for row_classes, row_probs in zip(classes, probs)]
+
+
+@lru_cache(maxsize=4)
+def get_classifier(path=EMOJI_MODEL):
+    """ the EmojiClassifier for the model file at path, loaded with inference.load_model, with
+    the labels saved next to it (see get_labels_path) if there are any. Loaded once per path """
+
+    labels_path = get_labels_path(path)
+    labels = util.Vocabulary.load(labels_path) if os.path.exists(labels_path) else None
+    return EmojiClassifier(inference.load_model(path), labels=labels)
+
+
+def predict_emojis(texts, top_k=1, classifier=None):
+    """ predicts the top_k emojis for each of texts (a list of strings) with one pass of the
+    classifier, by default get_classifier(). Returns a list of (emoji, probability) lists """
+    if classifier is None:
+        classifier = get_classifier()
+    return classifier.predict(list(texts), top_k=top_k)
+
+
+class MicroBatcher:
+    """ runs predict_batch (eg. EmojiClassifier.predict) on batches of the items passed to
+    submit from any number of threads. A batch is sent as soon as it has max_batch_size items,
+    or max_delay seconds after its first item arrived. submit returns a
+    concurrent.futures.Future of the item's result. Use close(), or a with block, to stop the
+    worker thread after the submitted items are done """
+
+    def __init__(self, predict_batch, max_batch_size=64, max_delay=0.005):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.requests = queue.Queue()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, item):
+        """ queues item for the next batch, returns a Future of its result """
+        if self.closed:
+            raise RuntimeError('MicroBatcher is closed')
+        future = Future()
+        self.requests.put((item, future))
+        return future
+
+    def __call__(self, item):
+        """ the result for item, blocking until its batch is done """
+        return self.submit(item).result()
+
+    def get_batch(self):
+        """ the next batch of (item, future) requests, or None once closed """
+
+        request = self.requests.get()
+        if request is None:
+            return None
+        batch = [request]
+        deadline = timer() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - timer()
+            try:
+                request = self.requests.get(timeout=timeout) if timeout > 0 else \
+                    self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                self.requests.put(None)  # finish this batch, then stop
+                break
+            batch.append(request)
+        return batch
+
+    def run(self):
+        """ worker thread loop """
+        while True:
+            batch = self.get_batch()
+            if batch is None:
+                break
+            items, futures = zip(*batch)
+            try:
+                results = self.predict_batch(list(items))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.requests.put(None)
+            self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,132 @@
+""" Batched text generation from the char-LSTM tweet models (models/tweet_gen_model-*.hdf5).
+
+    The notebooks generate one tweet at a time, re-encoding the whole seed window and calling
+    model.predict on a batch of one for every character. generate_text advances any number of
+    seeds in lockstep instead: each step is a single forward pass over all of the windows, the
+    sampled characters are drawn for every sequence at once, and the one-hot window buffer is
+    shifted along in place rather than rebuilt.
+
+    model can be a keras model, or any function that maps a (n, window_size, n_chars) batch of
+    one-hot windows to a (n, n_chars) array of next character probabilities.
+
+    decode_sequences does the same for the seq2seq emoji to tweet models, running the encoder
+    once for a batch of emojis and the single step decoder once per character for the whole
+    batch, with finished tweets dropping out. inference.NumpySeq2Seq is a numpy only version of
+    the encoder/decoder pair, for testing and benchmarking the decoding loop without keras.
+
+    Both take a strategy from decoding (beam search, top-k or nucleus sampling) in place of
+    the default temperature sampling """
+
+import numpy as np
+import data_load_utils as util
+import data_load_seq2seq_utils as s2s_util
+import decoding
+import inference
+
+MAX_TWEET_LENGTH = 160
+
+
+def load_generator_model(path, use_keras=False):
+    """ loads a saved tweet generator model, eg. models/tweet_gen_model-0.776_1.hdf5, with the
+    numpy runtime in inference, or with keras if use_keras is True """
+    if use_keras:
+        import keras
+        return keras.models.load_model(path)
+    return inference.load_model(path)
+
+
+def get_predict_function(model):
+    """ a function from a batch of inputs to a batch of predictions for model, which is either
+    a keras model (predicted in one batch) or a plain function """
+    if not hasattr(model, 'predict'):
+        return model
+
+    def predict(inputs):
+        batch_size = len(inputs[0]) if isinstance(inputs, list) else len(inputs)
+        return model.predict(inputs, batch_size=batch_size, verbose=0)
+
+    return predict
+
+
+def get_seed_windows(seeds, window_size=64, vocab=None, dtype=np.float32):
+    """ one-hot encodes the seed strings into a (len(seeds), window_size, len(vocab)) buffer.
+    Seeds are truncated or left padded with pad_text, the same as in the notebooks """
+
+    if vocab is None:
+        vocab = util.get_char_vocabulary()
+
+    codes = vocab.encode_text([util.pad_text(seed, length=window_size) for seed in seeds])
+    return util.one_hot_from_codes(codes, len(vocab), dtype=dtype)
+
+
+def generate_text(model, seeds, n_chars=96, temperature=1.0, window_size=None, vocab=None,
+                  emojis=None, rng=None, dtype=np.float32, strategy=None):
+    """ generates n_chars characters following each of the seed strings, returns a list of the
+    generated strings (without the seeds).
+
+    temperature is a scalar, or a sequence with one temperature per seed. window_size defaults
+    to the window the model was trained on, and vocab to the universal character set.
+    For the joint text/emoji models, pass emojis, a (len(seeds), n_emojis) one-hot array that
+    is fed to the model as a second input. rng is a seed or np.random.Generator.
+    strategy is one of the decoding strategies (eg. decoding.BeamSearch), in place of sampling
+    with temperature """
+
+    if window_size is None:
+        window_size = model.input_shape[0][1] if emojis is not None else model.input_shape[1]
+    if vocab is None:
+        vocab = util.get_char_vocabulary()
+
+    predict = get_predict_function(model)
+
+    state = [get_seed_windows(seeds, window_size=window_size, vocab=vocab, dtype=dtype)]
+    if emojis is not None:
+        state.append(np.asarray(emojis, dtype=dtype))
+
+    def step(state, codes):
+        window = state[0]
+        if codes is not None:
+            # shift every window one character to the left, and add the chosen characters
+            window[:, 0:-1] = window[:, 1:]
+            window[:, -1] = 0
+            window[np.arange(len(window)), -1, codes] = 1
+        return predict(state if emojis is not None else window), state
+
+    codes = decoding.run_decoder(step, state, n_chars,
+                                 decoding.get_strategy(strategy, temperature), rng=rng)
+    return vocab.decode_text(codes).tolist()
+
+
+def decode_sequences(encoder_model, decoder_model, emojis, max_length=MAX_TWEET_LENGTH,
+                     temperature=0, rng=None, vocab=None, dtype=np.float32, strategy=None):
+    """ generates one tweet for each row of emojis, a (n, n_emojis) or (n, 1, n_emojis) one-hot
+    array, with the seq2seq encoder and decoder models (keras models or functions such as
+    inference.NumpySeq2Seq.encode and decode). Returns a list of n strings, without the final
+    newline.
+
+    Like decode_sequence in the notebook, decoding starts from a newline and a tweet is finished
+    when it produces a newline or grows longer than max_length, and at that point it is dropped
+    from the batch passed to the decoder. temperature 0 (the default) is greedy decoding, as in
+    the notebook, otherwise characters are sampled with temperature, unless another decoding
+    strategy is given """
+
+    if vocab is None:
+        _, vocab = s2s_util.get_universal_chars_list()
+
+    encode = get_predict_function(encoder_model)
+    decode = get_predict_function(decoder_model)
+
+    emojis = np.asarray(emojis, dtype=dtype)
+    if emojis.ndim == 2:
+        emojis = emojis[:, np.newaxis, :]
+    stop_code = vocab['\n']
+
+    def step(state, codes):
+        target = util.one_hot_from_codes(codes[:, np.newaxis], len(vocab), dtype=dtype)
+        preds, h, c = decode([target] + state)
+        return preds[:, -1, :], [h, c]
+
+    codes = decoding.run_decoder(step, list(encode(emojis)), max_length + 1,
+                                 decoding.get_strategy(strategy, temperature),
+                                 start_codes=np.full(len(emojis), stop_code),
+                                 stop_code=stop_code, rng=rng)
+    return vocab.decode_text(codes).tolist()
@@ -0,0 +1,661 @@
+""" An asyncio service for emoji conditioned tweet generation, for the seq2seq encoder/decoder
+    models and the joint text/emoji models (models/text_emoji_joint_gen_model-*.hdf5).
+
+    generate.decode_sequences decodes one fixed batch until all of its tweets are finished.
+    GenerationService instead keeps a single running batch of sequences from any number of
+    concurrent requests (continuous batching). Every step is one model call for all of them;
+    finished sequences leave the batch straight away and queued requests join it at the next
+    step (after their own first step, see Seq2SeqEngine.first_step), so short and long tweets
+    don't hold each other up.
+
+    Requests wait in a bounded queue. When it is full generate waits for room (backpressure),
+    and raises ServiceBusy if there is none before its timeout. A request that isn't finished
+    by its timeout raises asyncio.TimeoutError and its sequences are dropped from the batch.
+    The model runs in a worker thread, so the event loop stays free to take requests.
+    Seq2SeqEngine can keep the encoder states of each emoji, the decoder states after each
+    seed, and the first step after it in a state_cache.StateCache, so the first character of
+    a repeated emoji and seed is sampled without running the models.
+
+    serve() puts a service behind a minimal HTTP/1.1 server on a TCP port or a Unix socket:
+      POST /generate  {"emoji": ..., "n": 1, "temperature": 1.0, "max_length": 160,
+                       "timeout": null, "seed": null}  ->  {"tweets": [...]}
+      GET /stats      the service's counters
+
+    run with: python generation_service.py (--seq2seq emoji_s2s.h5 | --joint MODEL | --stub)
+              [--emojis labels.json] [--port 8000 | --unix PATH] [--cache-mb 64] """
+
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import numpy as np
+import data_load_utils as util
+import data_load_seq2seq_utils as s2s_util
+import decoding
+import emoji_predict
+import generate
+import inference
+import state_cache
+
+
+class ServiceBusy(Exception):
+    """ raised by GenerationService.generate when the request queue stays full until the
+    request's timeout """
+
+
+class Seq2SeqEngine:
+    """ the seq2seq encoder and decoder (keras models, or functions such as
+    inference.NumpySeq2Seq.encode and decode) as a GenerationService engine. emojis are the
+    emoji of each input of the encoder. Each sequence starts from a newline and stops at the
+    next one, as in generate.decode_sequences, and continues from its seed (by default seed)
+    after the newline.
+
+    With a state_cache.StateCache as cache, the encoder states of each emoji and the decoder
+    states after each seed are kept, along with the probabilities of the first step after the
+    seed, so first_step() for an emoji and seed seen before doesn't run the models at all.
+    check_weights() drops them when
+    the models' weights have changed in place. A GenerationService calls it every
+    check_weights_every seconds, or call it (or the service's check_weights) yourself
+    straight after changing the weights """
+
+    def __init__(self, encoder_model, decoder_model, emojis, vocab=None,
+                 max_length=generate.MAX_TWEET_LENGTH, dtype=np.float32, seed='', cache=None):
+        self.models = (encoder_model, decoder_model)
+        self.encode = generate.get_predict_function(encoder_model)
+        self.decode = generate.get_predict_function(decoder_model)
+        self.emojis = util.get_vocabulary(emojis)
+        self.vocab = s2s_util.get_universal_chars_list()[1] if vocab is None else vocab
+        self.stop_code = self.vocab['\n']
+        self.max_length = max_length
+        self.dtype = dtype
+        self.seed = seed
+        self.cache = cache
+        self.fingerprint = None if cache is None else \
+            state_cache.get_weights_fingerprint(*self.models)
+
+    def check_weights(self):
+        """ rehashes the models' weights, and drops the cached states of the old weights if
+        they changed. Returns whether they did """
+        if self.cache is None:
+            return False
+        fingerprint = state_cache.get_weights_fingerprint(*self.models)
+        if fingerprint == self.fingerprint:
+            return False
+        self.cache.invalidate(self.fingerprint)
+        self.fingerprint = fingerprint
+        return True
+
+    def start(self, emoji_codes, seeds=None):
+        """ the state rows and first codes of new sequences for the emojis in emoji_codes,
+        continuing from seeds (a string or None for the default seed, for each sequence) """
+        seeds = [None] * len(emoji_codes) if seeds is None else seeds
+        prefixes = ['\n' + (self.seed if seed is None else seed) for seed in seeds]
+        # the last character of the prefix is the first code passed to step
+        state = self.get_states(emoji_codes, [prefix[0:-1] for prefix in prefixes])
+        return state, self.vocab.encode([prefix[-1] for prefix in prefixes])
+
+    def first_step(self, emoji_codes, seeds=None):
+        """ start() followed by step(): the probabilities of the first characters of new
+        sequences and their state after them. The first step only depends on the emoji and the
+        seed, so with a cache it is stored with the states after the whole prefix (the same
+        states as get_states would store for that prefix, plus the probabilities) """
+
+        seeds = [None] * len(emoji_codes) if seeds is None else seeds
+        prefixes = ['\n' + (self.seed if seed is None else seed) for seed in seeds]
+        keys = [(self.fingerprint, int(code), prefix)
+                for code, prefix in zip(emoji_codes, prefixes)]
+        rows = dict((key, None if self.cache is None else self.cache.get(key))
+                    for key in set(keys))
+        # states stored by get_states, for a longer seed, don't have the probabilities
+        missing = [key for key, row in rows.items() if row is None or len(row) < 3]
+
+        if missing:
+            state, codes = self.start(np.array([code for _, code, _ in missing]),
+                                      [prefix[1:] for _, _, prefix in missing])
+            preds, (h, c) = self.step(state, codes)
+            for j, key in enumerate(missing):
+                rows[key] = [h[j], c[j], preds[j]]
+                if self.cache is not None:
+                    self.cache.put(key, rows[key])
+
+        return (np.stack([rows[key][2] for key in keys]),
+                [np.stack([rows[key][i] for key in keys]) for i in range(2)])
+
+    def get_states(self, emoji_codes, prefixes):
+        """ the decoder's [h, c] states, for the emojis in emoji_codes, after running it over
+        each of prefixes from the encoder's states (which are the states for an empty
+        prefix). Each distinct (emoji, prefix) is only computed once, and only if it isn't in
+        the cache """
+
+        keys = [(self.fingerprint, int(code), prefix)
+                for code, prefix in zip(emoji_codes, prefixes)]
+        rows = dict((key, None if self.cache is None else self.cache.get(key))
+                    for key in set(keys))
+        missing = [key for key, row in rows.items() if row is None]
+
+        if missing:
+            codes = np.array([code for _, code, _ in missing])
+            if not any(prefix for _, _, prefix in missing):
+                emojis = util.one_hot_from_codes(codes[:, np.newaxis], len(self.emojis),
+                                                 dtype=self.dtype)
+                h, c = self.encode(emojis)
+            else:
+                h, c = self.get_states(codes, [''] * len(missing))
+                for prefix in set(prefix for _, _, prefix in missing if prefix):
+                    # one decoder call over the whole prefix for the emojis that need it
+                    i = [j for j, key in enumerate(missing) if key[2] == prefix]
+                    target = util.one_hot_from_codes(
+                        np.tile(self.vocab.encode(list(prefix)), (len(i), 1)), len(self.vocab),
+                        dtype=self.dtype)
+                    _, h[i], c[i] = self.decode([target, h[i], c[i]])
+            for j, key in enumerate(missing):
+                rows[key] = [h[j], c[j]]
+                if self.cache is not None:
+                    self.cache.put(key, rows[key])
+
+        return [np.stack([rows[key][i] for key in keys]) for i in range(2)]
+
+    def step(self, state, codes):
+        """ the (n, n_chars) next character probabilities and new state after codes """
+        target = util.one_hot_from_codes(codes[:, np.newaxis], len(self.vocab), dtype=self.dtype)
+        preds, h, c = self.decode([target] + state)
+        return preds[:, -1, :], [h, c]
+
+
+class JointEngine:
+    """ a joint text/emoji char-LSTM (a keras model or an InferenceModel with inputs
+    [window, emoji], like models/text_emoji_joint_gen_model-*.hdf5) as a GenerationService
+    engine. emojis are the emoji of each of the model's emoji inputs, by default their numbers
+    as strings. Every sequence starts from the seed text, and as the vocabulary has no
+    newline, runs for max_length characters """
+
+    def __init__(self, model, emojis=None, vocab=None, seed='',
+                 max_length=generate.MAX_TWEET_LENGTH, dtype=np.float32):
+        self.predict = generate.get_predict_function(model)
+        self.window_size = model.input_shape[0][1]
+        n_emojis = model.input_shape[1][1]
+        self.emojis = util.get_vocabulary(
+            [str(i) for i in range(n_emojis)] if emojis is None else emojis)
+        assert len(self.emojis) == n_emojis, 'the model has {} emojis'.format(n_emojis)
+        self.vocab = util.get_char_vocabulary() if vocab is None else vocab
+        self.stop_code = self.vocab.get('\n')
+        self.seed = seed
+        self.max_length = max_length
+        self.dtype = dtype
+
+    def start(self, emoji_codes, seeds=None):
+        seeds = [None] * len(emoji_codes) if seeds is None else seeds
+        windows = generate.get_seed_windows([self.seed if seed is None else seed
+                                             for seed in seeds],
+                                            window_size=self.window_size, vocab=self.vocab,
+                                            dtype=self.dtype)
+        emojis = util.one_hot_from_codes(emoji_codes, len(self.emojis), dtype=self.dtype)
+        # BLANK_CODE marks a new sequence, whose seed window is predicted from as it is
+        return [windows, emojis], np.full(len(emoji_codes), util.BLANK_CODE)
+
+    def first_step(self, emoji_codes, seeds=None):
+        state, codes = self.start(emoji_codes, seeds)
+        return self.step(state, codes)
+
+    def step(self, state, codes):
+        window = state[0]
+        rows = np.flatnonzero(codes >= 0)
+        # shift the windows one character to the left, and add the chosen characters
+        window[rows, 0:-1] = window[rows, 1:]
+        window[rows, -1] = 0
+        window[rows, -1, codes[rows]] = 1
+        return self.predict(state), state
+
+
+def get_number(name, value, minimum, maximum=None):
+    """ value (a number or a string of one) as a finite float between minimum and maximum.
+    Raises ValueError otherwise """
+    try:
+        number = float(value) if not isinstance(value, bool) else None
+    except (TypeError, ValueError):
+        number = None
+    if number is None or not np.isfinite(number) or number < minimum or \
+            (maximum is not None and number > maximum):
+        raise ValueError('{} must be a number from {} to {}, not {!r}'.format(
+            name, minimum, 'any' if maximum is None else maximum, value))
+    return number
+
+
+def get_integer(name, value, minimum, maximum=None):
+    """ value (a whole number or a string of one) as an int between minimum and maximum.
+    Raises ValueError otherwise """
+    number = get_number(name, value, minimum, maximum)
+    if not number.is_integer():
+        raise ValueError('{} must be a whole number, not {!r}'.format(name, value))
+    return int(number)
+
+
+class GenerationRequest:
+    """ the n sequences of one call to GenerationService.generate """
+
+    def __init__(self, emoji_code, n, temperature, max_length, deadline, future, seed=None):
+        self.emoji_code = emoji_code
+        self.seed = seed
+        self.n = n
+        self.temperature = temperature
+        self.max_length = max_length
+        self.deadline = deadline
+        self.future = future
+        self.codes = [[] for _ in range(n)]
+        self.remaining = n
+
+    def expired(self, now):
+        return self.deadline is not None and now >= self.deadline
+
+
+class GenerationService:
+    """ continuous batching over engine (a Seq2SeqEngine or JointEngine) for concurrent
+    generate() calls, with at most max_batch_size sequences in the running batch and
+    max_queue requests waiting to join it. rng is a seed or np.random.Generator.
+    If the engine caches states (see Seq2SeqEngine), the weights are rehashed before starting
+    new sequences if check_weights_every seconds (None for never) have passed since the last
+    time, so states of changed weights are dropped within that time without anyone having to
+    ask. Use it as an async context manager, or call start() and close() """
+
+    def __init__(self, engine, max_batch_size=64, max_queue=256, rng=None,
+                 check_weights_every=10.0):
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_queue = max_queue
+        self.rng = np.random.default_rng(rng)
+        self.check_weights_every = check_weights_every
+        self.next_weights_check = None
+        self.counters = dict.fromkeys(['requests', 'completed', 'timeouts', 'rejected',
+                                       'failed', 'steps', 'sequence_steps', 'chars',
+                                       'weight_changes'], 0)
+        self.queue = None
+        self.task = None
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=1)  # the model runs one step at a time
+        loop = asyncio.get_running_loop()
+        if self.check_weights_every is not None:  # the engine hashed them when it was made
+            self.next_weights_check = loop.time() + self.check_weights_every
+        self.task = loop.create_task(self.run())
+        return self
+
+    async def close(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def get_emoji_code(self, emoji):
+        """ the engine's number for emoji, an emoji or an emoji number. Raises KeyError for
+        emojis the model doesn't have """
+        if isinstance(emoji, (int, np.integer)) and not isinstance(emoji, bool):
+            if not 0 <= emoji < len(self.engine.emojis):
+                raise KeyError(emoji)
+            return int(emoji)
+        return self.engine.emojis[emoji]
+
+    async def generate(self, emoji, n=1, temperature=1.0, max_length=None, timeout=None,
+                       seed=None):
+        """ generates n tweets for emoji, sampled with temperature (0 for greedy), of at most
+        max_length characters (the engine's max_length by default), continuing from seed (the
+        engine's seed by default), which isn't included in them. Returns a list of n strings.
+        Raises ServiceBusy if the request can't be queued, or asyncio.TimeoutError if it isn't
+        finished, within timeout seconds. The numbers may also be given as strings (as they
+        may come from a request body), and raise ValueError if they aren't valid """
+
+        if self.task is None:
+            raise RuntimeError('the service has not been started')
+        n = get_integer('n', n, 1, self.max_batch_size)
+        temperature = get_number('temperature', temperature, 0)
+        max_length = self.engine.max_length if max_length is None else \
+            get_integer('max_length', max_length, 1)
+        timeout = None if timeout is None else get_number('timeout', timeout, 0)
+        if seed is not None:
+            if not isinstance(seed, str):
+                raise ValueError('seed must be a string')
+            self.engine.vocab.encode(list(seed))  # raises KeyError for unknown characters
+
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        request = GenerationRequest(self.get_emoji_code(emoji), n, temperature, max_length,
+                                    deadline, loop.create_future(), seed=seed)
+        self.counters['requests'] += 1
+
+        try:
+            await asyncio.wait_for(self.queue.put(request), timeout)
+        except asyncio.TimeoutError:
+            self.counters['rejected'] += 1
+            raise ServiceBusy('the request queue is full') from None
+
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(request.future),
+                None if deadline is None else max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            self.counters['timeouts'] += 1
+            raise
+        finally:
+            # tells the scheduler to drop the request's sequences if it gave up
+            if not request.future.done():
+                request.future.cancel()
+
+    async def check_weights(self):
+        """ rehashes the engine's weights straight away, between model steps, and drops its
+        cached states if the weights changed. Returns whether they did """
+        if getattr(self.engine, 'cache', None) is None:
+            return False
+        loop = asyncio.get_running_loop()
+        changed = await loop.run_in_executor(self.executor, self.engine.check_weights)
+        self.next_weights_check = None if self.check_weights_every is None else \
+            loop.time() + self.check_weights_every
+        self.counters['weight_changes'] += changed
+        return changed
+
+    def stats(self):
+        """ the service's counters, the mean number of sequences in each step, and the
+        engine's cache statistics if it has a cache """
+        stats = dict(self.counters)
+        stats['queued'] = self.queue.qsize() if self.queue is not None else 0
+        stats['mean_batch_size'] = (self.counters['sequence_steps'] / self.counters['steps']
+                                    if self.counters['steps'] else 0.0)
+        if getattr(self.engine, 'cache', None) is not None:
+            stats['cache'] = self.engine.cache.stats()
+        return stats
+
+    async def get_next_request(self, block):
+        """ the next queued request that is still wanted, or None if there isn't one and block
+        is False """
+        while True:
+            if block:
+                request = await self.queue.get()
+            elif self.queue.empty():
+                return None
+            else:
+                request = self.queue.get_nowait()
+            if request.future.done():  # the caller gave up while it was queued
+                continue
+            if request.expired(asyncio.get_running_loop().time()):
+                self.fail(request, asyncio.TimeoutError())
+                continue
+            return request
+
+    def fail(self, request, error):
+        if not request.future.done():
+            request.future.set_exception(error)
+            if not isinstance(error, asyncio.TimeoutError):  # generate counts those
+                self.counters['failed'] += 1
+
+    def finish(self, request):
+        codes = np.full((request.n, max(max(len(row) for row in request.codes), 1)),
+                        util.BLANK_CODE, dtype=np.int64)
+        for i, row in enumerate(request.codes):
+            codes[i, 0:len(row)] = row
+        if not request.future.done():
+            request.future.set_result(self.engine.vocab.decode_text(codes).tolist())
+            self.counters['completed'] += 1
+
+    def sample(self, rows, preds):
+        """ the next code of each of rows (request, sequence number) from the probabilities
+        preds of a step """
+        temperature = np.array([request.temperature for request, _ in rows])
+        codes = decoding.TemperatureSampler(temperature)(np.asarray(preds),
+                                                         np.arange(len(rows)), self.rng)
+        self.counters['steps'] += 1
+        self.counters['sequence_steps'] += len(rows)
+        return codes
+
+    def record(self, rows, codes, now):
+        """ appends the codes to the sequences of rows, finishing requests whose sequences are
+        all done and failing abandoned ones. Returns which rows are still running """
+        keep = np.ones(len(rows), dtype=bool)
+        for j, (request, i) in enumerate(rows):
+            if request.future.done() or request.expired(now):
+                keep[j] = False
+                self.fail(request, asyncio.TimeoutError())
+                continue
+            code = int(codes[j])
+            if code != self.engine.stop_code:
+                request.codes[i].append(code)
+                self.counters['chars'] += 1
+            if code == self.engine.stop_code or len(request.codes[i]) >= request.max_length:
+                keep[j] = False
+                request.remaining -= 1
+                if request.remaining == 0:
+                    self.finish(request)
+        return keep
+
+    async def run(self):
+        """ the scheduler loop: admits queued requests into the running batch while there is
+        room, runs one step for the whole batch, and retires finished sequences """
+
+        loop = asyncio.get_running_loop()
+        rows = []             # (request, sequence number) of each row of the batch
+        state, codes = None, None
+        waiting = None        # a request that didn't fit into the batch yet
+
+        while True:
+            new_requests = []
+            try:
+                # admit new sequences, waiting for a request if the batch is empty
+                n_free = self.max_batch_size - len(rows)
+                while True:
+                    if waiting is None:
+                        waiting = await self.get_next_request(block=not rows and not new_requests)
+                    if waiting is None or waiting.n > n_free:
+                        break
+                    new_requests.append(waiting)
+                    n_free -= waiting.n
+                    waiting = None
+
+                if new_requests and self.next_weights_check is not None and \
+                        loop.time() >= self.next_weights_check:
+                    await self.check_weights()
+
+                if new_requests:
+                    # the first step of new sequences is the engine's, which may have it cached
+                    emoji_codes = np.repeat([request.emoji_code for request in new_requests],
+                                            [request.n for request in new_requests])
+                    seeds = [request.seed for request in new_requests for _ in range(request.n)]
+                    new_rows = [(request, i) for request in new_requests
+                                for i in range(request.n)]
+                    preds, new_state = await loop.run_in_executor(
+                        self.executor, self.engine.first_step, emoji_codes, seeds)
+                    new_codes = self.sample(new_rows, preds)
+                    keep = self.record(new_rows, new_codes, loop.time())
+
+                    rows += [row for row, kept in zip(new_rows, keep) if kept]
+                    new_state, new_codes = [arr[keep] for arr in new_state], new_codes[keep]
+                    if state is None:
+                        state, codes = new_state, new_codes
+                    else:
+                        state = [np.concatenate([arr, new_arr])
+                                 for arr, new_arr in zip(state, new_state)]
+                        codes = np.concatenate([codes, new_codes])
+
+                if not rows:  # the new sequences were all finished by their first step
+                    state, codes = None, None
+                    continue
+
+                preds, state = await loop.run_in_executor(self.executor, self.engine.step,
+                                                          state, codes)
+                codes = self.sample(rows, preds)
+                keep = self.record(rows, codes, loop.time())
+
+                if not keep.all():
+                    rows = [row for row, kept in zip(rows, keep) if kept]
+                    state = [arr[keep] for arr in state] if rows else None
+                    codes = codes[keep] if rows else None
+            except Exception as error:
+                # a failed model call or a bad request fails the requests in the batch,
+                # but the scheduler keeps going for the ones that come after them
+                for request in set(request for request, _ in rows) | set(new_requests):
+                    self.fail(request, error)
+                rows, state, codes = [], None, None
+
+
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                500: 'Internal Server Error', 503: 'Service Unavailable',
+                504: 'Gateway Timeout'}
+
+
+async def write_response(writer, status, body):
+    data = json.dumps(body).encode('utf-8')
+    writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\n'
+                 'Connection: close\r\n\r\n'.format(status, HTTP_REASONS[status],
+                                                    len(data)).encode('ascii') + data)
+    await writer.drain()
+
+
+async def handle_http(service, reader, writer):
+    """ answers one HTTP request on the connection, then closes it """
+
+    try:
+        request_line = (await reader.readline()).decode('latin-1').split()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            key, _, value = line.partition(':')
+            headers[key.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+        if len(request_line) < 2:
+            return await write_response(writer, 400, {'error': 'bad request line'})
+        method, path = request_line[0:2]
+
+        if path == '/stats':
+            return await write_response(writer, 200, service.stats())
+        if path != '/generate':
+            return await write_response(writer, 404, {'error': 'not found'})
+        if method != 'POST':
+            return await write_response(writer, 405, {'error': 'use POST'})
+
+        try:
+            args = json.loads(body or b'{}')
+            tweets = await service.generate(args['emoji'], n=args.get('n', 1),
+                                            temperature=args.get('temperature', 1.0),
+                                            max_length=args.get('max_length'),
+                                            timeout=args.get('timeout'),
+                                            seed=args.get('seed'))
+        except (ValueError, KeyError, TypeError) as error:
+            return await write_response(writer, 400, {'error': repr(error)})
+        except ServiceBusy as error:
+            return await write_response(writer, 503, {'error': str(error)})
+        except asyncio.TimeoutError:
+            return await write_response(writer, 504, {'error': 'timed out'})
+        except Exception as error:
+            return await write_response(writer, 500, {'error': repr(error)})
+        await write_response(writer, 200, {'tweets': tweets})
+
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(service, host='127.0.0.1', port=8000, path=None):
+    """ an asyncio server for service on host:port, or on the Unix socket at path if given.
+    Port 0 picks a free port, see server.sockets[0].getsockname() """
+
+    def handler(reader, writer):
+        return handle_http(service, reader, writer)
+
+    if path is not None:
+        return await asyncio.start_unix_server(handler, path=path)
+    return await asyncio.start_server(handler, host=host, port=port)
+
+
+async def post_generate(payload, host='127.0.0.1', port=8000, path=None):
+    """ a client for serve(): POSTs payload (a dict) to /generate, returns the (status, response
+    dict) """
+
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    data = json.dumps(payload).encode('utf-8')
+    writer.write('POST /generate HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\n'
+                 'Content-Length: {}\r\n\r\n'.format(host, len(data)).encode('ascii') + data)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(body)
+
+
+def get_stub_engine(n_emojis=64, units=256, mean_length=60, rng=0, cache=None):
+    """ a Seq2SeqEngine over a NumpySeq2Seq with random weights, for testing and load testing
+    without a trained model. The newline's output bias is raised so that sampled tweets are
+    about mean_length characters long. cache is the engine's StateCache """
+    chars, vocab = s2s_util.get_universal_chars_list()
+    model = inference.NumpySeq2Seq.random(n_emojis, len(chars), units=units, rng=rng)
+    model.dense_weights[1][vocab['\n']] += np.log(len(chars) / mean_length)
+    return Seq2SeqEngine(model.encode, model.decode, [str(i) for i in range(n_emojis)],
+                         vocab=vocab, cache=cache)
+
+
+def load_engine(seq2seq=None, joint=None, emojis=None, cache=None):
+    """ the engine for a seq2seq model file (as saved by the seq2seq notebook) or a joint model
+    file. emojis is a labels file saved with Vocabulary.save, by default the model's
+    .labels.json next to it if there is one. cache is the seq2seq engine's StateCache (the
+    joint models predict from a window of text, so they have no states to cache) """
+
+    path = seq2seq or joint
+    if emojis is None and os.path.exists(emoji_predict.get_labels_path(path)):
+        emojis = emoji_predict.get_labels_path(path)
+    labels = util.Vocabulary.load(emojis).tokens if emojis else None
+
+    if seq2seq:
+        model = inference.load_seq2seq(seq2seq)
+        if labels is None:
+            labels = [str(i) for i in range(model.encoder_weights[0].shape[0])]
+        return Seq2SeqEngine(model.encode, model.decode, labels, cache=cache)
+    return JointEngine(inference.load_model(joint), emojis=labels)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='emoji tweet generation service')
+    model_group = parser.add_mutually_exclusive_group(required=True)
+    model_group.add_argument('--seq2seq', help='seq2seq model file')
+    model_group.add_argument('--joint', help='joint text/emoji model file')
+    model_group.add_argument('--stub', action='store_true', help='a random seq2seq model')
+    parser.add_argument('--emojis', help='emoji labels file (Vocabulary.save)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix', help='serve on this Unix socket instead')
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-queue', type=int, default=256)
+    parser.add_argument('--cache-mb', type=float, default=64,
+                        help='size of the seq2seq state cache, 0 for none')
+    args = parser.parse_args(argv)
+
+    cache = state_cache.StateCache(max_bytes=int(args.cache_mb * 2**20)) \
+        if args.cache_mb > 0 else None
+    engine = get_stub_engine(cache=cache) if args.stub else \
+        load_engine(args.seq2seq, args.joint, args.emojis, cache=cache)
+
+    async def run():
+        async with GenerationService(engine, max_batch_size=args.max_batch_size,
+                                     max_queue=args.max_queue) as service:
+            server = await serve(service, host=args.host, port=args.port, path=args.unix)
+            print('serving on {}'.format(args.unix or '{}:{}'.format(args.host, args.port)))
+            async with server:
+                await server.serve_forever()
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
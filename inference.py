@@ -0,0 +1,264 @@
+""" Keras free inference for the trained models, in numpy.
+
+    load_model reads a keras 2 .h5/.hdf5 file (models/*.hdf5, emoji_model-0.650.h5) with h5py,
+    and runs the forward pass of the saved layer graph in float32 numpy. Only the layers used
+    by the models in this repo are supported: InputLayer, LSTM, Dense and Concatenate.
+
+    The LSTMs project the inputs of every timestep through the fused (input_dim, 4 * units)
+    kernel with one matmul before stepping through time, and each step then needs a single
+    (units, 4 * units) recurrent matmul for all four gates.
+
+    load_seq2seq builds the encoder/decoder pair of the seq2seq notebook (NumpySeq2Seq) from
+    the weights of its saved training model """
+
+import json
+import numpy as np
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def hard_sigmoid(x):
+    """ keras' piecewise linear sigmoid, the default LSTM recurrent_activation before keras 2.3 """
+    return np.clip(np.float32(0.2) * x + np.float32(0.5), 0, 1)
+
+
+def relu(x):
+    return np.maximum(x, 0)
+
+
+def linear(x):
+    return x
+
+
+def softmax(x):
+    exp = np.exp(x - x.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+ACTIVATIONS = {'sigmoid': sigmoid, 'hard_sigmoid': hard_sigmoid, 'relu': relu,
+               'linear': linear, 'tanh': np.tanh, 'softmax': softmax}
+
+
+def lstm_step(x, h, c, kernel, recurrent_kernel, bias, recurrent_activation=sigmoid):
+    """ one step of a keras LSTM layer for a batch, x is (n, input_dim) and h, c are
+    (n, units). The weights are the layer's get_weights(), with the gates in keras' order
+    (input, forget, cell, output). Returns the new (h, c) """
+    return lstm_projected_step(x @ kernel + bias, h, c, recurrent_kernel, recurrent_activation)
+
+
+def lstm_projected_step(projected, h, c, recurrent_kernel, recurrent_activation=sigmoid):
+    """ lstm_step for inputs already multiplied by the kernel, with the bias added """
+
+    z = projected + h @ recurrent_kernel
+    z_i, z_f, z_c, z_o = np.split(z, 4, axis=1)
+
+    c = recurrent_activation(z_f) * c + recurrent_activation(z_i) * np.tanh(z_c)
+    h = recurrent_activation(z_o) * np.tanh(c)
+    return h, c
+
+
+def run_lstm(inputs, h, c, kernel, recurrent_kernel, bias, recurrent_activation=sigmoid,
+             return_sequences=False):
+    """ runs an LSTM over inputs (n, timesteps, input_dim) from the states h, c. Returns the
+    final (h, c) and, if return_sequences, the (n, timesteps, units) outputs """
+
+    n, timesteps, input_dim = inputs.shape
+    # every timestep's input projection in one matmul
+    projected = (inputs.reshape(n * timesteps, input_dim) @ kernel + bias).reshape(
+        n, timesteps, -1)
+
+    outputs = np.empty((n, timesteps, h.shape[1]), dtype=h.dtype) if return_sequences else None
+    for t in range(timesteps):
+        h, c = lstm_projected_step(projected[:, t], h, c, recurrent_kernel,
+                                   recurrent_activation=recurrent_activation)
+        if return_sequences:
+            outputs[:, t] = h
+
+    return h, c, outputs
+
+
+class NumpySeq2Seq:
+    """ numpy reference implementation of the encoder_model and decoder_model built for
+    inference in the seq2seq notebook. encoder_weights and decoder_weights are the
+    [kernel, recurrent_kernel, bias] weights of the two LSTM layers and dense_weights the
+    [kernel, bias] of the softmax layer. encode and decode take and return the same lists of
+    arrays as encoder_model.predict and decoder_model.predict """
+
+    def __init__(self, encoder_weights, decoder_weights, dense_weights,
+                 recurrent_activation=sigmoid):
+        self.encoder_weights = [np.asarray(w) for w in encoder_weights]
+        self.decoder_weights = [np.asarray(w) for w in decoder_weights]
+        self.dense_weights = [np.asarray(w) for w in dense_weights]
+        self.recurrent_activation = recurrent_activation
+        self.units = self.encoder_weights[1].shape[0]
+        self.dtype = self.encoder_weights[0].dtype
+
+    @staticmethod
+    def random(n_emojis, n_chars, units=256, scale=0.1, rng=None, dtype=np.float32):
+        """ a model with random weights of the notebook's shapes """
+        rng = np.random.default_rng(rng)
+
+        def weights(*shapes):
+            return [(rng.standard_normal(shape) * scale).astype(dtype) for shape in shapes]
+
+        return NumpySeq2Seq(weights((n_emojis, 4 * units), (units, 4 * units), (4 * units,)),
+                            weights((n_chars, 4 * units), (units, 4 * units), (4 * units,)),
+                            weights((units, n_chars), (n_chars,)))
+
+    def encode(self, inputs):
+        """ (n, timesteps, n_emojis) one-hot emojis to the encoder states [h, c] """
+        inputs = np.asarray(inputs, dtype=self.dtype)
+        zeros = np.zeros((inputs.shape[0], self.units), dtype=self.dtype)
+        h, c, _ = run_lstm(inputs, zeros, zeros, *self.encoder_weights,
+                           recurrent_activation=self.recurrent_activation)
+        return [h, c]
+
+    def decode(self, inputs):
+        """ [x, h, c] with x (n, timesteps, n_chars) to [probabilities, h, c], where the
+        probabilities of the next character are (n, timesteps, n_chars) """
+        x, h, c = inputs
+        h, c, outputs = run_lstm(np.asarray(x, dtype=self.dtype), h, c, *self.decoder_weights,
+                                 recurrent_activation=self.recurrent_activation,
+                                 return_sequences=True)
+        kernel, bias = self.dense_weights
+        return [softmax(outputs @ kernel + bias), h, c]
+
+
+def read_model_file(path):
+    """ the model config and a dict of layer name -> list of float32 weights (in the order of
+    keras' layer.get_weights()) from a keras 2 model file """
+    import h5py  # only needed to load model files
+
+    with h5py.File(path, 'r') as f:
+        config = f.attrs['model_config']
+        config = json.loads(config.decode('utf-8') if isinstance(config, bytes) else config)
+
+        group = f['model_weights'] if 'model_weights' in f else f
+        weights = {}
+        for layer_name in group.attrs['layer_names']:
+            layer_name = layer_name.decode('utf-8')
+            layer = group[layer_name]
+            weights[layer_name] = [np.asarray(layer[name.decode('utf-8')], dtype=np.float32)
+                                   for name in layer.attrs['weight_names']]
+
+    return config, weights
+
+
+def apply_layer(layer, weights, inputs):
+    """ calls a layer (its config dict) with its weights on a list of input arrays, returns the
+    list of output arrays """
+
+    class_name, config = layer['class_name'], layer['config']
+
+    if class_name == 'Dense':
+        kernel, bias = weights if config['use_bias'] else (weights[0], 0)
+        return [ACTIVATIONS[config['activation']](inputs[0] @ kernel + bias)]
+
+    if class_name == 'Concatenate':
+        return [np.concatenate(inputs, axis=config['axis'])]
+
+    if class_name == 'LSTM':
+        assert config['activation'] == 'tanh' and not config['go_backwards']
+        kernel, recurrent_kernel, bias = weights if config['use_bias'] else weights + [0]
+        x = inputs[0]
+        if len(inputs) == 3:
+            h, c = inputs[1], inputs[2]  # initial_state
+        else:
+            h = c = np.zeros((x.shape[0], config['units']), dtype=np.float32)
+
+        h, c, outputs = run_lstm(x, h, c, kernel, recurrent_kernel, bias,
+                                 recurrent_activation=ACTIVATIONS[config['recurrent_activation']],
+                                 return_sequences=config['return_sequences'])
+        result = outputs if config['return_sequences'] else h
+        return [result, h, c] if config['return_state'] else [result]
+
+    raise NotImplementedError('{} layers are not supported'.format(class_name))
+
+
+class InferenceModel:
+    """ a keras model loaded by load_model. predict has the same arguments as keras'
+    Model.predict (batch_size and verbose are accepted but not needed) so it can be passed to
+    the functions in generate in place of the keras model """
+
+    def __init__(self, config, weights):
+        self.weights = weights
+
+        if config['class_name'] == 'Sequential':
+            layers = config['config']
+            layers = layers['layers'] if isinstance(layers, dict) else layers  # keras < 2.2.3
+            # chain the layers into a graph, so both kinds of model run the same way
+            self.layers = {'input': {'class_name': 'InputLayer', 'inbound_nodes': [],
+                                     'config': {'batch_input_shape':
+                                                layers[0]['config']['batch_input_shape']}}}
+            previous = 'input'
+            for layer in layers:
+                name = layer['config']['name']
+                self.layers[name] = dict(layer, inbound_nodes=[[[previous, 0, 0, {}]]])
+                previous = name
+            self.input_names = [['input', 0, 0]]
+            self.output_names = [[previous, 0, 0]]
+        else:
+            self.layers = dict((layer['name'], layer) for layer in config['config']['layers'])
+            self.input_names = config['config']['input_layers']
+            self.output_names = config['config']['output_layers']
+
+        shapes = [tuple(self.layers[name]['config']['batch_input_shape'])
+                  for name, _, _ in self.input_names]
+        self.input_shape = shapes[0] if len(shapes) == 1 else shapes
+
+    def get_layer_config(self, class_name):
+        """ the configs of the layers of type class_name, in the order they appear """
+        return [layer for layer in self.layers.values() if layer['class_name'] == class_name]
+
+    def predict(self, inputs, batch_size=None, verbose=0):
+        """ runs the model on an input array, or a list of them for a model with several
+        inputs, returns an array or a list of arrays like keras """
+
+        if not isinstance(inputs, (list, tuple)):
+            inputs = [inputs]
+        assert len(inputs) == len(self.input_names)
+
+        # outputs of each layer call, keyed by (layer name, node index)
+        node_outputs = dict(((name, node), [np.asarray(arr, dtype=np.float32)])
+                            for (name, node, _), arr in zip(self.input_names, inputs))
+
+        def get_node_outputs(name, node):
+            if (name, node) not in node_outputs:
+                layer = self.layers[name]
+                inbound = [get_node_outputs(in_name, in_node)[in_tensor]
+                           for in_name, in_node, in_tensor, _ in layer['inbound_nodes'][node]]
+                node_outputs[(name, node)] = apply_layer(layer, self.weights.get(name, []),
+                                                         inbound)
+            return node_outputs[(name, node)]
+
+        outputs = [get_node_outputs(name, node)[tensor]
+                   for name, node, tensor in self.output_names]
+        return outputs[0] if len(outputs) == 1 else outputs
+
+    __call__ = predict
+
+
+def load_model(path):
+    """ loads the keras 2 model file at path as an InferenceModel """
+    return InferenceModel(*read_model_file(path))
+
+
+def load_seq2seq(path):
+    """ loads the training model saved by the seq2seq notebook (emoji_s2s.h5) as a
+    NumpySeq2Seq. The decoder is the LSTM that is given an initial state, and the dense
+    layer is the one after it """
+
+    model = load_model(path)
+    lstms = model.get_layer_config('LSTM')
+    decoder = [layer for layer in lstms if len(layer['inbound_nodes'][0]) == 3]
+    assert len(lstms) == 2 and len(decoder) == 1, 'not a seq2seq encoder/decoder model'
+    decoder = decoder[0]
+    encoder = [layer for layer in lstms if layer is not decoder][0]
+    dense = [layer for layer in model.get_layer_config('Dense')
+             if layer['inbound_nodes'][0][0][0] == decoder['name']][0]
+
+    recurrent_activation = ACTIVATIONS[encoder['config']['recurrent_activation']]
+    return NumpySeq2Seq(model.weights[encoder['name']], model.weights[decoder['name']],
+                        model.weights[dense['name']], recurrent_activation=recurrent_activation)
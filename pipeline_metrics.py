@@ -0,0 +1,219 @@
+""" Opt-in instrumentation for the batch generators (data_load_utils.convert_tweet_to_xy_generator
+    and data_load_seq2seq_utils.xy_generator), to see where the time goes when training stalls.
+
+    Pass a PipelineMetrics to a generator as metrics=. The generator marks the start of each
+    batch, a lap at the end of each stage of building it (pandas slicing and character coding,
+    window extraction, one-hot encoding, copies into the batch buffers), and the end of the
+    batch when it is yielded. Each lap records its wall time with perf_counter_ns and the bytes
+    of the arrays the stage produced. Those are the bytes written, not allocated: a stage that
+    fills a preallocated buffer (like 'copy' and 'emoji') counts the buffer every batch, even
+    though nothing new is allocated. For the memory each stage allocates, temporaries included,
+    pass trace_allocations=True, which traces the generator with tracemalloc and records the
+    peak of each stage's allocations above what was allocated when it started (tracing slows
+    every allocation down, so the times are less accurate with it on). The time between
+    yielding a batch and being asked for the next one is the consumer's (the model's) time.
+    Without metrics the generators only pay a None check per stage.
+
+    MetricsCallback logs, for each epoch of keras training, the time the generator took against
+    the time the model took for its training steps. """
+
+from collections import defaultdict
+from time import perf_counter_ns
+import tracemalloc
+import data_load_utils as util
+
+try:
+    from keras.callbacks import Callback
+except ImportError:  # keras is only needed for the callback, not to collect metrics
+    Callback = object
+
+
+def get_nbytes(arrays):
+    """ the total size of arrays, a batch or a list of arrays, nested any way """
+    return sum(arr.nbytes for arr in util.flatten_batch(list(arrays)))
+
+
+class PipelineMetrics:
+    """ per stage wall time and bytes produced (and, if trace_allocations is True, bytes
+    allocated), and batch rates, for a batch generator. The generator calls start_batch(),
+    then lap(stage, *arrays) after each stage, then end_batch(batch) before yielding the batch.
+    The time of each lap is the time since the last lap (or the start of the batch). Call
+    summary() or report() for the totals so far """
+
+    def __init__(self, trace_allocations=False):
+        self.trace_allocations = trace_allocations
+        self.reset()
+
+    def reset(self):
+        """ clears all the totals """
+        self.stage_ns = defaultdict(int)
+        self.stage_bytes = defaultdict(int)
+        self.stage_allocated = defaultdict(int)
+        self.stage_calls = defaultdict(int)
+        self.n_batches = 0
+        self.batch_bytes = 0
+        self.generator_ns = 0  # time spent building batches
+        self.consumer_ns = 0   # time between yielding a batch and the next being requested
+        self._batch_start = None
+        self._last_lap = None
+        self._yielded = None
+        self._traced = 0          # bytes traced at the last lap
+        self._started_tracing = False
+
+    def start_batch(self):
+        if self.trace_allocations:
+            # only the generator is traced, unless something else is tracing already
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            self._traced = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+
+        now = perf_counter_ns()
+        if self._yielded is not None:
+            self.consumer_ns += now - self._yielded
+            self._yielded = None
+        self._batch_start = self._last_lap = now
+
+    def lap(self, stage, *arrays):
+        """ records the time since the last lap as stage, and the size of the arrays (or
+        batches) it produced, whether they are new or reused buffers """
+        now = perf_counter_ns()
+        self.stage_ns[stage] += now - self._last_lap
+        self.stage_calls[stage] += 1
+        if arrays:
+            self.stage_bytes[stage] += get_nbytes(arrays)
+        if self.trace_allocations:
+            self.trace_lap(stage)
+        # the next stage's time starts after the tracing, not before it
+        self._last_lap = perf_counter_ns() if self.trace_allocations else now
+
+    def trace_lap(self, stage):
+        """ records the peak memory allocated since the last lap, above what was allocated
+        then, as stage's """
+        traced, peak = tracemalloc.get_traced_memory()
+        self.stage_allocated[stage] += max(peak - self._traced, 0)
+        self._traced = traced
+        tracemalloc.reset_peak()
+
+    def end_batch(self, batch):
+        now = perf_counter_ns()
+        if now > self._last_lap:
+            # whatever happened after the last lap
+            self.stage_ns['other'] += now - self._last_lap
+            self.stage_calls['other'] += 1
+            if self.trace_allocations:
+                self.trace_lap('other')
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        self.generator_ns += now - self._batch_start
+        self.n_batches += 1
+        self.batch_bytes += get_nbytes([batch])
+        self._yielded = now
+
+    def summary(self):
+        """ the totals so far as a dict: batches, generator and consumer seconds, batches per
+        second (overall, and of the generator alone), the fraction of the time spent in the
+        generator, and a dict of stage -> (seconds, calls, bytes produced). With
+        trace_allocations, stage_allocated is a dict of stage -> bytes allocated """
+
+        generator_s = self.generator_ns / 1e9
+        consumer_s = self.consumer_ns / 1e9
+        summary = {'batches': self.n_batches,
+                   'batch_bytes': self.batch_bytes,
+                   'generator_seconds': generator_s,
+                   'consumer_seconds': consumer_s,
+                   'batches_per_second': self.n_batches / (generator_s + consumer_s)
+                   if generator_s + consumer_s > 0 else 0.0,
+                   'generator_batches_per_second': self.n_batches / generator_s
+                   if generator_s > 0 else 0.0,
+                   'generator_fraction': generator_s / (generator_s + consumer_s)
+                   if generator_s + consumer_s > 0 else 0.0,
+                   'stages': dict((stage, (ns / 1e9, self.stage_calls[stage],
+                                           self.stage_bytes[stage]))
+                                  for stage, ns in self.stage_ns.items())}
+        if self.trace_allocations:
+            summary['stage_allocated'] = dict((stage, self.stage_allocated[stage])
+                                              for stage in self.stage_ns)
+        return summary
+
+    def report(self):
+        """ summary() as a printable table. MB out per batch is the size of the arrays each stage
+        produced, which for stages writing into reused buffers isn't newly allocated memory. With
+        trace_allocations, MB alloc per batch is the memory each stage allocated """
+
+        summary = self.summary()
+        n_batches = max(summary['batches'], 1)
+        lines = ['{} batches, {:.1f} batches/s ({:.1f}/s for the generator alone), '
+                 '{:.0%} of the time in the generator'.format(
+                     summary['batches'], summary['batches_per_second'],
+                     summary['generator_batches_per_second'], summary['generator_fraction']),
+                 '{:>12} {:>10} {:>8} {:>14} {:>14}'.format(
+                     'stage', 'total (s)', '% gen', 'ms per batch', 'MB out/batch')]
+        if self.trace_allocations:
+            lines[-1] += ' {:>14}'.format('MB alloc/batch')
+        for stage, (seconds, _, nbytes) in sorted(summary['stages'].items(),
+                                                  key=lambda item: -item[1][0]):
+            lines.append('{:>12} {:>10.3f} {:>8.1%} {:>14.3f} {:>14.2f}'.format(
+                stage, seconds, seconds / summary['generator_seconds']
+                if summary['generator_seconds'] else 0.0,
+                1000 * seconds / n_batches, nbytes / n_batches / 2**20))
+            if self.trace_allocations:
+                lines[-1] += ' {:>14.2f}'.format(
+                    summary['stage_allocated'][stage] / n_batches / 2**20)
+        lines.append('{:>12} {:>10.3f} {:>8} {:>14.3f}'.format(
+            'consumer', summary['consumer_seconds'], '',
+            1000 * summary['consumer_seconds'] / n_batches))
+        return '\n'.join(lines)
+
+
+class MetricsCallback(Callback):
+    """ keras callback that logs, at the end of each epoch, the time spent waiting for batches
+    against the time spent in the model's training steps, with the generator's own time from
+    metrics (the PipelineMetrics passed to the generator) if given. With workers prefetching
+    batches the wait can be much less than the generator's time. Each epoch's numbers are
+    appended to history as a dict, and passed to log (print by default, None for silent) """
+
+    def __init__(self, metrics=None, log=print):
+        super().__init__()
+        self.metrics = metrics
+        self.log = log
+        self.history = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = perf_counter_ns()
+        self.step_ns = 0
+        self.n_steps = 0
+        self.batch_start = None
+        if self.metrics is not None:
+            self.start_generator_ns = self.metrics.generator_ns
+            self.start_batches = self.metrics.n_batches
+
+    def on_batch_begin(self, batch, logs=None):
+        self.batch_start = perf_counter_ns()
+
+    def on_batch_end(self, batch, logs=None):
+        self.step_ns += perf_counter_ns() - self.batch_start
+        self.n_steps += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        epoch_s = (perf_counter_ns() - self.epoch_start) / 1e9
+        step_s = self.step_ns / 1e9
+        stats = {'epoch': epoch, 'steps': self.n_steps, 'epoch_seconds': epoch_s,
+                 'step_seconds': step_s, 'wait_seconds': epoch_s - step_s,
+                 'wait_fraction': (epoch_s - step_s) / epoch_s if epoch_s > 0 else 0.0}
+        if self.metrics is not None:
+            stats['generator_seconds'] = \
+                (self.metrics.generator_ns - self.start_generator_ns) / 1e9
+            stats['generator_batches'] = self.metrics.n_batches - self.start_batches
+        self.history.append(stats)
+
+        if self.log is not None:
+            message = ('epoch {}: {} steps in {:.2f} s, model {:.2f} s, waiting for data '
+                       '{:.2f} s ({:.0%})'.format(epoch, self.n_steps, epoch_s, step_s,
+                                                  stats['wait_seconds'], stats['wait_fraction']))
+            if self.metrics is not None:
+                message += ', generator {:.2f} s for {} batches'.format(
+                    stats['generator_seconds'], stats['generator_batches'])
+            self.log(message)
@@ -0,0 +1,106 @@
+""" Test file for the multiprocess batch pipeline """
+
+import numpy as np
+import pandas as pd
+import pytest
+import batch_pipeline as bp
+import data_load_seq2seq_utils as s2s_util
+import data_load_utils as util
+
+
+def get_tweets(n_repeats=8):
+    my_dict = {'text':
+               ["red and yellow and pink and green, orange and purple and blue, I can sing a rainbow",
+                "sweet dreams are made of this, who am I to disagree",
+                "short one"],
+               'emoji':
+               [":rainbow:",
+                ":gay_pride_flag:",
+                ":fire:"]}
+    return pd.concat([pd.DataFrame(my_dict)] * n_repeats, ignore_index=True)
+
+
+def counting_batch_function(batch_num):
+    return (np.full(3, batch_num), np.zeros(1))
+
+
+def failing_batch_function(batch_num):
+    if batch_num == 2:
+        raise ValueError('bad batch')
+    return (np.zeros(3), np.ones(2))
+
+
+def test_window_pipeline_matches_generator():
+    """ batches come out in order, identical to convert_tweet_to_xy_generator's """
+    tweets = get_tweets()
+    emojis, _ = util.get_emojis_list(tweets['emoji'])
+
+    gen = util.convert_tweet_to_xy_generator(tweets, batch_size=4, emoji_set=emojis,
+                                             dtype=np.bool_)
+    with bp.window_pipeline(tweets, batch_size=4, workers=2, prefetch=3, emoji_set=emojis,
+                            dtype=np.bool_) as pipeline:
+        assert len(pipeline) == 6
+        for _ in range(len(pipeline) * 2 + 1):  # loops over the data like the generator
+            ([x, x_emoji], y) = next(gen)
+            ([x_pipe, x_emoji_pipe], y_pipe) = next(pipeline)
+            assert x_pipe.dtype == np.bool_
+            assert np.array_equal(x, x_pipe)
+            assert np.array_equal(x_emoji, x_emoji_pipe)
+            assert np.array_equal(y, y_pipe)
+
+
+def test_seq2seq_pipeline_matches_batches():
+    tweets = get_tweets()
+    _, emoji_idx = util.get_emojis_list(tweets['emoji'])
+
+    with bp.seq2seq_pipeline(tweets, batch_size=5, workers=3, prefetch=2, loop=False,
+                             emoji_indices=emoji_idx, encoding='index') as pipeline:
+        for batch_num in range(len(pipeline)):
+            ([emoj, x], y) = next(pipeline)
+            ([emoj_ref, x_ref], y_ref) = s2s_util.get_xy_batch(tweets, batch_num, batch_size=5,
+                                                               emoji_indices=emoji_idx,
+                                                               encoding='index')
+            assert np.array_equal(x, x_ref)
+            assert np.array_equal(y, y_ref)
+            assert np.array_equal(emoj, emoj_ref)
+
+        with pytest.raises(StopIteration):
+            next(pipeline)
+
+
+def test_pipeline_copy_keeps_batches():
+    pipeline = bp.BatchPipeline(counting_batch_function, 4, workers=2, prefetch=1, loop=False,
+                                copy=True)
+    batches = list(pipeline)
+    pipeline.close()
+
+    assert [x[0] for (x, _) in batches] == [0, 1, 2, 3]
+
+
+def test_pipeline_batches_can_be_held():
+    """ by default batches are copies, and can be held for longer than the ring of slots lasts,
+    the way fit_generator's queue holds them """
+    with bp.BatchPipeline(counting_batch_function, 5, workers=2, prefetch=2) as pipeline:
+        batches = [next(pipeline) for _ in range(pipeline.n_slots * 3)]
+        assert [x[0] for (x, _) in batches] == [i % 5 for i in range(len(batches))]
+
+    # views stay valid for the last hold batches, and only then is their slot reused
+    with bp.BatchPipeline(counting_batch_function, 5, workers=2, prefetch=2, copy=False,
+                          hold=3) as pipeline:
+        assert pipeline.n_slots == 5
+        batches = []
+        for i in range(pipeline.n_slots * 3):
+            batches = batches[-2:] + [next(pipeline)]
+            assert [x[0] for (x, _) in batches] == [j % 5 for j in range(i + 1)][-3:]
+        later = [next(pipeline) for _ in range(pipeline.n_slots)]
+        assert all(np.shares_memory(x, x_ref) for (x, _), (x_ref, _) in zip(later[2:], batches))
+
+
+def test_pipeline_raises_worker_errors():
+    pipeline = bp.BatchPipeline(failing_batch_function, 4, workers=2, prefetch=2)
+    next(pipeline)
+    next(pipeline)
+
+    with pytest.raises(RuntimeError, match='bad batch'):
+        next(pipeline)
+    assert pipeline.closed
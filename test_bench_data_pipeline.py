@@ -0,0 +1,49 @@
+""" Test file for the data pipeline benchmark suite's corpus and regression checks """
+
+import numpy as np
+import data_load_utils as util
+import bench_data_pipeline as bench
+
+
+def test_synthetic_corpus_reads_back(tmp_path):
+    path = str(tmp_path / 'synthetic.csv')
+    bench.write_synthetic_corpus(path, 25000, seed=1)
+    tweets = util.read_tweet_data(path)
+
+    # the repeated header rows are dropped
+    assert len(tweets) == 25000
+    assert not (tweets['text'] == 'text').any()
+
+    lengths = tweets['text'].str.len()
+    assert lengths.max() <= 160
+    assert 20 < lengths.median() < 60
+    counts = tweets['emoji'].value_counts()
+    assert counts.iloc[0] > 10 * counts.median()  # a long tail of emojis
+
+    filtered = util.filter_text_for_handles(tweets['text'])
+    assert tweets['text'].str.contains('@').any() and not filtered.str.contains('@').any()
+
+    # the same seed gives the same corpus
+    other_path = str(tmp_path / 'other.csv')
+    bench.write_synthetic_corpus(other_path, 25000, seed=1)
+    assert util.read_tweet_data(other_path).equals(tweets)
+
+
+def test_compare_flags_regressions():
+    def results(**cases):
+        return {'meta': {}, 'results': dict(
+            (key, {'seconds': seconds, 'peak_mb': peak_mb})
+            for key, (seconds, peak_mb) in cases.items())}
+
+    baseline = results(a=(1.0, 10.0), b=(2.0, 10.0), c=(1.0, 0.0), gone=(1.0, 1.0))
+    current = results(a=(1.1, 10.0), b=(3.0, 10.5), c=(1.0, 1.0), new=(9.0, 9.0))
+
+    regressions = bench.compare(baseline, current, threshold=0.2)
+    assert [(key, metric) for key, metric, _, _, _ in regressions] == \
+        [('b', 'seconds'), ('c', 'peak_mb')]
+    assert np.isclose(regressions[0][4], 1.5)
+
+    regressions = bench.compare(baseline, current, threshold=0.05, memory_threshold=1)
+    assert [(key, metric) for key, metric, _, _, _ in regressions] == \
+        [('a', 'seconds'), ('b', 'seconds'), ('c', 'peak_mb')]
+    assert bench.compare(baseline, baseline) == []
@@ -0,0 +1,188 @@
+""" Test file for the on-disk cache of the filtered tweet corpus """
+
+import os
+import numpy as np
+import pandas as pd
+import data_cache_utils as cache_util
+import data_load_seq2seq_utils as s2s_util
+import data_load_utils as util
+
+
+def write_tweets_csv(path, n_repeats=4):
+    """ writes a small csv in the scraped format, including a repeated header row """
+    tweets = pd.DataFrame({'line': range(8),
+                           'text': ["red and yellow and pink and green @someone",
+                                    "sweet dreams are made of this",
+                                    "I`m an undesirable character",
+                                    "sing a rainbow, sing a rainbow, sing a rainbow too",
+                                    "text",
+                                    "who am I to disagree?",
+                                    "the only tweet with this emoji",
+                                    "x" * 160],
+                           'emoji': [":rainbow:", ":fire:", ":rainbow:", ":rainbow:",
+                                     "emoji", ":fire:", ":ghost:", ":fire:"]})
+    pd.concat([tweets] * n_repeats).to_csv(path, index=False)
+
+
+def get_filtered_tweets(paths, min_count):
+    """ the notebooks' way of loading the corpus """
+    tweets = pd.concat([util.read_tweet_data(path) for path in paths], ignore_index=True)
+    tweets = util.filter_tweets_min_count(tweets, min_count=min_count)
+    tweets['text'] = util.filter_text_for_handles(tweets['text'])
+    return tweets.reset_index(drop=True)
+
+
+def test_cache_round_trips(tmp_path):
+    paths = [str(tmp_path / 'a.csv'), str(tmp_path / 'b.csv')]
+    write_tweets_csv(paths[0])
+    write_tweets_csv(paths[1], n_repeats=2)
+    cache_dir = str(tmp_path / 'cache')
+
+    cache = cache_util.get_corpus_cache(paths, cache_dir, min_count=6, length=160)
+    tweets = get_filtered_tweets(paths, min_count=6)
+
+    assert len(cache) == len(tweets)
+    assert isinstance(cache.codes, np.memmap)
+    assert cache.codes.dtype == np.uint8
+    assert cache.emojis == [':fire:', ':rainbow:']
+
+    decoded = cache.get_tweets()
+    assert list(decoded['emoji']) == list(tweets['emoji'])
+    assert list(decoded['text']) == [text[0:160] for text in tweets['text']]
+
+
+def test_generators_read_cache(tmp_path):
+    path = str(tmp_path / 'a.csv')
+    write_tweets_csv(path)
+    cache = cache_util.get_corpus_cache(path, str(tmp_path / 'cache'), min_count=3)
+    tweets = get_filtered_tweets([path], min_count=3)
+    emojis, emoji_idx = util.get_emojis_list(tweets['emoji'])
+
+    for encoding in ['onehot', 'index']:
+        gen = util.convert_tweet_to_xy_generator(tweets, batch_size=4, emoji_set=emojis,
+                                                 encoding=encoding)
+        cache_gen = util.convert_tweet_to_xy_generator(cache, batch_size=4, emoji_set=emojis,
+                                                       encoding=encoding)
+        for _ in range(3):
+            ([x, x_emoji], y) = next(gen)
+            ([x_cache, x_emoji_cache], y_cache) = next(cache_gen)
+            assert np.array_equal(x, x_cache)
+            assert np.array_equal(x_emoji, x_emoji_cache)
+            assert np.array_equal(y, y_cache)
+
+        ([emoj, x], y) = s2s_util.get_index_xy_batch(tweets, slice(0, len(tweets)),
+                                                     emoji_indices=emoji_idx)
+        ([emoj_cache, x_cache], y_cache) = s2s_util.get_index_xy_batch(
+            cache, slice(0, len(cache)), emoji_indices=emoji_idx)
+        assert np.array_equal(x, x_cache)
+        assert np.array_equal(y, y_cache)
+        assert np.array_equal(emoj, emoj_cache)
+
+    ([emoj, x], y) = next(s2s_util.xy_generator(cache, batch_size=len(cache),
+                                                emoji_indices=emoji_idx))
+    ([emoj_ref, x_ref], y_ref) = next(s2s_util.xy_generator(tweets, batch_size=len(tweets),
+                                                            emoji_indices=emoji_idx))
+    assert np.array_equal(x, x_ref)
+    assert np.array_equal(y, y_ref)
+    assert np.array_equal(emoj, emoj_ref)
+
+
+def test_cache_rebuilds_when_stale(tmp_path, monkeypatch):
+    path = str(tmp_path / 'a.csv')
+    write_tweets_csv(path)
+    cache_dir = str(tmp_path / 'cache')
+
+    assert not cache_util.is_cache_fresh(cache_dir, [path], min_count=3)
+    cache_util.get_corpus_cache(path, cache_dir, min_count=3)
+    assert cache_util.is_cache_fresh(cache_dir, [path], min_count=3)
+
+    # filter parameters changed
+    assert not cache_util.is_cache_fresh(cache_dir, [path], min_count=1)
+    assert not cache_util.is_cache_fresh(cache_dir, [path], min_count=3, length=100)
+    assert len(cache_util.get_corpus_cache(path, cache_dir, min_count=1)) > 0
+    assert cache_util.get_corpus_cache(path, cache_dir, min_count=1).manifest['min_count'] == 1
+
+    # touched but unchanged source files don't need a rebuild, and are only hashed once
+    os.utime(path, (0, 0))
+    hashed = []
+    get_file_hash = cache_util.get_file_hash
+    monkeypatch.setattr(cache_util, 'get_file_hash',
+                        lambda path: hashed.append(path) or get_file_hash(path))
+    assert cache_util.is_cache_fresh(cache_dir, [path], min_count=1)
+    assert cache_util.is_cache_fresh(cache_dir, [path], min_count=1)
+    assert hashed == [path]
+    assert cache_util.load_corpus_cache(cache_dir).manifest['sources'][0]['mtime'] == 0
+    monkeypatch.undo()
+
+    # changed source files do
+    n_tweets = len(cache_util.load_corpus_cache(cache_dir))
+    write_tweets_csv(path, n_repeats=8)
+    assert not cache_util.is_cache_fresh(cache_dir, [path], min_count=1)
+    assert len(cache_util.get_corpus_cache(path, cache_dir, min_count=1)) == n_tweets * 2
+
+
+def test_cache_splits_are_saved_and_match_dataframe_splits(tmp_path):
+    path = str(tmp_path / 'a.csv')
+    tweets = pd.DataFrame({'text': ['tweet number {} @someone'.format(i) for i in range(500)],
+                           'emoji': [[':fire:', ':rainbow:'][i % 3 // 2] for i in range(500)]})
+    tweets.to_csv(path, index=False)
+    cache_dir = str(tmp_path / 'cache')
+    cache = cache_util.get_corpus_cache(path, cache_dir, min_count=3)
+    tweets = get_filtered_tweets([path], min_count=3)
+    splits = (('train', 0.5), ('dev', 0.25), ('test', 0.25))
+
+    splits_path = os.path.join(cache_dir, cache_util.SPLITS_FILE)
+    assert not os.path.exists(splits_path)
+    for name, _ in splits:
+        split = cache.get_split(name, splits=splits)
+        expected = util.select_split(tweets, name, splits=splits)
+        assert len(split) == len(expected) and len(split) > 50
+        assert split.get_tweets().equals(expected)
+
+    split_index, saved_splits = cache_util.load_split_index(splits_path)
+    assert saved_splits == [list(split) for split in splits]
+    assert np.array_equal(split_index['dev'], util.get_split_index(tweets, splits)['dev'])
+
+    # the generators read a split of the cache
+    emojis, emoji_idx = util.get_emojis_list(tweets['emoji'])
+    dev = util.select_split(tweets, 'dev')
+    ([emoj, x], y) = next(s2s_util.xy_generator(cache, batch_size=len(dev), split='dev',
+                                                emoji_indices=emoji_idx, encoding='index'))
+    ([emoj_ref, x_ref], y_ref) = next(s2s_util.xy_generator(
+        dev, batch_size=len(dev), emoji_indices=emoji_idx, encoding='index'))
+    assert np.array_equal(x, x_ref) and np.array_equal(emoj, emoj_ref)
+
+    # other splits replace the saved index, and rebuilding the cache removes it
+    assert len(cache.get_split('train', splits=splits)) < len(cache.get_split('train'))
+    assert cache_util.load_split_index(splits_path)[1][0] == ['train', 0.9]
+    cache_util.build_corpus_cache([path], cache_dir, min_count=1)
+    assert not os.path.exists(splits_path)
+
+
+def test_cache_splits_of_tweets_longer_than_the_cache(tmp_path):
+    """ tweets longer than the cache's length are hashed whole, the same as in a DataFrame, so
+    truncating them doesn't move them into another split """
+    path = str(tmp_path / 'a.csv')
+    pd.DataFrame({'text': ['{} {}'.format(i, 'x' * 200) for i in range(400)],
+                  'emoji': [':fire:'] * 400}).to_csv(path, index=False)
+    cache = cache_util.get_corpus_cache(path, str(tmp_path / 'cache'), min_count=3, length=160)
+    tweets = get_filtered_tweets([path], min_count=3)
+
+    split_index = util.get_split_index(tweets)
+    for name, rows in cache.get_split_index().items():
+        assert np.array_equal(rows, split_index[name])
+    assert cache.get_split('test').get_tweets().equals(
+        util.select_split(tweets, 'test').assign(text=lambda df: df['text'].str[0:160]))
+
+
+def test_convert_tweet_to_xy_memmap_reads_cache(tmp_path):
+    path = str(tmp_path / 'a.csv')
+    write_tweets_csv(path)
+    cache = cache_util.get_corpus_cache(path, str(tmp_path / 'cache'), min_count=3)
+    tweets = get_filtered_tweets([path], min_count=3)
+
+    x_ref, y_ref = util.convert_tweet_to_xy(tweets, dtype=np.bool_)
+    x, y = util.convert_tweet_to_xy_memmap(cache, str(tmp_path / 'x.npy'),
+                                           str(tmp_path / 'y.npy'), dtype=np.bool_, chunksize=5)
+    assert np.array_equal(x, x_ref)
+    assert np.array_equal(y, y_ref)
@@ -1,6 +1,7 @@
 """ Test file for functions that import/preprocess twitter data for the seq2seq model"""
 
 
+import pytest
 import pandas as pd
 import numpy as np
 import data_load_seq2seq_utils as s2s_util
@@ -85,3 +86,208 @@ def test_emoji_gen():
     # check each row of emoji array sums to exactly one
     for m in range(emoj.shape[0]):
         assert np.sum(emoj[m, :]) == 1
+
+
+def test_xy_generator_index_round_trips():
+    """ one-hot encoding the encoding='index' batches gives back the dense batches """
+
+    my_dict = {'text':
+               ["red and yellow and pink and green, orange and purple and blue, I can sing a rainbow, sing a rainbow, sing a rainbow too",
+                "sweet dreams are made of this, who am I to disagree, travel the world and the even seas, every body's looking for someone",
+                "short"],
+               'emoji':
+               [":rainbow:",
+                ":gay_pride_flag:",
+                ":rainbow:"]}
+    my_data = pd.DataFrame(my_dict)
+    chars, _ = s2s_util.get_universal_chars_list()
+    emojis, emoji_idx = util.get_emojis_list(my_data['emoji'])
+
+    gen = s2s_util.xy_generator(my_data, batch_size=3, emoji_indices=emoji_idx)
+    index_gen = s2s_util.xy_generator(my_data, batch_size=3, emoji_indices=emoji_idx,
+                                      encoding='index')
+
+    ([emoj, x], y) = next(gen)
+    ([emoj_index, x_index], y_index) = next(index_gen)
+
+    assert x_index.shape == x.shape[0:2]
+    assert y_index.shape == y.shape[0:2]
+    assert emoj_index.shape == emoj.shape[0:2]
+
+    # padding after the end of the tweet is blank, so it's masked out of the sparse targets
+    assert x_index[2, len('short\n')] == util.BLANK_CODE
+    assert y_index[2, len('short')] == util.BLANK_CODE
+
+    assert np.array_equal(util.one_hot_from_codes(x_index, len(chars)), x)
+    assert np.array_equal(util.one_hot_from_codes(y_index, len(chars)), y)
+    assert np.array_equal(util.one_hot_from_codes(emoj_index, len(emojis)), emoj)
+
+    # the index generator keeps looping over the data
+    for _ in range(3):
+        next(index_gen)
+
+
+def test_xy_generator_dtype():
+    """ xy_generator returns one-hot arrays of the requested dtype """
+
+    my_dict = {'text': ["red and yellow and pink and green", "sweet dreams are made of this"],
+               'emoji': [":rainbow:", ":gay_pride_flag:"]}
+    my_data = pd.DataFrame(my_dict)
+    _, emoji_idx = util.get_emojis_list(my_data['emoji'])
+
+    ([emoj_ref, x_ref], y_ref) = next(s2s_util.xy_generator(my_data, batch_size=2,
+                                                            emoji_indices=emoji_idx))
+    ([emoj, x], y) = next(s2s_util.xy_generator(my_data, batch_size=2, emoji_indices=emoji_idx,
+                                                dtype=np.uint8))
+
+    assert x.dtype == np.uint8 and y.dtype == np.uint8 and emoj.dtype == np.uint8
+    assert np.array_equal(x, x_ref)
+    assert np.array_equal(y, y_ref)
+    assert np.array_equal(emoj, emoj_ref)
+
+
+def test_get_xy_batch_writes_into_out():
+    """ random access batches are the same whether newly allocated or written into out """
+
+    my_dict = {'text': ["red and yellow and pink and green", "sweet dreams are made of this",
+                        "short", "a bit longer"],
+               'emoji': [":rainbow:", ":gay_pride_flag:", ":rainbow:", ":fire:"]}
+    my_data = pd.DataFrame(my_dict)
+    _, emoji_idx = util.get_emojis_list(my_data['emoji'])
+
+    for encoding in ['onehot', 'index']:
+        out = s2s_util.get_xy_batch(my_data, 0, batch_size=2, emoji_indices=emoji_idx,
+                                    encoding=encoding, dtype=np.bool_)
+        first = [arr.copy() for arr in util.flatten_batch(out)]
+
+        # the second batch has shorter tweets, so nothing may be left over from the first
+        second = s2s_util.get_xy_batch(my_data, 1, batch_size=2, emoji_indices=emoji_idx,
+                                       encoding=encoding, dtype=np.bool_)
+        written = s2s_util.get_xy_batch(my_data, 1, batch_size=2, emoji_indices=emoji_idx,
+                                        encoding=encoding, out=out)
+        assert written is out
+        for arr, out_arr in zip(util.flatten_batch(second), util.flatten_batch(out)):
+            assert np.array_equal(arr, out_arr)
+        assert not np.array_equal(first[1], util.flatten_batch(out)[1])
+
+
+def test_get_bucket_batches_groups_by_length():
+    lengths = np.array([5, 40, 161, 10, 33, 32, 100, 64])
+    batches = s2s_util.get_bucket_batches(lengths, buckets=[32, 64, 161], batch_size=2)
+    assert [(length, rows.tolist()) for length, rows in batches] == \
+        [(32, [0, 3]), (32, [5]), (64, [1, 4]), (64, [7]), (161, [2, 6])]
+
+    shuffled = s2s_util.get_bucket_batches(lengths, buckets=[32, 64, 161], batch_size=2,
+                                           rng=np.random.default_rng(0))
+    assert sorted(np.concatenate([rows for _, rows in shuffled]).tolist()) == list(range(8))
+    for length, rows in shuffled:
+        assert (lengths[rows] <= length).all()
+
+    assert s2s_util.get_buckets([20, 200, 64], sequence_length=161) == [20, 64, 161]
+
+
+def test_bucketed_xy_generator_matches_fixed_length_batches():
+    """ a bucketed batch is the fixed length batch of the same rows, cut to the bucket length """
+
+    my_dict = {'text': ["red and yellow and pink and green, orange and purple and blue",
+                        "short", "sweet dreams are made of this", "lol", "a bit longer"],
+               'emoji': [":rainbow:", ":fire:", ":gay_pride_flag:", ":fire:", ":rainbow:"]}
+    my_data = pd.DataFrame(my_dict)
+    _, emoji_idx = util.get_emojis_list(my_data['emoji'])
+
+    gen = s2s_util.bucketed_xy_generator(my_data, batch_size=2, buckets=[16, 32],
+                                         emoji_indices=emoji_idx, shuffle=False)
+    for length, rows in [(16, [1, 3]), (16, [4]), (32, [2]), (161, [0]), (16, [1, 3])]:
+        ([emoj, x], y, mask) = next(gen)
+        ([ref_emoj, ref_x], ref_y) = s2s_util.get_xy_for_rows(my_data, rows,
+                                                              emoji_indices=emoji_idx)
+        assert x.shape[1] == length and mask.shape == (len(rows), length)
+        assert np.array_equal(emoj, ref_emoj)
+        assert np.array_equal(x, ref_x[:, 0:length])
+        assert np.array_equal(y, ref_y[:, 0:length])
+        assert np.array_equal(mask.sum(axis=1), my_data['text'].str.len()[rows])
+
+    # xy_generator shuffles the buckets, and index batches are masked in the same positions
+    index_gen = s2s_util.xy_generator(my_data, batch_size=2, emoji_indices=emoji_idx,
+                                      encoding='index', buckets=[16, 32], seed=0)
+    epoch = [next(index_gen) for _ in range(4)]
+    assert sorted(len(y) for _, y, _ in epoch) == [1, 1, 1, 2]
+    for _, y_index, mask in epoch:
+        assert np.array_equal(mask, y_index >= 0)
+
+
+def test_xy_generator_buffers_do_not_leak():
+    """ each batch only holds its own tweets, even though the buffers are reused, and a batch
+    stays valid while fewer than buffers more batches have been yielded """
+
+    my_dict = {'text': ["red and yellow and pink and green, orange and purple and blue",
+                        "sweet dreams", "short", "a", "sing a rainbow, sing a rainbow too", ""],
+               'emoji': [":rainbow:", ":gay_pride_flag:", ":rainbow:", ":fire:", ":fire:",
+                         ":rainbow:"]}
+    my_data = pd.DataFrame(my_dict)
+    _, emoji_idx = util.get_emojis_list(my_data['emoji'])
+
+    def expected(batch_num):
+        return util.flatten_batch(s2s_util.get_xy_batch(my_data, batch_num % 6, batch_size=1,
+                                                        emoji_indices=emoji_idx))
+
+    for buffers in [1, 2, 3]:
+        gen = s2s_util.xy_generator(my_data, batch_size=1, emoji_indices=emoji_idx,
+                                    buffers=buffers)
+        held = []
+        for batch_num in range(14):  # more than two passes over the tweets
+            held = (held + [next(gen)])[-buffers:]
+            for i, batch in enumerate(reversed(held)):
+                for arr, ref in zip(util.flatten_batch(batch), expected(batch_num - i)):
+                    assert np.array_equal(arr, ref)
+
+        # the buffers are reused, not reallocated
+        assert len(set(id(batch[1]) for batch in held)) == buffers
+        assert next(gen)[1] is held[0][1]
+
+
+def test_xy_generator_batches_can_be_held_by_default():
+    """ a consumer that takes batches ahead of using them, as keras' GeneratorEnqueuer does,
+    gets correct batches from the default generator """
+
+    my_data = pd.DataFrame({'text': ["red and yellow", "sweet dreams", "short", "a", "sing"],
+                            'emoji': [":rainbow:", ":fire:", ":rainbow:", ":fire:", ":fire:"]})
+    _, emoji_idx = util.get_emojis_list(my_data['emoji'])
+    gen = s2s_util.xy_generator(my_data, batch_size=1, emoji_indices=emoji_idx)
+    held = [next(gen) for _ in range(12)]
+    for batch_num, batch in enumerate(held):
+        ref = s2s_util.get_xy_batch(my_data, batch_num % 5, batch_size=1,
+                                    emoji_indices=emoji_idx)
+        for arr, ref_arr in zip(util.flatten_batch(batch), util.flatten_batch(ref)):
+            assert np.array_equal(arr, ref_arr)
+
+
+def test_batch_buffer_pool_hands_over_ownership():
+    my_dict = {'text': ["red and yellow and pink and green", "sweet dreams are made of this",
+                        "short", "a bit longer"],
+               'emoji': [":rainbow:", ":gay_pride_flag:", ":rainbow:", ":fire:"]}
+    my_data = pd.DataFrame(my_dict)
+    _, emoji_idx = util.get_emojis_list(my_data['emoji'])
+    index_batches = [s2s_util.get_xy_batch(my_data, i, batch_size=1, emoji_indices=emoji_idx,
+                                           encoding='index') for i in range(4)]
+
+    pool = s2s_util.BatchBufferPool(index_batches[0], emoji_indices=emoji_idx, n_buffers=2,
+                                    dtype=np.uint8)
+    gen = s2s_util.xy_generator(my_data, batch_size=1, emoji_indices=emoji_idx, pool=pool)
+    first, second = next(gen), next(gen)
+    with pytest.raises(TimeoutError):
+        pool.encode(index_batches[2], timeout=0.01)
+
+    # a batch held by the consumer is never overwritten
+    pool.release(first)
+    third = next(gen)
+    for batch, index_batch in [(second, index_batches[1]), (third, index_batches[2])]:
+        for arr, ref in zip(util.flatten_batch(batch),
+                            util.flatten_batch(s2s_util.one_hot_batch(
+                                index_batch, emoji_indices=emoji_idx, dtype=np.uint8))):
+            assert np.array_equal(arr, ref)
+
+    # released buffers are cleared back to zero
+    pool.release(second)
+    pool.release(third)
+    assert not any(arr.any() for batch in pool.buffers for arr in util.flatten_batch(batch))
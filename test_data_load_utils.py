@@ -2,7 +2,10 @@
     for the neural network """
 
 import math
+import tracemalloc
+import numpy as np
 import pandas as pd
+import pytest
 import data_load_utils as util
 
 
@@ -244,3 +247,497 @@ def test_convert_tweet_to_xy_generator_emojis():
                     for i in range(5):
                         util.x_y_bool_array_to_sentence(x_text[i], y[i], chars, position=i) == util.pad_text(
                             my_dict['text'][0], length=160)[(i*s):(i*s)+w+1]
+
+
+def reference_x_bool_array(sentence, chars, char_index):
+    """ the original per-character loop, kept to check the vectorised encoder against """
+    text_x = np.zeros((len(sentence), len(sentence[0]), len(chars)), dtype=np.bool_)
+    for i, s in enumerate(sentence):
+        for pos, char in enumerate(s):
+            text_x[i, pos, char_index[char]] = 1
+    return text_x
+
+
+def reference_y_bool_array(next_chars, char_index):
+    """ the original per-character loop, kept to check the vectorised encoder against """
+    text_y = np.zeros((len(next_chars), len(char_index)), dtype=np.bool_)
+    for i in range(len(next_chars)):
+        text_y[i, char_index[next_chars[i]]] = 1
+    return text_y
+
+
+def test_vectorised_one_hot_matches_loops():
+    """ get_x_bool_array and get_y_bool_array give bit-for-bit the same arrays as the loops """
+
+    my_dict = {'text': "red and yellow and pink and green, orange and purple and blue, I can sing a rainbow, sing a rainbow £ too",
+               'emoji': ":rainbow:"}
+    chars, char_index = util.get_universal_chars_list()
+
+    for w in [1, 10, 40]:
+        for s in [1, 3, 7]:
+            series, next_chars = util.get_series_data_from_tweet(pd.Series(my_dict),
+                                                                 window_size=w,
+                                                                 step=s)
+            x = util.get_x_bool_array(series, chars, char_index)
+            y = util.get_y_bool_array(next_chars, char_index)
+            x_ref = reference_x_bool_array(series, chars, char_index)
+            y_ref = reference_y_bool_array(next_chars, char_index)
+
+            assert x.dtype == x_ref.dtype and x.shape == x_ref.shape
+            assert y.dtype == y_ref.dtype and y.shape == y_ref.shape
+            assert np.array_equal(x, x_ref)
+            assert np.array_equal(y, y_ref)
+
+
+def test_encode_char_codes_unknown_character_raises():
+    """ characters missing from the index raise KeyError, like the dict lookup did """
+    _, char_index = util.get_universal_chars_list()
+
+    with pytest.raises(KeyError):
+        util.encode_char_codes(['abc', 'a`c'], char_index)
+
+    with pytest.raises(KeyError):
+        util.encode_char_codes(['abc', 'a\U0001F308c'], char_index)
+
+
+def test_encode_char_codes_pads_short_strings_with_blanks():
+    chars, char_index = util.get_universal_chars_list()
+    codes = util.encode_char_codes(['abc', 'a'], char_index)
+
+    assert codes.shape == (2, 3)
+    assert list(codes[1, 1:]) == [util.BLANK_CODE] * 2
+
+    # blanks one-hot encode to all-zero rows
+    one_hot = util.one_hot_from_codes(codes, len(chars))
+    assert one_hot.shape == (2, 3, len(chars))
+    assert one_hot[1, 1:].sum() == 0
+    assert one_hot[0].sum() == 3
+
+
+def test_encode_char_codes_empty_input():
+    char_index = util.get_char_vocabulary()
+    # no sentences at all (an empty chunk or batch) used to fail in reshape
+    assert util.encode_char_codes([], char_index).shape == (0, 1)
+    assert util.encode_char_codes(['', ''], char_index).tolist() == [[util.BLANK_CODE]] * 2
+    assert char_index.decode_text(util.encode_char_codes(['a', ''], char_index)).tolist() == \
+        ['a', '']
+
+
+def test_convert_tweet_to_xy_generator_strided_matches():
+    """ the strided generator gives exactly the same batches as the window-by-window one """
+
+    my_dict = {'text':
+               ["red and yellow and pink and green, orange and purple and blue, I can sing a rainbow, sing a rainbow, sing a rainbow too",
+                "sweet dreams are made of this, who am I to disagree, travel the world and the even seas, every body's looking for someone",
+                "short one",
+                ""],
+               'emoji':
+               [":rainbow:",
+                ":gay_pride_flag:",
+                ":rainbow:",
+                ":fire:"]}
+    my_data = pd.DataFrame(my_dict)
+    emojis, _ = util.get_emojis_list(my_data['emoji'])
+
+    for t in [90, 160, 200]:
+        for w in [10, 40, 55]:
+            for s in [1, 3, 7]:
+                for emoji_set in [None, emojis]:
+                    gen = util.convert_tweet_to_xy_generator(my_data, length=t, window_size=w,
+                                                             step=s, batch_size=2,
+                                                             emoji_set=emoji_set)
+                    strided_gen = util.convert_tweet_to_xy_generator(my_data, length=t,
+                                                                     window_size=w, step=s,
+                                                                     batch_size=2,
+                                                                     emoji_set=emoji_set,
+                                                                     strided=True)
+                    for _ in range(2):
+                        (x, y) = next(gen)
+                        (x_strided, y_strided) = next(strided_gen)
+
+                        if emoji_set:
+                            assert np.array_equal(x[1], x_strided[1])
+                            x, x_strided = x[0], x_strided[0]
+
+                        assert x.dtype == x_strided.dtype
+                        assert np.array_equal(x, x_strided)
+                        assert np.array_equal(y, y_strided)
+
+
+def test_get_window_views_does_not_copy():
+    _, char_index = util.get_universal_chars_list()
+    codes = util.get_padded_codes(['some text', 'more text'], char_index, length=20)
+
+    x_view, y_view = util.get_window_views(codes, window_size=5, step=2)
+
+    assert x_view.shape == (2, 8, 5)
+    assert y_view.shape == (2, 8)
+    assert np.shares_memory(x_view, codes)
+    assert np.shares_memory(y_view, codes)
+
+
+def test_convert_tweet_to_xy_generator_index_round_trips():
+    """ one-hot encoding the encoding='index' batches gives back the dense batches """
+
+    my_dict = {'text':
+               ["red and yellow and pink and green, orange and purple and blue, I can sing a rainbow, sing a rainbow, sing a rainbow too",
+                "sweet dreams are made of this, who am I to disagree, travel the world and the even seas, every body's looking for someone"],
+               'emoji':
+               [":rainbow:",
+                ":gay_pride_flag:"]}
+    my_data = pd.DataFrame(my_dict)
+    chars, _ = util.get_universal_chars_list()
+    emojis, _ = util.get_emojis_list(my_data['emoji'])
+
+    for t, w, s in [(160, 40, 3), (90, 10, 2), (200, 55, 7)]:
+        gen = util.convert_tweet_to_xy_generator(my_data, length=t, window_size=w, step=s,
+                                                 batch_size=2, emoji_set=emojis)
+        index_gen = util.convert_tweet_to_xy_generator(my_data, length=t, window_size=w, step=s,
+                                                       batch_size=2, emoji_set=emojis,
+                                                       encoding='index')
+        ([x, x_emoji], y) = next(gen)
+        ([x_index, x_emoji_index], y_index) = next(index_gen)
+
+        assert x_index.dtype == np.int8
+        assert x_index.shape == x.shape[0:2]
+        assert y_index.shape == y.shape[0:1]
+        assert x_emoji_index.shape == x_emoji.shape[0:1]
+
+        assert np.array_equal(util.one_hot_from_codes(x_index, len(chars)), x)
+        assert np.array_equal(util.one_hot_from_codes(y_index, len(chars)), y)
+        assert np.array_equal(util.one_hot_from_codes(x_emoji_index, len(emojis)), x_emoji)
+
+
+def test_dtype_carries_through_to_batches():
+    """ convert_tweet_to_xy and convert_tweet_to_xy_generator return arrays of the requested
+    dtype, with the same values as the default float64 """
+
+    my_dict = {'text':
+               ["red and yellow and pink and green, orange and purple and blue, I can sing a rainbow, sing a rainbow, sing a rainbow too",
+                "sweet dreams are made of this, who am I to disagree, travel the world and the even seas, every body's looking for someone"],
+               'emoji':
+               [":rainbow:",
+                ":gay_pride_flag:"]}
+    my_data = pd.DataFrame(my_dict)
+    emojis, _ = util.get_emojis_list(my_data['emoji'])
+
+    x_ref, y_ref = util.convert_tweet_to_xy(my_data)
+    ([x_gen_ref, emoji_ref], y_gen_ref) = next(util.convert_tweet_to_xy_generator(
+        my_data, batch_size=2, emoji_set=emojis))
+    assert x_ref.dtype == np.float64
+
+    for dtype in [np.bool_, np.uint8, np.float16, np.float32]:
+        x, y = util.convert_tweet_to_xy(my_data, dtype=dtype)
+        assert x.dtype == dtype and y.dtype == dtype
+        assert np.array_equal(x, x_ref)
+        assert np.array_equal(y, y_ref)
+
+        for strided in [False, True]:
+            ([x_gen, x_emoji], y_gen) = next(util.convert_tweet_to_xy_generator(
+                my_data, batch_size=2, emoji_set=emojis, strided=strided, dtype=dtype))
+            assert x_gen.dtype == dtype and y_gen.dtype == dtype and x_emoji.dtype == dtype
+            assert np.array_equal(x_gen, x_gen_ref)
+            assert np.array_equal(y_gen, y_gen_ref)
+            assert np.array_equal(x_emoji, emoji_ref)
+
+
+def write_tweets_csv(path, n_repeats=4):
+    """ writes a small csv in the scraped format, with a repeated header row and extra columns """
+    tweets = pd.DataFrame({'line': range(6),
+                           'text': ["red and yellow and pink and green @someone",
+                                    "sweet dreams are made of this",
+                                    "text",
+                                    "sing a rainbow, sing a rainbow, sing a rainbow too",
+                                    "I`m an undesirable character",
+                                    "the only tweet with this emoji"],
+                           'emoji': [":rainbow:", ":fire:", "emoji", ":rainbow:", ":fire:",
+                                     ":ghost:"],
+                           'user': 'someone'})
+    pd.concat([tweets] * n_repeats).to_csv(path, index=False)
+
+
+def test_read_tweet_data_chunks_matches_read_tweet_data(tmp_path):
+    paths = [str(tmp_path / 'a.csv'), str(tmp_path / 'b.csv')]
+    write_tweets_csv(paths[0])
+    write_tweets_csv(paths[1], n_repeats=3)
+
+    tweets = pd.concat([util.read_tweet_data(path) for path in paths])
+    chunks = list(util.read_tweet_data_chunks(paths, chunksize=5))
+
+    assert len(chunks) > 2
+    assert all(list(chunk.columns) == ['text', 'emoji'] for chunk in chunks)
+    assert pd.concat(chunks).equals(tweets)
+
+    counts = util.get_emoji_counts(paths, chunksize=5)
+    assert counts.to_dict() == {':fire:': 14, ':ghost:': 7, ':rainbow:': 14}
+
+
+def test_read_filtered_tweet_chunks_matches_filters(tmp_path):
+    """ streaming the filters gives the same tweets, in the same order, as filtering it all """
+    paths = [str(tmp_path / 'a.csv'), str(tmp_path / 'b.csv')]
+    write_tweets_csv(paths[0])
+    write_tweets_csv(paths[1], n_repeats=3)
+
+    tweets = pd.concat([util.read_tweet_data(path) for path in paths])
+    tweets = util.filter_tweets_min_count(tweets, min_count=7)
+    tweets['text'] = util.filter_text_for_handles(tweets['text'])
+
+    streamed = pd.concat(util.read_filtered_tweet_chunks(paths, min_count=7, chunksize=4))
+
+    assert streamed.equals(tweets)
+    assert set(streamed['emoji']) == {':fire:', ':rainbow:'}
+
+
+def reference_filter_text_for_handles(text, chars=util.CHARACTERS):
+    """ the original Series.apply implementation of filter_text_for_handles """
+
+    def filter_handles(txt): return ' '.join(
+        word for word in txt.split(' ') if not word.startswith('@'))
+
+    def filter_chars(txt): return ''.join([c for c in txt if c in chars])
+
+    return text.apply(lambda txt: filter_chars(filter_handles(txt)))
+
+
+TRICKY_TEXTS = ['@handle at the start', 'at the end @handle', '@only', '@', ' @ ', '',
+                'two  spaces  @handle  here', '@one @two @three', 'a@b is not a handle',
+                'email@example.com and @x.', 'new\nline @handle\nwith newline',
+                '\U0001F308 emoji @\U0001F308 \U0001F308@', '  ', ' leading and trailing ',
+                'café £100 tab\tseparated @tab\thandle', 'I`m an undesirable character']
+
+
+def test_filter_text_for_handles_matches_original():
+    """ the regex normaliser gives exactly the same output as the original closures """
+    texts = pd.Series(TRICKY_TEXTS, name='text', index=range(10, 10 + len(TRICKY_TEXTS)))
+
+    for chars in [util.CHARACTERS, util.CHARACTERS.replace(' ', ''), 'abc-]^\\\\']:
+        filtered = util.filter_text_for_handles(texts, chars=chars)
+        reference = reference_filter_text_for_handles(texts, chars=chars)
+        assert list(filtered) == list(reference)
+        assert filtered.index.equals(reference.index)
+        assert filtered.name == reference.name
+
+
+def test_filter_text_for_handles_multiprocessing():
+    texts = pd.Series(TRICKY_TEXTS * 20, name='text')
+
+    filtered = util.filter_text_for_handles(texts, processes=2, chunksize=50)
+    assert list(filtered) == list(reference_filter_text_for_handles(texts))
+    assert filtered.index.equals(texts.index)
+
+
+def test_get_xy_batch_matches_generator():
+    """ random access batches are the generator's batches, with or without an out batch """
+
+    my_dict = {'text':
+               ["red and yellow and pink and green, orange and purple and blue, I can sing a rainbow, sing a rainbow, sing a rainbow too",
+                "sweet dreams are made of this, who am I to disagree, travel the world and the even seas, every body's looking for someone",
+                "short one",
+                ""],
+               'emoji':
+               [":rainbow:",
+                ":gay_pride_flag:",
+                ":rainbow:",
+                ":fire:"]}
+    my_data = pd.DataFrame(my_dict)
+    emojis, _ = util.get_emojis_list(my_data['emoji'])
+
+    for encoding in ['onehot', 'index']:
+        for emoji_set in [None, emojis]:
+            gen = util.convert_tweet_to_xy_generator(my_data, batch_size=2, emoji_set=emoji_set,
+                                                     encoding=encoding, dtype=np.uint8)
+            out = None
+            for batch_num in range(2):
+                batch = util.flatten_batch(next(gen))
+                fresh = util.get_xy_batch(my_data, batch_num, batch_size=2, emoji_set=emoji_set,
+                                          encoding=encoding, dtype=np.uint8)
+                if out is None:
+                    out = util.unflatten_batch([arr.copy() for arr in util.flatten_batch(fresh)],
+                                               fresh)
+                written = util.get_xy_batch(my_data, batch_num, batch_size=2,
+                                            emoji_set=emoji_set, encoding=encoding,
+                                            dtype=np.uint8, out=out)
+                assert written is out
+                for arr, fresh_arr, out_arr in zip(batch, util.flatten_batch(fresh),
+                                                   util.flatten_batch(out)):
+                    assert arr.dtype == fresh_arr.dtype == out_arr.dtype
+                    assert np.array_equal(arr, fresh_arr)
+                    assert np.array_equal(arr, out_arr)
+
+
+def test_vocabulary_matches_get_unique_chars_list():
+    """ the cached Vocabulary gives the same characters and indices as the original lists """
+    chars, char_index = util.get_unique_chars_list(util.CHARACTERS)
+    vocab = util.get_char_vocabulary(util.CHARACTERS)
+
+    assert list(vocab.tokens) == chars
+    assert dict(vocab) == char_index
+    assert util.get_char_vocabulary(util.CHARACTERS) is vocab  # memoised
+    assert util.get_universal_chars_list() == (chars, char_index)
+
+    emojis, emoji_index = util.get_emojis_list(pd.Series([':b:', ':a:', ':c:', ':a:']))
+    assert emoji_index == {':a:': 0, ':b:': 1, ':c:': 2}
+
+
+def test_vocabulary_is_immutable():
+    vocab = util.get_vocabulary([':a:', ':b:'])
+    with pytest.raises(AttributeError):
+        vocab.tokens = ()
+    with pytest.raises(TypeError):
+        vocab[':c:'] = 2
+    with pytest.raises(AssertionError):
+        vocab.lookup  # emoji tokens have no character lookup table
+    lookup = util.get_char_vocabulary().lookup
+    with pytest.raises(ValueError):
+        lookup[0] = 1
+
+
+def test_vocabulary_encode_decode_round_trips(tmp_path):
+    vocab = util.get_char_vocabulary()
+    texts = ['hello there', '', 'A,B;C!']
+
+    codes = vocab.encode_text(texts)
+    assert codes.shape == (3, 11)
+    assert codes[0, 0] == vocab['h'] and codes[1, 0] == util.BLANK_CODE
+    assert list(vocab.decode_text(codes)) == texts
+
+    emojis = util.get_vocabulary([':ghost:', ':fire:', ':rainbow:'])
+    emoji_codes = emojis.encode([[':fire:', ':ghost:'], [':rainbow:', ':fire:']])
+    assert emoji_codes.tolist() == [[1, 0], [2, 1]]
+    assert emojis.decode(emoji_codes).tolist() == [[':fire:', ':ghost:'], [':rainbow:', ':fire:']]
+    with pytest.raises(KeyError):
+        emojis.encode([':fire:', ':ice:'])
+    # the index behind encode is built once per vocabulary, not once per call
+    token_index = emojis._token_index
+    emojis.encode([':ghost:'])
+    assert token_index is not None and emojis._token_index is token_index
+
+    path = str(tmp_path / 'emojis.json')
+    emojis.save(path)
+    assert util.Vocabulary.load(path) is emojis
+    assert util.Vocabulary.from_json(vocab.to_json()) is vocab
+
+
+def test_split_assignment_is_stable():
+    """ a tweet's split depends only on its text and emoji, not on the rest of the corpus """
+
+    tweets = pd.DataFrame({'text': ['tweet number {}'.format(i) for i in range(2000)],
+                           'emoji': [[':fire:', ':rainbow:'][i % 2] for i in range(2000)]})
+    split_index = util.get_split_index(tweets)
+
+    assert sorted(np.concatenate(list(split_index.values()))) == list(range(2000))
+    assert all(rows.dtype == np.int32 for rows in split_index.values())
+    assert 1700 < len(split_index['train']) < 1900
+    assert 50 < len(split_index['dev']) < 150 and 50 < len(split_index['test']) < 150
+
+    # shuffling, dropping and appending tweets doesn't move any tweet to another split
+    changed = pd.concat([tweets.sample(frac=0.5, random_state=0),
+                         pd.DataFrame({'text': ['new tweet'], 'emoji': [':fire:']})],
+                        ignore_index=True)
+    for name in split_index:
+        dev = util.select_split(changed, name)
+        assert set(dev['text']) - {'new tweet'} <= set(tweets['text'].iloc[split_index[name]])
+
+    dev = util.select_split(tweets, 'dev', split_index=split_index)
+    assert dev.equals(util.select_split(tweets, 'dev'))
+    assert util.select_split(tweets, None) is tweets
+
+    # the generators train on one split only
+    batch_size = len(split_index['test'])
+    ([x, _], _) = next(util.convert_tweet_to_xy_generator(
+        tweets, batch_size=batch_size, emoji_set=[':fire:', ':rainbow:'], split='test',
+        encoding='index'))
+    ([x_ref, _], _) = next(util.convert_tweet_to_xy_generator(
+        tweets.iloc[split_index['test']], batch_size=batch_size,
+        emoji_set=[':fire:', ':rainbow:'], encoding='index'))
+    assert np.array_equal(x, x_ref)
+
+
+def get_many_emoji_tweets(n_tweets=3000, n_emojis=40, seed=0):
+    rng = np.random.default_rng(seed)
+    emojis = np.array([':emoji_{}:'.format(i) for i in range(n_emojis)], dtype=object)
+    words = np.array(['red', 'and', 'yellow', 'café', '@someone', 'lol!!', ''], dtype=object)
+    text = [' '.join(rng.choice(words, rng.integers(1, 8))) for _ in range(n_tweets)]
+    emoji = emojis[np.minimum(rng.geometric(0.1, n_tweets), n_emojis) - 1]
+    return pd.DataFrame({'text': text, 'emoji': emoji}, index=rng.permutation(n_tweets))
+
+
+def test_filter_tweets_min_count_matches_groupby_filter():
+    tweets = get_many_emoji_tweets()
+    tweets.loc[tweets.index[0:3], 'emoji'] = np.nan
+
+    for min_count in (0, 10, 100):
+        expected = tweets.groupby('emoji').filter(lambda c: len(c) > min_count)
+        assert util.filter_tweets_min_count(tweets, min_count=min_count).equals(expected)
+
+        stats = util.get_emoji_stats(tweets)
+        assert util.filter_tweets_min_count(tweets, min_count=min_count,
+                                            emoji_stats=stats).equals(expected)
+
+    # downsampling keeps a random max_per_emoji tweets of the bigger emojis, in order
+    capped = util.filter_tweets_min_count(tweets, min_count=10, max_per_emoji=50, seed=1)
+    counts = capped['emoji'].value_counts()
+    expected_counts = tweets['emoji'].value_counts()
+    expected_counts = np.minimum(expected_counts[expected_counts > 10], 50)
+    assert counts.sort_index().equals(expected_counts.sort_index())
+    assert list(capped.index) == [i for i in tweets.index if i in set(capped.index)]
+    assert not capped.equals(util.filter_tweets_min_count(tweets, min_count=10,
+                                                          max_per_emoji=50, seed=2))
+
+
+def test_get_emoji_stats():
+    tweets = get_many_emoji_tweets()
+    stats = util.get_emoji_stats(tweets, chunksize=700)
+
+    counts = tweets['emoji'].value_counts()
+    assert stats['count'].to_dict() == counts.to_dict()
+    assert (np.diff(stats['count']) <= 0).all()
+    lengths = tweets['text'].str.len().groupby(tweets['emoji']).mean()
+    assert np.allclose(stats['mean_length'], lengths[stats.index])
+
+    chars, _ = util.get_universal_chars_list()
+    for emoji in stats.index[0:3]:
+        text = ''.join(tweets['text'][tweets['emoji'] == emoji])
+        assert [stats.loc[emoji, char] for char in chars] == [text.count(char) for char in chars]
+
+    assert util.get_emoji_stats(tweets, chunksize=700, processes=2).equals(stats)
+
+
+def test_convert_tweet_to_xy_memmap_matches(tmp_path):
+    """ the out-of-core arrays are the same as convert_tweet_to_xy's for any chunk size """
+    my_data = pd.DataFrame({'text': ["red and yellow and pink and green, orange and purple",
+                                     "sweet dreams", "", "lol", "x" * 170],
+                            'emoji': [":rainbow:", ":fire:", ":fire:", ":ghost:", ":fire:"]})
+    x_path, y_path = str(tmp_path / 'x.npy'), str(tmp_path / 'y.npy')
+
+    for (t, w, s) in [(160, 40, 3), (50, 20, 7)]:
+        x_ref, y_ref = util.convert_tweet_to_xy(my_data, length=t, window_size=w, step=s,
+                                                dtype=np.uint8)
+        for chunksize in [1, 2, 5, 100]:
+            x, y = util.convert_tweet_to_xy_memmap(my_data, x_path, y_path, length=t,
+                                                   window_size=w, step=s, dtype=np.uint8,
+                                                   chunksize=chunksize)
+            assert isinstance(x, np.memmap) and x.dtype == np.uint8
+            assert np.array_equal(x, x_ref)
+            assert np.array_equal(y, y_ref)
+            assert np.array_equal(np.load(x_path), x_ref)
+
+
+def test_convert_tweet_to_xy_memmap_memory_is_constant(tmp_path):
+    """ the traced memory depends on the chunk size, not the number of tweets """
+    my_data = pd.DataFrame({'text': ["sing a rainbow, sing a rainbow too"] * 400,
+                            'emoji': [":rainbow:"] * 400})
+
+    peaks = []
+    for n_tweets in [100, 400]:
+        tracemalloc.start()
+        x, y = util.convert_tweet_to_xy_memmap(my_data.iloc[0:n_tweets], str(tmp_path / 'x.npy'),
+                                               str(tmp_path / 'y.npy'), chunksize=50)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        assert len(x) == n_tweets * 40
+        del x, y
+
+    # a chunk's float64 windows (50 * 40 * 40 * 93 * 8 bytes = 57 MB) go straight to the file
+    assert peaks[1] < 1.2 * peaks[0]
+    assert peaks[1] < 10 * 2**20
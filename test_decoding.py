@@ -0,0 +1,162 @@
+""" Test file for the decoding strategies """
+
+from itertools import product
+import numpy as np
+import data_load_seq2seq_utils as s2s_util
+import data_load_utils as util
+import decoding
+import generate
+import inference
+
+
+def test_sample_batch_temperature():
+    preds = np.tile([0.1, 0.2, 0.7], (4000, 1))
+
+    assert np.array_equal(decoding.sample_batch(preds, temperature=0), np.full(4000, 2))
+
+    counts = np.bincount(decoding.sample_batch(preds, temperature=1.0, rng=0), minlength=3)
+    assert np.allclose(counts / 4000, [0.1, 0.2, 0.7], atol=0.03)
+
+    # low temperatures sharpen the distribution, high ones flatten it
+    cold = np.bincount(decoding.sample_batch(preds, temperature=0.2, rng=0), minlength=3)
+    hot = np.bincount(decoding.sample_batch(preds, temperature=5.0, rng=0), minlength=3)
+    assert cold[2] > counts[2] > hot[2]
+
+    # one temperature per row
+    mixed = decoding.sample_batch(preds[0:2], temperature=[0, 1e-3], rng=0)
+    assert np.array_equal(mixed, [2, 2])
+
+
+def test_all_zero_rows_are_sampled_uniformly():
+    preds = np.zeros((3000, 4))
+    preds[0] = [0, 0, 1, 0]
+    for temperature in [1.0, 0.5, [0.5] * 3000]:
+        weights = decoding.reweight(preds, np.asarray(temperature))
+        assert np.isfinite(weights).all() and (weights[1:] == 1).all()
+        counts = np.bincount(decoding.sample_batch(preds[1:], temperature=temperature, rng=0),
+                             minlength=4)
+        assert np.allclose(counts / 2999, 0.25, atol=0.03)
+    assert decoding.sample_batch(preds[0:1], temperature=0.5, rng=0)[0] == 2
+
+
+def test_sample_batch_is_reproducible():
+    preds = np.random.default_rng(1).dirichlet(np.ones(10), size=50)
+    assert np.array_equal(decoding.sample_batch(preds, rng=3), decoding.sample_batch(preds, rng=3))
+
+
+def test_top_k_sampler_only_picks_top_k():
+    rng = np.random.default_rng(0)
+    preds = rng.dirichlet(np.ones(20), size=500)
+    rows = np.arange(500)
+    top_3 = np.argsort(-preds, axis=1)[:, 0:3]
+
+    samples = decoding.TopKSampler(k=3)(preds, rows, rng)
+    assert (samples[:, np.newaxis] == top_3).any(axis=1).all()
+    assert len(set(samples - top_3[:, 0])) > 1  # not just the most likely
+    assert np.array_equal(decoding.TopKSampler(k=1)(preds, rows, rng), preds.argmax(axis=1))
+
+
+def test_nucleus_sampler_keeps_top_p():
+    rng = np.random.default_rng(0)
+    preds = np.tile([0.05, 0.5, 0.15, 0.3], (4000, 1))
+    rows = np.arange(4000)
+
+    # 0.5 + 0.3 covers 0.8, so only those two can be drawn, in proportion 5:3
+    counts = np.bincount(decoding.NucleusSampler(top_p=0.8)(preds, rows, rng), minlength=4)
+    assert counts[0] == counts[2] == 0
+    assert np.allclose(counts[[1, 3]] / 4000, [0.625, 0.375], atol=0.03)
+
+    assert (decoding.NucleusSampler(top_p=0.1)(preds, rows, rng) == 1).all()
+    counts = np.bincount(decoding.NucleusSampler(top_p=1.0)(preds, rows, rng), minlength=4)
+    assert np.allclose(counts / 4000, preds[0], atol=0.03)
+
+
+def markov_step(transitions):
+    """ a step function for run_decoder where the next character only depends on the last """
+    def step(state, codes):
+        return transitions[codes], state
+    return step
+
+
+def brute_force_best(transitions, start, n_steps, stop_code, length_penalty):
+    """ the best score over every possible sequence, scored like BeamSearch """
+    best = -np.inf
+    for length in range(1, n_steps + 1):
+        for sequence in product(range(len(transitions)), repeat=length):
+            if stop_code in sequence[:-1] or (length < n_steps and sequence[-1] != stop_code):
+                continue
+            codes = (start,) + sequence
+            log_prob = sum(np.log(transitions[a, b]) for a, b in zip(codes[:-1], codes[1:]))
+            best = max(best, log_prob / length ** length_penalty)
+    return best
+
+
+def test_beam_search_finds_best_sequences():
+    rng = np.random.default_rng(0)
+    transitions = rng.dirichlet(np.ones(4), size=4)
+    start_codes = np.array([0, 1, 2, 3])
+    state = [np.zeros(4)]
+
+    for length_penalty in (0, 1.0):
+        # wide enough to be exhaustive
+        beam = decoding.BeamSearch(width=64, length_penalty=length_penalty)
+        codes, scores = beam.search(markov_step(transitions), state, start_codes, n_steps=4,
+                                    stop_code=3)
+        for start, score in zip(start_codes, scores):
+            assert np.isclose(score, brute_force_best(transitions, start, 4, 3, length_penalty))
+
+    # and the codes are the sequence that gives the score
+    for start, row, score in zip(start_codes, codes, scores):
+        sequence = [start] + [code for code in row if code != util.BLANK_CODE]
+        if len(sequence) < 5:
+            sequence.append(3)
+        log_prob = sum(np.log(transitions[a, b]) for a, b in zip(sequence[:-1], sequence[1:]))
+        assert np.isclose(log_prob / (len(sequence) - 1), score)
+
+
+def get_log_prob(model, emoji, text, max_length):
+    """ log probability of the seq2seq model generating text (and then a newline, if it's
+    shorter than max_length) for emoji, with teacher forcing """
+    _, vocab = s2s_util.get_universal_chars_list()
+    targets = vocab.encode_text([text + '\n' if len(text) <= max_length else text])[0]
+    inputs = np.concatenate([[vocab['\n']], targets[:-1]])
+    x = util.one_hot_from_codes(inputs[np.newaxis], len(vocab), dtype=np.float32)
+    probs, _, _ = model.decode([x] + model.encode(emoji[np.newaxis, np.newaxis]))
+    return np.log(probs[0, np.arange(len(targets)), targets]).sum()
+
+
+def test_beam_search_beats_greedy():
+    chars, _ = s2s_util.get_universal_chars_list()
+    model = inference.NumpySeq2Seq.random(n_emojis=5, n_chars=len(chars), units=16, scale=0.5,
+                                          rng=0)
+    emojis = np.eye(5, dtype=np.float32)
+    model.dense_weights[1][chars.index('\n')] += 2  # so some tweets stop before max_length
+
+    greedy = generate.decode_sequences(model.encode, model.decode, emojis, max_length=30)
+    assert sorted(len(text) for text in greedy) == [0, 1, 2, 31, 31]
+    greedy_scores = [get_log_prob(model, emoji, text, 30) for emoji, text in zip(emojis, greedy)]
+
+    for width in (1, 4):
+        beam = generate.decode_sequences(model.encode, model.decode, emojis, max_length=30,
+                                         strategy=decoding.BeamSearch(width=width,
+                                                                      length_penalty=0))
+        for emoji, text, greedy_score in zip(emojis, beam, greedy_scores):
+            assert get_log_prob(model, emoji, text, 30) >= greedy_score - 1e-4
+
+
+def test_strategies_plug_into_generate_text():
+    def model(windows):
+        # prefers the character after the last one in the window, then the one after that
+        last = windows[:, -1, :].argmax(axis=1)
+        preds = np.full(windows.shape[::2], 0.01, dtype=np.float32)
+        preds[np.arange(len(last)), (last + 1) % preds.shape[1]] = 0.6
+        preds[np.arange(len(last)), (last + 2) % preds.shape[1]] = 0.3
+        return preds / preds.sum(axis=1, keepdims=True)
+
+    vocab = util.get_char_vocabulary()
+    expected = ''.join(vocab.tokens[vocab['a'] + i] for i in range(1, 9))
+    for strategy in (decoding.GreedySampler(), decoding.TopKSampler(k=1),
+                     decoding.NucleusSampler(top_p=0.3), decoding.BeamSearch(width=3)):
+        generated = generate.generate_text(model, ['a', 'xa'], n_chars=8, window_size=4,
+                                           strategy=strategy, rng=0)
+        assert generated == [expected, expected]
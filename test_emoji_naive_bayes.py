@@ -0,0 +1,61 @@
+""" Test file for the streaming naive Bayes emoji classifier """
+
+import numpy as np
+import pandas as pd
+import pytest
+import data_load_utils as util
+
+pytest.importorskip('sklearn')
+import emoji_naive_bayes as nb  # noqa: E402
+from sklearn.naive_bayes import MultinomialNB  # noqa: E402
+
+
+def get_tweets(n_repeats=20):
+    my_dict = {'text': ["sing a rainbow, red and yellow and pink and green",
+                        "it's so hot today, this track is fire",
+                        "rainbow rainbow @someone colours",
+                        "fire emoji for this hot take",
+                        "sweet dreams"],
+               'emoji': ["🌈", "🔥", "🌈", "🔥", "😴"]}
+    return pd.concat([pd.DataFrame(my_dict)] * n_repeats, ignore_index=True)
+
+
+def test_streaming_training_matches_fitting_in_memory(tmp_path):
+    paths = [str(tmp_path / 'a.csv'), str(tmp_path / 'b.csv')]
+    tweets = get_tweets()
+    tweets.iloc[0:50].to_csv(paths[0], index=False)
+    tweets.iloc[50:].to_csv(paths[1], index=False)
+
+    classifier = nb.train_naive_bayes(paths, min_count=10, chunksize=7)
+    assert list(classifier.emojis) == sorted(['🌈', '🔥', '😴'])
+
+    # one fit over all of the filtered tweets gives the same model
+    filtered = util.filter_text_for_handles(tweets['text'])
+    model = MultinomialNB(alpha=classifier.model.alpha)
+    model.fit(classifier.transform(filtered), classifier.emojis.encode(tweets['emoji']))
+    assert np.allclose(classifier.model.feature_log_prob_, model.feature_log_prob_)
+    assert np.allclose(classifier.model.class_log_prior_, model.class_log_prior_)
+
+    assert list(classifier.predict(['a rainbow of colours', 'so hot'])) == ['🌈', '🔥']
+    assert classifier.score(filtered, tweets['emoji']) == 1.0
+
+    with pytest.raises(KeyError):
+        classifier.partial_fit(['text'], ['not an emoji'])
+
+
+def test_top_words_match_identity_prediction():
+    tweets = get_tweets(n_repeats=1)
+    classifier = nb.NaiveBayesEmojiClassifier(sorted(set(tweets['emoji'])))
+    classifier.partial_fit(tweets['text'], tweets['emoji'])
+
+    words = ['rainbow', 'fire', 'hot', 'dreams', 'sweet', 'and', 'this', 'colours', 'rainbow']
+    top = classifier.top_words(words, n=3)
+
+    # the notebook's way, predicting a one-hot row for each word
+    unique_words = list(dict.fromkeys(words))
+    word_pred = classifier.predict_proba(unique_words)
+    for i, emoji in enumerate(classifier.emojis):
+        expected = [unique_words[j] for j in np.argsort(-word_pred[:, i], kind='stable')[0:3]]
+        assert top[emoji] == expected
+    assert top['🌈'][0] in ('rainbow', 'colours')
+    assert len(classifier.top_words(words, n=100)['🔥']) == len(unique_words)
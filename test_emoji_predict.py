@@ -0,0 +1,99 @@
+""" Test file for the emoji prediction serving path """
+
+import threading
+import numpy as np
+import pytest
+import data_load_utils as util
+import emoji_predict
+import generate
+import inference
+
+pytest.importorskip('h5py')
+
+TEXTS = ['I can sing a rainbow, sing a rainbow, sing a rainbow too!!', 'sweet dreams',
+         'lol', '', 'hey @someone what a day', 'café \U0001F600 time']
+
+
+@pytest.fixture(scope='module')
+def model():
+    return inference.load_model(emoji_predict.EMOJI_MODEL)
+
+
+def test_classifier_matches_padded_windows(model):
+    classifier = emoji_predict.EmojiClassifier(model)
+
+    # the notebook way, every text filtered and padded to the whole window
+    windows = generate.get_seed_windows(util.normalise_texts(TEXTS), window_size=40)
+    expected = model.predict(windows)
+
+    assert np.allclose(classifier.predict_proba(TEXTS), expected, atol=1e-5)
+    # a batch of short texts is shorter, but gives the same predictions
+    assert classifier.encode(TEXTS[1:4]).shape == (3, 12)
+    assert np.allclose(classifier.predict_proba(TEXTS[1:4]), expected[1:4], atol=1e-5)
+
+
+def test_predict_returns_sorted_top_k(model):
+    labels = util.get_vocabulary(['e{}'.format(i) for i in range(93)])
+    classifier = emoji_predict.EmojiClassifier(model, labels=labels)
+    probs = classifier.predict_proba(TEXTS)
+
+    predicted = classifier.predict(TEXTS, top_k=5)
+    for row, text_probs in zip(predicted, probs):
+        expected = np.argsort(-text_probs, kind='stable')[0:5]
+        assert [emoji for emoji, _ in row] == ['e{}'.format(i) for i in expected]
+        assert np.allclose([prob for _, prob in row], text_probs[expected])
+
+    top_2 = emoji_predict.predict_emojis(TEXTS[0:2], top_k=2, classifier=classifier)
+    assert [[emoji for emoji, _ in row] for row in top_2] == \
+        [[emoji for emoji, _ in row[0:2]] for row in predicted[0:2]]
+    assert [len(row) for row in classifier.predict(TEXTS, top_k=200)] == [93] * len(TEXTS)
+    assert classifier.predict([]) == []
+
+
+def test_get_classifier_loads_saved_labels(tmp_path):
+    path = tmp_path / 'emoji_model.h5'
+    path.write_bytes(open(emoji_predict.EMOJI_MODEL, 'rb').read())
+    labels = util.get_vocabulary([':e{}:'.format(i) for i in range(93)])
+    labels.save(emoji_predict.get_labels_path(str(path)))
+
+    classifier = emoji_predict.get_classifier(str(path))
+    assert classifier is emoji_predict.get_classifier(str(path))
+    assert classifier.labels is labels
+    [[(emoji, _)]] = emoji_predict.predict_emojis(['sing a rainbow'], classifier=classifier)
+    assert emoji in labels
+
+
+def test_micro_batcher_batches_concurrent_requests():
+    batch_sizes = []
+
+    def predict_batch(items):
+        batch_sizes.append(len(items))
+        return [item * 2 for item in items]
+
+    with emoji_predict.MicroBatcher(predict_batch, max_batch_size=8, max_delay=0.05) as batcher:
+        futures = [batcher.submit(i) for i in range(20)]
+        assert [future.result() for future in futures] == [i * 2 for i in range(20)]
+
+        results = {}
+        threads = [threading.Thread(target=lambda i=i: results.update({i: batcher(i)}))
+                   for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == dict((i, i * 2) for i in range(10))
+
+    assert sum(batch_sizes) == 30 and max(batch_sizes) <= 8
+    assert len(batch_sizes) < 30
+
+    with pytest.raises(RuntimeError):
+        batcher.submit(1)
+
+
+def test_micro_batcher_passes_on_errors():
+    def predict_batch(items):
+        raise ValueError('bad batch')
+
+    with emoji_predict.MicroBatcher(predict_batch, max_delay=0) as batcher:
+        with pytest.raises(ValueError, match='bad batch'):
+            batcher('text')
@@ -0,0 +1,108 @@
+""" Test file for batched text generation, using stub models in place of the trained LSTMs """
+
+import numpy as np
+import data_load_seq2seq_utils as s2s_util
+import data_load_utils as util
+import generate
+import inference
+
+
+def oldest_char_model(windows):
+    """ stub model that always predicts the first character of its window, so generating from
+    a full window repeats the seed, as long as the windows are rolled along correctly """
+    return windows[:, 0, :] * 0.9 + 0.1 / windows.shape[2]
+
+
+def reference_generate(model, seed, n_chars, window_size):
+    """ the notebooks' one window at a time loop, with greedy sampling """
+    chars, char_index = util.get_universal_chars_list()
+    text = util.pad_text(seed, length=window_size)
+    generated = ''
+    for _ in range(n_chars):
+        sampled = np.zeros((1, window_size, len(chars)))
+        for t, char in enumerate(text):
+            sampled[0, t, char_index[char]] = 1
+        next_char = chars[np.argmax(model(sampled)[0])]
+        generated += next_char
+        text = text[1:] + next_char
+    return generated
+
+
+def test_generate_text_rolls_windows():
+    seeds = ['abcdefgh', 'hello', 'x' * 20]
+    generated = generate.generate_text(oldest_char_model, seeds, n_chars=20, temperature=0,
+                                       window_size=8)
+
+    assert generated[0] == 'abcdefgh' * 2 + 'abcd'
+    assert generated[1] == '   hello' * 2 + '   h'
+    assert generated[2] == 'x' * 20
+    for seed, text in zip(seeds, generated):
+        assert text == reference_generate(oldest_char_model, seed, 20, 8)
+
+
+def test_generate_text_with_emoji_input():
+    calls = []
+
+    def model(inputs):
+        window, emojis = inputs
+        calls.append(emojis.copy())
+        return oldest_char_model(window)
+
+    emojis = np.eye(2)
+    generated = generate.generate_text(model, ['ab', 'cd'], n_chars=4, temperature=0,
+                                       window_size=2, emojis=emojis)
+    assert generated == ['abab', 'cdcd']
+    assert len(calls) == 4 and np.array_equal(calls[0], emojis)
+
+
+def reference_decode_sequence(model, emoji_one_hot, max_length):
+    """ decode_sequence from the seq2seq notebook, one tweet at a time """
+    chars, char_index = s2s_util.get_universal_chars_list()
+    states_value = model.encode(emoji_one_hot[np.newaxis, np.newaxis, :])
+    target_seq = np.zeros((1, 1, len(chars)), dtype=np.float32)
+    target_seq[0, 0, char_index['\n']] = 1.
+
+    decoded_sentence = ''
+    while True:
+        output_tokens, h, c = model.decode([target_seq] + states_value)
+        sampled_char = chars[np.argmax(output_tokens[0, -1, :])]
+        decoded_sentence += sampled_char
+        if sampled_char == '\n' or len(decoded_sentence) > max_length:
+            break
+        target_seq = np.zeros((1, 1, len(chars)), dtype=np.float32)
+        target_seq[0, 0, char_index[sampled_char]] = 1.
+        states_value = [h, c]
+
+    return decoded_sentence.rstrip('\n')
+
+
+def test_decode_sequences_matches_one_at_a_time():
+    chars, _ = s2s_util.get_universal_chars_list()
+    model = inference.NumpySeq2Seq.random(n_emojis=5, n_chars=len(chars), units=16, scale=0.5,
+                                         rng=0)
+    emojis = np.eye(5)[[0, 1, 2, 3, 4, 2]]
+
+    decoded = generate.decode_sequences(model.encode, model.decode, emojis, max_length=30)
+    assert decoded == [reference_decode_sequence(model, emoji, 30) for emoji in emojis]
+
+
+def test_decode_sequences_drops_finished_tweets():
+    chars, char_index = s2s_util.get_universal_chars_list()
+    lengths = np.array([3, 0, 7, 200])
+    batch_sizes = []
+
+    def encoder(emojis):
+        # the state counts down the characters left to write
+        return [lengths[emojis[:, 0].argmax(axis=1)][:, np.newaxis].astype(float),
+                np.zeros((len(emojis), 1))]
+
+    def decoder(inputs):
+        x, h, c = inputs
+        batch_sizes.append(len(x))
+        codes = np.where(h[:, 0] > 0, char_index['a'], char_index['\n'])
+        return [util.one_hot_from_codes(codes[:, np.newaxis], len(chars)), h - 1, c]
+
+    decoded = generate.decode_sequences(encoder, decoder, np.eye(4), max_length=10)
+    assert decoded == ['aaa', '', 'aaaaaaa', 'a' * 11]
+    assert batch_sizes == [4, 3, 3, 3, 2, 2, 2, 2, 1, 1, 1]
+
@@ -0,0 +1,218 @@
+""" Test file for the asyncio generation service """
+
+import asyncio
+import time
+import numpy as np
+import pytest
+import generate
+import generation_service as gs
+import inference
+import state_cache
+
+JOINT_MODEL = 'models/text_emoji_joint_gen_model-0.840.hdf5'
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 60))
+
+
+def test_coalesced_requests_match_batch_decoding():
+    engine = gs.get_stub_engine(n_emojis=6, units=32, mean_length=20)
+
+    async def generate_all():
+        async with gs.GenerationService(engine, max_batch_size=8) as service:
+            results = await asyncio.gather(*[service.generate(str(i % 6), n=2, temperature=0,
+                                                              max_length=50)
+                                             for i in range(12)])
+            return results, service.stats()
+
+    results, stats = run(generate_all())
+
+    # greedy decoding doesn't depend on which sequences share a step
+    reference = generate.decode_sequences(engine.encode, engine.decode, np.eye(6),
+                                          max_length=50)
+    for i, tweets in enumerate(results):
+        assert tweets == [reference[i % 6][0:50]] * 2
+
+    # sequences joined the running batch as others finished, and steps were shared
+    lengths = [len(tweet) + (len(tweet) < 50) for tweets in results for tweet in tweets]
+    assert stats['sequence_steps'] == sum(lengths)
+    assert stats['steps'] < sum(lengths) / 4
+    assert 4 < stats['mean_batch_size'] <= 8
+    assert stats['completed'] == 12 and stats['chars'] == sum(map(len, sum(results, [])))
+
+
+def test_sampling_and_request_checks():
+    engine = gs.get_stub_engine(n_emojis=6, units=32)
+
+    async def generate_some():
+        async with gs.GenerationService(engine, max_batch_size=4, rng=0) as service:
+            tweets = await service.generate(2, n=4, temperature=1.0, max_length=30)
+            with pytest.raises(KeyError):
+                await service.generate('not an emoji')
+            with pytest.raises(KeyError):
+                await service.generate(6)
+            for bad_args in [{'n': 5}, {'n': 0}, {'n': 1.5}, {'n': True}, {'n': 'two'},
+                             {'temperature': -1}, {'temperature': 'nan'}, {'max_length': 'ten'},
+                             {'max_length': 0}, {'timeout': -1}, {'seed': 12}]:
+                with pytest.raises(ValueError):
+                    await service.generate('1', **bad_args)
+            # numbers from a request body may be strings
+            assert len((await service.generate('1', n='2', max_length='10', temperature='0',
+                                               timeout='30'))[1]) <= 10
+            return tweets
+
+    tweets = run(generate_some())
+    assert len(tweets) == 4 and len(set(tweets)) > 1
+    assert all(len(tweet) <= 30 and '\n' not in tweet for tweet in tweets)
+
+
+def test_seeds_and_state_cache():
+    engines = [gs.get_stub_engine(n_emojis=6, units=32, mean_length=1000),
+               gs.get_stub_engine(n_emojis=6, units=32, mean_length=1000,
+                                  cache=state_cache.StateCache())]
+
+    async def generate_seeded(engine):
+        async with gs.GenerationService(engine, rng=0) as service:
+            results = []
+            for _ in range(2):
+                results.append(await asyncio.gather(*[
+                    service.generate(emoji, temperature=0, max_length=30, seed=seed)
+                    for emoji, seed in [('1', 'i love '), ('1', None), ('2', 'i love ')]]))
+            with pytest.raises(KeyError):
+                await service.generate('1', seed='\u2603')
+            return results, service.stats()
+
+    (uncached, stats), (cached, cached_stats) = [run(generate_seeded(engine))
+                                                 for engine in engines]
+    assert uncached[0] == uncached[1] == cached[0] == cached[1]
+    assert uncached[0][0] != uncached[0][1]
+    assert 'cache' not in stats
+    # 2 encoder states, 2 seeded states and the first steps of the 3 (emoji, seed) pairs, the
+    # first steps all found again for the second round
+    assert cached_stats['cache']['entries'] == 7 and cached_stats['cache']['hits'] >= 3
+
+
+class SlowEngine:
+    """ wraps an engine, taking delay seconds for every step """
+
+    def __init__(self, engine, delay):
+        self.engine = engine
+        self.delay = delay
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+    def step(self, state, codes):
+        time.sleep(self.delay)
+        return self.engine.step(state, codes)
+
+
+def test_deadlines_and_backpressure():
+    engine = SlowEngine(gs.get_stub_engine(n_emojis=6, units=32, mean_length=1000), 0.01)
+
+    async def overload():
+        async with gs.GenerationService(engine, max_batch_size=1, max_queue=1) as service:
+            # a long request holds the only slot of the batch
+            first = asyncio.ensure_future(service.generate('0', max_length=1000, timeout=0.3))
+            await asyncio.sleep(0.05)
+            # the scheduler holds the next request until there is room, and one more is queued
+            queued = [asyncio.ensure_future(service.generate(emoji, max_length=5))
+                      for emoji in '12']
+            await asyncio.sleep(0.05)
+            assert service.stats()['queued'] == 1
+
+            # the queue is full, so this one can't even be queued
+            with pytest.raises(gs.ServiceBusy):
+                await service.generate('2', timeout=0.05)
+
+            with pytest.raises(asyncio.TimeoutError):
+                await first
+            # the first request's sequence is dropped, so the queued ones get to run
+            assert all(len(tweets[0]) <= 5 for tweets in await asyncio.gather(*queued))
+            return service.stats()
+
+    stats = run(overload())
+    assert stats['timeouts'] == 1 and stats['rejected'] == 1 and stats['completed'] == 2
+
+
+def test_engine_errors_fail_their_requests():
+    engine = gs.get_stub_engine(n_emojis=6, units=32)
+
+    class BrokenEngine(SlowEngine):
+        def step(self, state, codes):
+            raise ValueError('broken model')
+
+    async def generate_broken():
+        async with gs.GenerationService(BrokenEngine(engine, 0)) as service:
+            with pytest.raises(ValueError):
+                await service.generate('1')
+            service.engine = engine  # the service keeps going after a failed step
+
+            # predictions the sampler can't use fail outside the model call, and the
+            # service keeps going after those too
+            service.engine = BadPredictionsEngine(engine, 0)
+            with pytest.raises(ValueError):
+                await service.generate('1')
+            service.engine = engine
+            return await service.generate('1', max_length=10), service.stats()
+
+    class BadPredictionsEngine(SlowEngine):
+        def step(self, state, codes):
+            return np.zeros((len(codes), 0)), state
+
+    tweets, stats = run(generate_broken())
+    assert len(tweets) == 1 and stats['failed'] == 2 and stats['completed'] == 1
+
+
+def test_joint_engine_matches_generate_text():
+    model = inference.load_model(JOINT_MODEL)
+    engine = gs.JointEngine(model, seed='sing a rainbow')
+
+    async def generate_joint():
+        async with gs.GenerationService(engine) as service:
+            return await asyncio.gather(*[service.generate(emoji, temperature=0, max_length=12)
+                                          for emoji in ['0', '50', '110']])
+
+    results = run(generate_joint())
+    expected = generate.generate_text(model, ['sing a rainbow'] * 3, n_chars=12, temperature=0,
+                                      emojis=np.eye(111)[[0, 50, 110]])
+    assert [tweets[0] for tweets in results] == expected
+
+
+def test_http_server(tmp_path):
+    engine = gs.get_stub_engine(n_emojis=6, units=32)
+
+    async def requests():
+        async with gs.GenerationService(engine) as service:
+            server = await gs.serve(service, port=0)
+            port = server.sockets[0].getsockname()[1]
+            responses = [
+                await gs.post_generate({'emoji': '3', 'n': 2, 'max_length': 20}, port=port),
+                await gs.post_generate({'emoji': 'nope'}, port=port),
+                await gs.post_generate({'n': 1}, port=port),
+                await gs.post_generate({'emoji': '3', 'max_length': '10'}, port=port),
+                await gs.post_generate({'emoji': '3', 'max_length': 'x'}, port=port)]
+
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(b'GET /stats HTTP/1.1\r\n\r\n')
+            stats = await reader.read()
+            writer.close()
+            server.close()
+            await server.wait_closed()
+
+            unix_path = str(tmp_path / 'service.sock')
+            server = await gs.serve(service, path=unix_path)
+            responses.append(await gs.post_generate({'emoji': 1, 'max_length': 5},
+                                                    path=unix_path))
+            server.close()
+            await server.wait_closed()
+            return responses, stats
+
+    (ok, bad_emoji, missing, string_length, bad_length, unix), stats = run(requests())
+    assert ok[0] == 200 and len(ok[1]['tweets']) == 2
+    assert all(len(tweet) <= 20 for tweet in ok[1]['tweets'])
+    assert bad_emoji[0] == 400 and missing[0] == 400 and bad_length[0] == 400
+    assert string_length[0] == 200 and len(string_length[1]['tweets'][0]) <= 10
+    assert unix[0] == 200 and len(unix[1]['tweets'][0]) <= 5
+    assert stats.startswith(b'HTTP/1.1 200 OK') and b'"completed": 2' in stats
@@ -0,0 +1,172 @@
+""" Test file for the numpy inference runtime, checked against a slow float64 reimplementation
+    of the keras layers using the weights stored in the model files """
+
+import json
+import numpy as np
+import pytest
+import data_load_seq2seq_utils as s2s_util
+import data_load_utils as util
+import generate
+import inference
+
+h5py = pytest.importorskip('h5py')
+
+TWEET_GEN_MODEL = 'models/tweet_gen_model-0.776_1.hdf5'
+JOINT_MODEL = 'models/text_emoji_joint_gen_model-0.840.hdf5'
+EMOJI_MODEL = 'emoji_model-0.650.h5'
+SEEDS = ['I can sing a rainbow, sing a rainbow', 'sweet dreams are made of this', 'lol']
+
+
+def read_weights(path, layer):
+    with h5py.File(path, 'r') as f:
+        group = f['model_weights'][layer]
+        return [np.asarray(group[name], dtype=np.float64) for name in group.attrs['weight_names']]
+
+
+def reference_lstm(x, kernel, recurrent_kernel, bias):
+    """ keras 2.2 LSTM with hard_sigmoid gates, one sample and one gate at a time """
+    units = recurrent_kernel.shape[0]
+    gate = dict((name, slice(i * units, (i + 1) * units)) for i, name in enumerate('ifco'))
+
+    def hard_sigmoid(z):
+        return np.clip(0.2 * z + 0.5, 0, 1)
+
+    outputs = []
+    for sample in x:
+        h = np.zeros(units)
+        c = np.zeros(units)
+        for x_t in sample:
+            def z(name):
+                return x_t @ kernel[:, gate[name]] + h @ recurrent_kernel[:, gate[name]] + \
+                    bias[gate[name]]
+            i, f, o = hard_sigmoid(z('i')), hard_sigmoid(z('f')), hard_sigmoid(z('o'))
+            c = f * c + i * np.tanh(z('c'))
+            h = o * np.tanh(c)
+        outputs.append(h)
+    return np.array(outputs)
+
+
+def reference_softmax(z):
+    return np.exp(z) / np.exp(z).sum(axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize('path, lstm, dense', [(TWEET_GEN_MODEL, 'lstm_1', 'dense_1'),
+                                               (EMOJI_MODEL, 'lstm_2', 'dense_2')])
+def test_char_lstm_matches_reference(path, lstm, dense):
+    model = inference.load_model(path)
+    window_size = model.input_shape[1]
+    windows = generate.get_seed_windows(SEEDS, window_size=window_size)
+
+    h = reference_lstm(windows.astype(np.float64), *read_weights(path, lstm))
+    kernel, bias = read_weights(path, dense)
+    expected = reference_softmax(h @ kernel + bias)
+
+    preds = model.predict(windows)
+    assert preds.dtype == np.float32
+    assert preds.shape == (len(SEEDS), 93)
+    assert np.allclose(preds, expected, atol=1e-5)
+
+
+def test_joint_model_matches_reference():
+    model = inference.load_model(JOINT_MODEL)
+    assert model.input_shape == [(None, 64, 93), (None, 111)]
+    windows = generate.get_seed_windows(SEEDS, window_size=64)
+    emojis = np.eye(111, dtype=np.float32)[[0, 50, 110]]
+
+    text = reference_lstm(windows.astype(np.float64), *read_weights(JOINT_MODEL, 'text_lstm'))
+    emoji = np.maximum(emojis @ read_weights(JOINT_MODEL, 'emoji_dense_0')[0] +
+                       read_weights(JOINT_MODEL, 'emoji_dense_0')[1], 0)
+    emoji = np.maximum(emoji @ read_weights(JOINT_MODEL, 'emoji_dense_1')[0] +
+                       read_weights(JOINT_MODEL, 'emoji_dense_1')[1], 0)
+    kernel, bias = read_weights(JOINT_MODEL, 'output')
+    expected = reference_softmax(np.concatenate([text, emoji], axis=1) @ kernel + bias)
+
+    assert np.allclose(model.predict([windows, emojis]), expected, atol=1e-5)
+
+
+def test_loaded_models_generate_text():
+    model = generate.load_generator_model(TWEET_GEN_MODEL)
+    generated = generate.generate_text(model, SEEDS, n_chars=10, temperature=0)
+    assert [len(text) for text in generated] == [10] * 3
+
+    joint_model = generate.load_generator_model(JOINT_MODEL)
+    generated = generate.generate_text(joint_model, SEEDS, n_chars=10, temperature=0.5, rng=0,
+                                       emojis=np.eye(111)[0:3])
+    assert [len(text) for text in generated] == [10] * 3
+
+
+def write_seq2seq_model_file(path, model):
+    """ saves a NumpySeq2Seq in the layout keras 2 uses for the seq2seq notebook's model """
+    def layer(name, class_name, inbound, **config):
+        return {'name': name, 'class_name': class_name, 'config': dict(config, name=name),
+                'inbound_nodes': [[[node[0], 0, node[1], {}] for node in inbound]] if inbound
+                else []}
+
+    n_emojis, n_chars = model.encoder_weights[0].shape[0], model.decoder_weights[0].shape[0]
+    lstm_config = dict(units=model.units, activation='tanh', recurrent_activation='sigmoid',
+                       use_bias=True, go_backwards=False)
+    config = {'class_name': 'Model', 'config': {
+        'layers': [layer('input_1', 'InputLayer', [], batch_input_shape=[None, None, n_emojis]),
+                   layer('input_2', 'InputLayer', [], batch_input_shape=[None, None, n_chars]),
+                   layer('lstm_1', 'LSTM', [('input_1', 0)], return_sequences=False,
+                         return_state=True, **lstm_config),
+                   layer('lstm_2', 'LSTM', [('input_2', 0), ('lstm_1', 1), ('lstm_1', 2)],
+                         return_sequences=True, return_state=True, **lstm_config),
+                   layer('dense_1', 'Dense', [('lstm_2', 0)], activation='softmax',
+                         use_bias=True)],
+        'input_layers': [['input_1', 0, 0], ['input_2', 0, 0]],
+        'output_layers': [['dense_1', 0, 0]]}}
+
+    weights = {'lstm_1': model.encoder_weights, 'lstm_2': model.decoder_weights,
+               'dense_1': model.dense_weights}
+    with h5py.File(path, 'w') as f:
+        f.attrs['model_config'] = json.dumps(config)
+        group = f.create_group('model_weights')
+        # keras writes the names as fixed length byte strings
+        group.attrs['layer_names'] = np.array(['input_1', 'input_2', 'lstm_1', 'lstm_2',
+                                               'dense_1'], dtype='S')
+        for name in ('input_1', 'input_2'):
+            group.create_group(name).attrs['weight_names'] = np.array([], dtype='S1')
+        for name, layer_weights in weights.items():
+            names = ['{}/w{}:0'.format(name, i) for i in range(len(layer_weights))]
+            layer_group = group.create_group(name)
+            layer_group.attrs['weight_names'] = np.array(names, dtype='S')
+            for weight_name, weight in zip(names, layer_weights):
+                layer_group.create_dataset(weight_name, data=weight)
+
+    return config
+
+
+def test_load_seq2seq_round_trips(tmp_path):
+    chars, _ = s2s_util.get_universal_chars_list()
+    model = inference.NumpySeq2Seq.random(n_emojis=4, n_chars=len(chars), units=8, rng=0)
+    path = str(tmp_path / 'emoji_s2s.h5')
+    write_seq2seq_model_file(path, model)
+
+    loaded = inference.load_seq2seq(path)
+    emojis = np.eye(4, dtype=np.float32)
+    assert generate.decode_sequences(loaded.encode, loaded.decode, emojis, max_length=20) == \
+        generate.decode_sequences(model.encode, model.decode, emojis, max_length=20)
+
+    # the full training model runs too, with teacher forcing
+    x = util.one_hot_from_codes(np.zeros((4, 6), dtype=int), len(chars), dtype=np.float32)
+    probs, _, _ = model.decode([x] + model.encode(emojis[:, np.newaxis, :]))
+    full_model = inference.load_model(path)
+    assert np.allclose(full_model.predict([emojis[:, np.newaxis, :], x]), probs, atol=1e-6)
+
+
+def test_numpy_lstm_carries_state_between_calls():
+    chars, _ = s2s_util.get_universal_chars_list()
+    model = inference.NumpySeq2Seq.random(n_emojis=3, n_chars=len(chars), units=8, rng=1)
+    h, c = model.encode(np.eye(3)[:, np.newaxis, :])
+    x = util.one_hot_from_codes(np.random.default_rng(0).integers(0, len(chars), (3, 5)),
+                                len(chars), dtype=np.float32)
+
+    probs, h_all, c_all = model.decode([x, h, c])
+    assert probs.shape == (3, 5, len(chars))
+    assert np.allclose(probs.sum(axis=-1), 1)
+
+    for t in range(5):
+        step_probs, h, c = model.decode([x[:, t:t+1], h, c])
+        assert np.allclose(step_probs[:, 0], probs[:, t], atol=1e-6)
+    assert np.allclose(h, h_all, atol=1e-6) and np.allclose(c, c_all, atol=1e-6)
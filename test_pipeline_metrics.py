@@ -0,0 +1,129 @@
+""" Test file for the batch generator instrumentation """
+
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import data_load_seq2seq_utils as s2s_util
+import data_load_utils as util
+import pipeline_metrics
+
+
+def get_tweets():
+    my_dict = {'text': ["red and yellow and pink and green", "sweet dreams are made of this",
+                        "short", "a bit longer", "sing a rainbow", "lol"],
+               'emoji': [":rainbow:", ":gay_pride_flag:", ":rainbow:", ":fire:", ":fire:",
+                         ":rainbow:"]}
+    return pd.DataFrame(my_dict)
+
+
+def get_generators(tweets, metrics=None):
+    emojis, emoji_idx = util.get_emojis_list(tweets['emoji'])
+    return {
+        'window': util.convert_tweet_to_xy_generator(tweets, batch_size=2, emoji_set=emojis,
+                                                     metrics=metrics),
+        'strided': util.convert_tweet_to_xy_generator(tweets, batch_size=2, emoji_set=emojis,
+                                                      strided=True, metrics=metrics),
+        'window index': util.convert_tweet_to_xy_generator(tweets, batch_size=2,
+                                                           encoding='index', metrics=metrics),
+        'seq2seq': s2s_util.xy_generator(tweets, batch_size=2, emoji_indices=emoji_idx,
+                                         metrics=metrics),
+        'seq2seq buffers': s2s_util.xy_generator(tweets, batch_size=2, emoji_indices=emoji_idx,
+                                                 buffers=2, metrics=metrics),
+        'seq2seq index': s2s_util.xy_generator(tweets, batch_size=2, encoding='index',
+                                               metrics=metrics),
+        'bucketed': s2s_util.xy_generator(tweets, batch_size=2, emoji_indices=emoji_idx,
+                                          buckets=[16, 32], seed=0, metrics=metrics)}
+
+
+def test_generators_record_stages_without_changing_batches():
+    tweets = get_tweets()
+    expected_stages = {'window': {'slice', 'windows', 'one_hot', 'copy', 'emoji'},
+                       'strided': {'codes', 'one_hot', 'windows', 'copy', 'emoji'},
+                       'window index': {'index'},
+                       'seq2seq': {'codes', 'one_hot'},
+                       'seq2seq buffers': {'codes', 'one_hot', 'reset'},
+                       'seq2seq index': {'codes'},
+                       'bucketed': {'codes', 'mask', 'one_hot'}}
+
+    plain = get_generators(tweets)
+    for name in expected_stages:
+        metrics = pipeline_metrics.PipelineMetrics()
+        gen = get_generators(tweets, metrics=metrics)[name]
+        batch_bytes = 0
+        for _ in range(5):
+            batch = next(gen)
+            batch_bytes += sum(arr.nbytes for arr in util.flatten_batch(batch))
+            for arr, ref in zip(util.flatten_batch(batch), util.flatten_batch(next(plain[name]))):
+                assert np.array_equal(arr, ref), name
+
+        summary = metrics.summary()
+        assert summary['batches'] == 5
+        assert expected_stages[name] <= set(summary['stages']) <= expected_stages[name] | {'other'}
+        assert summary['batch_bytes'] == batch_bytes
+        stage_seconds = sum(seconds for seconds, _, _ in summary['stages'].values())
+        assert np.isclose(stage_seconds, summary['generator_seconds'])
+
+
+def test_consumer_time_and_report():
+    metrics = pipeline_metrics.PipelineMetrics()
+    gen = get_generators(get_tweets(), metrics=metrics)['strided']
+    for _ in range(3):
+        next(gen)
+        time.sleep(0.02)  # the model's training step
+    next(gen)
+
+    summary = metrics.summary()
+    assert summary['consumer_seconds'] >= 0.06
+    assert 0 < summary['generator_fraction'] < 1
+    assert summary['stages']['one_hot'][1] == 4
+    # the strided one-hot array is a (2, 160, chars) float64 array for each batch
+    assert summary['stages']['one_hot'][2] == 4 * 2 * 160 * 93 * 8
+
+    report = metrics.report()
+    assert '4 batches' in report and 'one_hot' in report and 'consumer' in report
+
+    metrics.reset()
+    assert metrics.summary()['batches'] == 0
+
+
+def test_traced_allocations():
+    """ stages writing into the generator's buffers allocate nothing, however much they write,
+    and only the generator is traced """
+    metrics = pipeline_metrics.PipelineMetrics(trace_allocations=True)
+    gen = get_generators(get_tweets(), metrics=metrics)['strided']
+    for _ in range(3):
+        next(gen)
+        assert not tracemalloc.is_tracing()
+
+    summary = metrics.summary()
+    allocated = summary['stage_allocated']
+    one_hot_bytes = 3 * 2 * 160 * 93 * 8
+    assert summary['stages']['one_hot'][2] == one_hot_bytes <= allocated['one_hot']
+    assert summary['stages']['copy'][2] > 10 * allocated['copy']
+    assert 'MB alloc/batch' in metrics.report()
+    assert 'stage_allocated' not in pipeline_metrics.PipelineMetrics().summary()
+
+
+def test_metrics_callback_separates_waiting_from_model_steps():
+    metrics = pipeline_metrics.PipelineMetrics()
+    gen = get_generators(get_tweets(), metrics=metrics)['seq2seq']
+    messages = []
+    callback = pipeline_metrics.MetricsCallback(metrics, log=messages.append)
+
+    # the calls keras makes for an epoch of fit_generator
+    for epoch in range(2):
+        callback.on_epoch_begin(epoch)
+        for step in range(3):
+            next(gen)
+            time.sleep(0.01)  # the data loading stall
+            callback.on_batch_begin(step)
+            time.sleep(0.02)
+            callback.on_batch_end(step)
+        callback.on_epoch_end(epoch)
+
+    assert [stats['steps'] for stats in callback.history] == [3, 3]
+    for stats in callback.history:
+        assert stats['step_seconds'] >= 0.06 and stats['wait_seconds'] >= 0.03
+        assert stats['generator_batches'] == 3 and stats['generator_seconds'] > 0
+    assert len(messages) == 2 and messages[1].startswith('epoch 1: 3 steps')
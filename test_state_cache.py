@@ -0,0 +1,170 @@
+""" Test file for the seq2seq state cache """
+
+import asyncio
+import numpy as np
+import pytest
+import generation_service as gs
+import inference
+import state_cache
+
+
+def test_lru_eviction_and_limits():
+    cache = state_cache.StateCache(max_entries=3, max_bytes=10 * 8)
+    arrays = [np.arange(2.0), np.arange(1.0)]  # 24 bytes
+
+    for key in 'abc':
+        cache.put(key, arrays)
+    assert len(cache) == 3 and cache.nbytes == 72
+    assert cache.get('a')[0].tolist() == [0.0, 1.0]
+
+    # 'b' is now the least recently used, and a fourth entry is over both limits
+    cache.put('d', arrays)
+    assert 'b' not in cache and len(cache) == 3
+
+    # a bigger entry evicts as many as it needs to fit in the bytes
+    cache.put('e', [np.zeros(6)])
+    assert list(cache.entries) == ['d', 'e'] and cache.nbytes == 72
+
+    # one that could never fit isn't stored, and doesn't evict anything
+    cache.put('f', [np.zeros(11)])
+    assert 'f' not in cache and len(cache) == 2
+
+    assert cache.get('b') is None
+    assert cache.stats() == {'entries': 2, 'bytes': 72, 'hits': 1, 'misses': 1,
+                             'evictions': 3, 'invalidations': 0, 'hit_rate': 0.5}
+
+
+def test_stored_arrays_are_read_only_copies():
+    cache = state_cache.StateCache()
+    h = np.zeros(4)
+    cache.put('a', [h])
+    h[0] = 1
+    assert cache.get('a')[0][0] == 0
+    with pytest.raises(ValueError):
+        cache.get('a')[0][0] = 1
+
+
+def test_invalidate_by_model():
+    cache = state_cache.StateCache()
+    for key in [('m1', 0, ''), ('m1', 1, 'hi'), ('m2', 0, '')]:
+        cache.put(key, [np.zeros(2)])
+    cache.invalidate('m1')
+    assert list(cache.entries) == [('m2', 0, '')] and cache.nbytes == 16
+    cache.invalidate()
+    assert len(cache) == 0 and cache.stats()['invalidations'] == 3
+
+
+def test_weights_fingerprint():
+    model = inference.NumpySeq2Seq.random(4, 6, units=8, rng=0)
+    fingerprint = state_cache.get_weights_fingerprint(model.encode, model.decode)
+    assert fingerprint == state_cache.get_weights_fingerprint(model, model)
+    assert fingerprint == state_cache.get_weights_fingerprint(
+        *[inference.NumpySeq2Seq.random(4, 6, units=8, rng=0).encode] * 2)
+    assert fingerprint != state_cache.get_weights_fingerprint(
+        *[inference.NumpySeq2Seq.random(4, 6, units=8, rng=1).encode] * 2)
+
+    model.dense_weights[1][0] += 1
+    assert fingerprint != state_cache.get_weights_fingerprint(model.encode, model.decode)
+
+    def function(inputs):
+        return inputs
+    assert state_cache.get_weights_fingerprint(function) == \
+        state_cache.get_weights_fingerprint(function)
+    assert state_cache.get_model_weights(function) is None
+
+
+def test_engine_states_from_the_cache():
+    cache = state_cache.StateCache()
+    engine = gs.get_stub_engine(n_emojis=6, units=16, cache=cache)
+    uncached = gs.get_stub_engine(n_emojis=6, units=16)
+    emoji_codes = np.array([0, 1, 1, 2, 0])
+    seeds = ['hi', 'hi', None, 'yo', '']
+
+    expected_state, expected_codes = uncached.start(emoji_codes, seeds)
+    for _ in range(2):
+        state, codes = engine.start(emoji_codes, seeds)
+        assert all(np.allclose(arr, expected) for arr, expected in zip(state, expected_state))
+        assert codes.tolist() == expected_codes.tolist() == engine.vocab.encode(
+            ['i', 'i', '\n', 'o', '\n']).tolist()
+
+    # the encoder states of emojis 0, 1 and 2, and the states after the seeds of the three
+    # (emoji, seed) pairs (all but the seed's last character, which is the first code)
+    assert len(cache) == 6 and (engine.fingerprint, 1, '\nh') in cache
+    # the second time round each distinct (emoji, seed) was found in the cache
+    assert cache.stats()['hits'] == 5
+
+    # the cached states are the decoder's after stepping over the newline and the seed
+    state = engine.get_states(np.array([0]), [''])
+    for char in '\nh':
+        _, state = engine.step(state, engine.vocab.encode([char]))
+    assert np.allclose(state[0], expected_state[0][0:1])
+
+
+def test_first_step_from_the_cache():
+    engine = gs.get_stub_engine(n_emojis=6, units=16, cache=state_cache.StateCache())
+    uncached = gs.get_stub_engine(n_emojis=6, units=16)
+    emoji_codes = np.array([0, 1, 1, 1, 0])
+    seeds = [None, None, 'hi', 'hi!', None]
+
+    expected_preds, expected_state = uncached.step(*uncached.start(emoji_codes, seeds))
+    for _ in range(2):
+        preds, state = engine.first_step(emoji_codes, seeds)
+        assert np.allclose(preds, expected_preds)
+        assert all(np.allclose(arr, expected) for arr, expected in zip(state, expected_state))
+
+    # the states after '\nhi' are shared by the first step of 'hi' and the prefix of 'hi!'
+    assert len(engine.cache.entries[(engine.fingerprint, 1, '\nhi')]) == 3
+
+    # with the cache warm, the first step doesn't run the models at all
+    calls = []
+    engine.encode = engine.decode = lambda inputs: calls.append(inputs)
+    preds, _ = engine.first_step(emoji_codes, seeds)
+    assert calls == [] and np.allclose(preds, expected_preds)
+
+
+def test_engine_invalidates_on_weight_changes():
+    cache = state_cache.StateCache()
+    engine = gs.get_stub_engine(n_emojis=6, units=16, cache=cache)
+    engine.start(np.array([0, 1]), ['hi', None])
+    assert len(cache) == 3 and not engine.check_weights()
+
+    model = engine.models[0].__self__
+    model.encoder_weights[2][:] += 0.5
+    assert engine.check_weights() and len(cache) == 0
+
+    state, _ = engine.start(np.array([0]))
+    expected = model.encode(np.eye(6, dtype=np.float32)[[[0]]])
+    assert np.allclose(state[0], expected[0]) and len(cache) == 1
+
+
+def test_service_notices_weight_changes():
+    engine = gs.get_stub_engine(n_emojis=6, units=16, mean_length=1000,
+                                cache=state_cache.StateCache())
+    model = engine.models[0].__self__
+
+    async def generate_twice(check_weights_every):
+        async with gs.GenerationService(engine, check_weights_every=check_weights_every) \
+                as service:
+            await service.generate('1', temperature=0, max_length=20, seed='hi')
+            model.encoder_weights[0][:] *= -1
+            await service.generate('1', temperature=0, max_length=20, seed='hi')
+            return service.stats()
+
+    def states_match_the_model():
+        uncached = gs.Seq2SeqEngine(model.encode, model.decode, engine.emojis.tokens,
+                                    vocab=engine.vocab)
+        state, _ = engine.start(np.array([1]), ['hi'])
+        expected, _ = uncached.start(np.array([1]), ['hi'])
+        return all(np.allclose(arr, ref) for arr, ref in zip(state, expected))
+
+    # rehashing before every new request notices the change by itself
+    stats = asyncio.run(generate_twice(0))
+    assert stats['weight_changes'] == 1 and stats['cache']['invalidations'] == 3
+    assert states_match_the_model()
+
+    # without the periodic check, the cached states are used until check_weights is called
+    invalidations = engine.cache.stats()['invalidations']
+    stats = asyncio.run(generate_twice(None))
+    assert stats['weight_changes'] == 0 and stats['cache']['invalidations'] == invalidations
+    assert not states_match_the_model()
+    assert engine.check_weights() and states_match_the_model()
@@ -0,0 +1,84 @@
+""" Test file for the random access tweet datasets """
+
+import numpy as np
+import pandas as pd
+import pytest
+import data_load_seq2seq_utils as s2s_util
+import data_load_utils as util
+from tweet_datasets import TweetWindowDataset, Seq2SeqDataset
+
+
+def get_tweets():
+    """ 10 distinct tweets, so each one can be identified from its encoding """
+    return pd.DataFrame({'text': ['tweet number {}'.format(i) * (i + 1) for i in range(10)],
+                         'emoji': [':rainbow:', ':fire:'] * 5})
+
+
+def test_unshuffled_window_dataset_matches_generator():
+    tweets = get_tweets()
+    emojis, _ = util.get_emojis_list(tweets['emoji'])
+    dataset = TweetWindowDataset(tweets, batch_size=4, emoji_set=emojis, shuffle=False)
+    gen = util.convert_tweet_to_xy_generator(tweets, batch_size=4, emoji_set=emojis)
+
+    assert len(dataset) == 3  # the last partial batch is kept
+    for batch_idx in range(2):
+        ([x, x_emoji], y) = dataset[batch_idx]
+        ([x_gen, x_emoji_gen], y_gen) = next(gen)
+        assert np.array_equal(x, x_gen)
+        assert np.array_equal(x_emoji, x_emoji_gen)
+        assert np.array_equal(y, y_gen)
+
+    # 2 tweets in the last batch, with 40 windows each
+    ([x, x_emoji], y) = dataset[2]
+    assert x.shape[0] == x_emoji.shape[0] == y.shape[0] == 2 * 40
+    assert np.array_equal(dataset[-1][1], y)
+
+    with pytest.raises(IndexError):
+        dataset[3]
+
+    assert len(TweetWindowDataset(tweets, batch_size=4, drop_last=True)) == 2
+
+
+def test_shuffled_dataset_covers_every_tweet_each_epoch():
+    tweets = get_tweets()
+    dataset = Seq2SeqDataset(tweets, batch_size=3, seed=42, encoding='index')
+
+    epochs = []
+    for _ in range(3):
+        rows = np.concatenate([dataset.get_rows(i) for i in range(len(dataset))])
+        assert sorted(rows) == list(range(10))
+        epochs.append(rows)
+
+        # batches hold the tweets in the rows of the permutation
+        for batch_idx in range(len(dataset)):
+            (x, y) = dataset[batch_idx]
+            (x_ref, y_ref) = s2s_util.get_xy_for_rows(tweets, dataset.get_rows(batch_idx),
+                                                      encoding='index')
+            assert np.array_equal(x, x_ref)
+            assert np.array_equal(y, y_ref)
+
+        dataset.on_epoch_end()
+
+    assert not np.array_equal(epochs[0], epochs[1])
+    assert dataset.epoch == 3
+
+
+def test_shuffled_dataset_resumes_deterministically():
+    """ a new dataset set to the same epoch gives the same batches, without replaying """
+    tweets = get_tweets()
+    dataset = Seq2SeqDataset(tweets, batch_size=4, seed=7, dtype=np.bool_)
+    for _ in range(2):
+        dataset.on_epoch_end()
+    (x, y) = dataset[1]
+
+    resumed = Seq2SeqDataset(tweets, batch_size=4, seed=7, dtype=np.bool_)
+    resumed.set_epoch(2)
+    (x_resumed, y_resumed) = resumed[1]
+
+    assert x.dtype == np.bool_
+    assert np.array_equal(x, x_resumed)
+    assert np.array_equal(y, y_resumed)
+
+    other_seed = Seq2SeqDataset(tweets, batch_size=4, seed=8)
+    other_seed.set_epoch(2)
+    assert not np.array_equal(other_seed.order, dataset.order)
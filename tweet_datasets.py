@@ -0,0 +1,108 @@
+""" Random access datasets over the tweets, following the keras.utils.Sequence interface, as
+    an alternative to the generators in data_load_utils and data_load_seq2seq_utils.
+
+    Batch i of an epoch can be fetched at any time with dataset[i], so batches can be loaded by
+    several workers at once and a run can resume part way through an epoch. The tweets are
+    reshuffled every epoch, with a permutation that depends only on the seed and the epoch. """
+
+from math import ceil
+import numpy as np
+import data_load_utils as util
+import data_load_seq2seq_utils as s2s_util
+
+try:
+    from keras.utils import Sequence
+except ImportError:  # keras is only needed to train on the datasets, not to read them
+    Sequence = object
+
+
+class TweetDataset(Sequence):
+    """ base class for batches of the rows of tweets, a pd.DataFrame or a CorpusCache loaded by
+    data_cache_utils. If shuffle is True the rows are permuted for each epoch using seed.
+    The last partial batch is returned as a smaller batch, unless drop_last is True.
+    Subclasses implement get_batch(rows) """
+
+    def __init__(self, tweets, batch_size=64, shuffle=True, seed=0, drop_last=False):
+        super().__init__()
+        self.tweets = tweets
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        self.set_epoch(0)
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.tweets) // self.batch_size
+        return int(ceil(len(self.tweets) / self.batch_size))
+
+    def __getitem__(self, batch_idx):
+        return self.get_batch(self.get_rows(batch_idx))
+
+    def get_rows(self, batch_idx):
+        """ the row numbers of the tweets in batch number batch_idx of the current epoch """
+        if batch_idx < 0:
+            batch_idx += len(self)
+        if not 0 <= batch_idx < len(self):
+            raise IndexError('batch {} out of range for {} batches'.format(batch_idx, len(self)))
+
+        rows = self.order[batch_idx*self.batch_size:(batch_idx+1)*self.batch_size]
+        if not self.shuffle:
+            return slice(rows[0], rows[-1] + 1)  # contiguous, so read without a gather
+        return rows
+
+    def get_batch(self, rows):
+        raise NotImplementedError
+
+    def set_epoch(self, epoch):
+        """ moves to epoch, eg. to resume training from a checkpoint """
+        self.epoch = epoch
+        if self.shuffle:
+            self.order = np.random.default_rng([self.seed, epoch]).permutation(len(self.tweets))
+        else:
+            self.order = np.arange(len(self.tweets))
+
+    def on_epoch_end(self):
+        """ called by keras at the end of each epoch, reshuffles the tweets for the next one """
+        self.set_epoch(self.epoch + 1)
+
+
+class TweetWindowDataset(TweetDataset):
+    """ random access equivalent of data_load_utils.convert_tweet_to_xy_generator. Batch i holds
+    the moving windows of batch_size tweets, in the same layout as the generator's batches """
+
+    def __init__(self, tweets, batch_size=64, length=160, window_size=40, step=3,
+                 emoji_set=None, encoding='onehot', dtype=np.float64,
+                 shuffle=True, seed=0, drop_last=False):
+        super().__init__(tweets, batch_size=batch_size, shuffle=shuffle, seed=seed,
+                         drop_last=drop_last)
+        self.length = length
+        self.window_size = window_size
+        self.step = step
+        self.emoji_set = emoji_set
+        self.encoding = encoding
+        self.dtype = dtype
+
+    def get_batch(self, rows):
+        return util.get_xy_for_rows(self.tweets, rows, length=self.length,
+                                    window_size=self.window_size, step=self.step,
+                                    emoji_set=self.emoji_set, encoding=self.encoding,
+                                    dtype=self.dtype)
+
+
+class Seq2SeqDataset(TweetDataset):
+    """ random access equivalent of data_load_seq2seq_utils.xy_generator """
+
+    def __init__(self, tweets, batch_size=64, sequence_length=161, emoji_indices=None,
+                 encoding='onehot', dtype=np.float64, shuffle=True, seed=0, drop_last=False):
+        super().__init__(tweets, batch_size=batch_size, shuffle=shuffle, seed=seed,
+                         drop_last=drop_last)
+        self.sequence_length = sequence_length
+        self.emoji_indices = emoji_indices
+        self.encoding = encoding
+        self.dtype = dtype
+
+    def get_batch(self, rows):
+        return s2s_util.get_xy_for_rows(self.tweets, rows, sequence_length=self.sequence_length,
+                                        emoji_indices=self.emoji_indices,
+                                        encoding=self.encoding, dtype=self.dtype)